@@ -1,6 +1,8 @@
-from flask import Flask, request, jsonify, send_file, render_template
+from flask import Flask, request, jsonify, send_file, render_template, Response, stream_with_context
 from flask_cors import CORS
 import os
+import json
+import atexit
 import uuid
 import threading
 import time
@@ -11,7 +13,12 @@ from video_processor import VideoProcessor
 from config import *
 
 # Import cache cleanup function
-from merge_videos import cleanup_old_cache_files
+from merge_videos import cleanup_old_cache_files, video_cache, mezzanine_cache, warm_segment_process_pool
+from audio_cache import audio_cache
+from pcm_cache import pcm_cache
+from encoder_registry import get_encoder_registry, is_gpu_acceleration_available
+from resource_scheduler import get_resource_scheduler
+from job_queue import JobQueue, QueueFullError
 
 # Add parent directory to path to import merge_videos and merge_video_audio
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -24,22 +31,127 @@ CORS(app)
 app.config['SECRET_KEY'] = SECRET_KEY
 app.config['DEBUG'] = DEBUG
 
+# Fork segment workers before any background threads start
+warm_segment_process_pool()
+
 # Initialize video processor
 video_processor = VideoProcessor(TEMP_FOLDER, OUTPUT_FOLDER)
 
 # Store batch status
 batch_status = {}
 
+# Background jobs share a bounded queue and a fixed pool of workers
+job_queue = JobQueue()
+job_queue.start()
+
+# Keep watched folders' catalog warm in the background
+catalog_watcher = None
+if ENABLE_FOLDER_WATCHER:
+    from folder_watcher import CatalogWatcher
+    catalog_watcher = CatalogWatcher()
+    catalog_watcher.start()
+    atexit.register(catalog_watcher.stop)
+    video_processor.watcher = catalog_watcher
+    for watch_folder in WATCH_VIDEO_FOLDERS:
+        if os.path.isdir(watch_folder):
+            catalog_watcher.watch(watch_folder, 'video')
+    for watch_folder in WATCH_AUDIO_FOLDERS:
+        if os.path.isdir(watch_folder):
+            catalog_watcher.watch(watch_folder, 'audio')
+
+# Probe encoder capabilities once in the background; lookups wait for the first probe
+encoder_registry = get_encoder_registry()
+threading.Thread(target=encoder_registry.refresh, name='encoder-probe', daemon=True).start()
+
 # Clean up old cache files on startup
 if ENABLE_CACHING:
     logging.info("Cleaning up old cache files...")
     cleanup_old_cache_files()
+    for cache in (audio_cache, pcm_cache):
+        try:
+            cache.cleanup_older_than(CLEANUP_CACHE_DAYS)
+        except Exception as e:
+            logging.warning(f"Error cleaning up {cache.name} files: {e}")
     logging.info("Cache cleanup completed")
 
+def enqueue_job(batch_id, job_type, process, message, on_reject=None):
+    """Queue a job's processing function and build the submit response; 429 when the queue is full."""
+    def mark_started():
+        batch_status[batch_id]['status'] = 'processing'
+    
+    try:
+        job_queue.submit(batch_id, job_type, process, on_start=mark_started)
+    except QueueFullError as e:
+        batch_status.pop(batch_id, None)
+        if on_reject:
+            on_reject()
+        return jsonify({'error': str(e)}), 429
+    
+    response = {'batch_id': batch_id, 'message': message}
+    response.update(job_queue.get_job_info(batch_id) or {})
+    return jsonify(response)
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
+def scan_media_response(data, kind, result_key):
+    """Build a full, paginated or streaming (NDJSON) scan response."""
+    folder_path = data['folder_path']
+    if not os.path.exists(folder_path):
+        return jsonify({'error': 'Folder does not exist'}), 400
+    
+    try:
+        offset = int(data.get('offset', 0))
+        limit = int(data['limit']) if data.get('limit') is not None else None
+        min_duration = float(data['min_duration']) if data.get('min_duration') is not None else None
+        max_duration = float(data['max_duration']) if data.get('max_duration') is not None else None
+    except (TypeError, ValueError):
+        return jsonify({'error': 'offset, limit, min_duration and max_duration must be numbers'}), 400
+    
+    if offset < 0 or (limit is not None and limit < 1):
+        return jsonify({'error': 'offset must be >= 0 and limit must be >= 1'}), 400
+    
+    recursive = data.get('recursive', False)
+    stream = data.get('stream', False)
+    if not isinstance(recursive, bool) or not isinstance(stream, bool):
+        return jsonify({'error': 'recursive and stream must be booleans'}), 400
+    
+    # Streaming mode: one JSON entry per line as each file is probed
+    if stream:
+        def generate():
+            count = 0
+            stats = video_processor.scanner.new_stats(kind)
+            for entry in video_processor.iter_scan_folder(folder_path, kind, recursive, min_duration, max_duration, stats):
+                count += 1
+                yield json.dumps(entry) + '\n'
+            yield json.dumps({'done': True, 'count': count, 'scan_stats': stats}) + '\n'
+        
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    
+    # Paginated/filtered mode
+    paginated = (limit is not None or offset or recursive or
+                 min_duration is not None or max_duration is not None)
+    if paginated:
+        page = video_processor.scan_folder_page(
+            folder_path, kind, offset, limit, recursive, min_duration, max_duration
+        )
+        return jsonify({
+            result_key: page['entries'],
+            'total': page['total'],
+            'offset': offset,
+            'limit': limit,
+            'next_offset': page['next_offset'],
+            'scan_stats': page['scan_stats']
+        })
+    
+    stats = video_processor.scanner.new_stats(kind)
+    if kind == 'audio':
+        entries = video_processor.scan_audio_folder(folder_path, stats)
+    else:
+        entries = video_processor.scan_folder(folder_path, stats)
+    return jsonify({result_key: entries, 'scan_stats': stats})
+
 @app.route('/api/scan-folder', methods=['POST'])
 def scan_folder():
     try:
@@ -47,12 +159,7 @@ def scan_folder():
         if not data or 'folder_path' not in data:
             return jsonify({'error': 'Missing folder_path'}), 400
         
-        folder_path = data['folder_path']
-        if not os.path.exists(folder_path):
-            return jsonify({'error': 'Folder does not exist'}), 400
-        
-        videos = video_processor.scan_folder(folder_path)
-        return jsonify({'videos': videos})
+        return scan_media_response(data, 'video', 'videos')
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -63,12 +170,23 @@ def scan_audio_folder():
         if not data or 'folder_path' not in data:
             return jsonify({'error': 'Missing folder_path'}), 400
         
-        folder_path = data['folder_path']
-        if not os.path.exists(folder_path):
-            return jsonify({'error': 'Folder does not exist'}), 400
+        return scan_media_response(data, 'audio', 'audios')
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/catalog/changes', methods=['GET'])
+def get_catalog_changes():
+    """Return watched-folder catalog changes since a given version."""
+    try:
+        if not catalog_watcher:
+            return jsonify({'error': 'Folder watcher is disabled'}), 400
+        
+        try:
+            since = int(request.args.get('since', 0))
+        except ValueError:
+            return jsonify({'error': 'since must be an integer'}), 400
         
-        audios = video_processor.scan_audio_folder(folder_path)
-        return jsonify({'audios': audios})
+        return jsonify(catalog_watcher.changes_since(since))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -105,6 +223,10 @@ def process_batch():
         # Validate video_trim_mode value
         if video_trim_mode not in ['fixed', 'random']:
             return jsonify({'error': 'video_trim_mode must be either "fixed" or "random"'}), 400
+        
+        merge_mode = data.get('merge_mode', DEFAULT_MERGE_MODE)
+        if merge_mode not in MERGE_MODES:
+            return jsonify({'error': f'merge_mode must be one of {list(MERGE_MODES)}'}), 400
             
         output_count = data.get('output_count')
         if output_count is None:
@@ -127,11 +249,12 @@ def process_batch():
         
         # Initialize batch status
         batch_status[batch_id] = {
-            'status': 'processing',
+            'status': 'queued',
             'progress': 0,
             'outputs': [],
             'error': None,
-            'output_folder_path': output_folder_path
+            'output_folder_path': output_folder_path,
+            'segment_stats': {}
         }
         
         # Start processing in background
@@ -144,7 +267,8 @@ def process_batch():
                         batch_status[batch_id]['message'] = message
                 
                 outputs = video_processor.process_batch(
-                    folder_path, video_count, video_duration, output_count, progress_callback, output_folder_path, video_trim_mode
+                    folder_path, video_count, video_duration, output_count, progress_callback, output_folder_path, video_trim_mode, merge_mode,
+                    stats=batch_status[batch_id]['segment_stats']
                 )
                 
                 batch_status[batch_id].update({
@@ -161,11 +285,7 @@ def process_batch():
                     'message': f'Error: {str(e)}'
                 })
         
-        thread = threading.Thread(target=process)
-        thread.daemon = True
-        thread.start()
-        
-        return jsonify({'batch_id': batch_id, 'message': 'Processing started'})
+        return enqueue_job(batch_id, 'batch', process, 'Processing started')
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -203,7 +323,7 @@ def process_video_audio_batch():
         
         # Initialize batch status
         batch_status[batch_id] = {
-            'status': 'processing',
+            'status': 'queued',
             'progress': 0,
             'outputs': [],
             'error': None,
@@ -237,11 +357,7 @@ def process_video_audio_batch():
                     'message': f'Error: {str(e)}'
                 })
         
-        thread = threading.Thread(target=process)
-        thread.daemon = True
-        thread.start()
-        
-        return jsonify({'batch_id': batch_id, 'message': 'Processing started'})
+        return enqueue_job(batch_id, 'video_audio_batch', process, 'Processing started')
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -287,7 +403,7 @@ def process_voice_adder():
         
         # Initialize batch status
         batch_status[batch_id] = {
-            'status': 'processing',
+            'status': 'queued',
             'progress': 0,
             'outputs': [],
             'error': None,
@@ -351,11 +467,12 @@ def process_voice_adder():
                 except Exception as cleanup_error:
                     logging.warning(f"Error cleaning up temp files after error: {cleanup_error}")
         
-        thread = threading.Thread(target=process)
-        thread.daemon = True
-        thread.start()
+        def remove_uploads():
+            for path in (video_path, audio_path):
+                if os.path.exists(path):
+                    os.remove(path)
         
-        return jsonify({'batch_id': batch_id, 'message': 'Processing started'})
+        return enqueue_job(batch_id, 'voice_adder', process, 'Processing started', on_reject=remove_uploads)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -395,7 +512,7 @@ def process_voice_batch():
         
         # Initialize batch status
         batch_status[batch_id] = {
-            'status': 'processing',
+            'status': 'queued',
             'progress': 0,
             'outputs': [],
             'error': None,
@@ -430,11 +547,7 @@ def process_voice_batch():
                     'message': f'Error: {str(e)}'
                 })
         
-        thread = threading.Thread(target=process)
-        thread.daemon = True
-        thread.start()
-        
-        return jsonify({'batch_id': batch_id, 'message': 'Batch processing started'})
+        return enqueue_job(batch_id, 'voice_batch', process, 'Batch processing started')
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -443,7 +556,9 @@ def get_status(batch_id):
     if batch_id not in batch_status:
         return jsonify({'error': 'Batch not found'}), 404
     
-    return jsonify(batch_status[batch_id])
+    status = dict(batch_status[batch_id])
+    status.update(job_queue.get_job_info(batch_id) or {})
+    return jsonify(status)
 
 @app.route('/api/download/<batch_id>/<filename>')
 def download_file(batch_id, filename):
@@ -467,21 +582,72 @@ def download_file(batch_id, filename):
 
 @app.route('/api/clear-cache', methods=['POST'])
 def clear_cache():
-    """Clear video cache to free up disk space."""
+    """Clear video cache to free up disk space. Pinned entries are kept."""
     try:
-        from merge_videos import cleanup_old_cache_files
-        import shutil
-        
-        # Force clean all cache files
-        cache_folder = VIDEO_CACHE_FOLDER
-        if os.path.exists(cache_folder):
-            shutil.rmtree(cache_folder)
-            os.makedirs(cache_folder, exist_ok=True)
-            
-        return jsonify({'success': True, 'message': 'Cache cleared successfully'})
+        removed = video_cache.clear() + mezzanine_cache.clear() + audio_cache.clear() + pcm_cache.clear()
+        
+        return jsonify({
+            'success': True,
+            'message': f'Cache cleared successfully ({removed} entries removed)',
+            'stats': video_cache.get_stats(),
+            'mezzanine_stats': mezzanine_cache.get_stats(),
+            'audio_stats': audio_cache.get_stats(),
+            'pcm_stats': pcm_cache.get_stats()
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/cache', methods=['GET'])
+def list_cache():
+    """List cache entries, most recently used first."""
+    try:
+        entries = video_cache.list_entries()
+        limit = request.args.get('limit', type=int)
+        if limit:
+            entries = entries[:limit]
+        return jsonify({'stats': video_cache.get_stats(), 'entries': entries})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """Report cache size and hit/miss/eviction counters."""
+    return jsonify({**video_cache.get_stats(), 'mezzanine': mezzanine_cache.get_stats(), 'audio': audio_cache.get_stats(), 'pcm': pcm_cache.get_stats()})
+
+@app.route('/api/cache/<key>/<action>', methods=['POST'])
+def manage_cache_entry(key, action):
+    """Pin, unpin or evict a single cache entry."""
+    try:
+        if action == 'pin':
+            done = video_cache.pin(key)
+        elif action == 'unpin':
+            done = video_cache.unpin(key)
+        elif action == 'evict':
+            force = request.args.get('force', '').lower() in ('1', 'true', 'yes')
+            done = video_cache.evict(key, force=force)
+        else:
+            return jsonify({'error': f'Unknown cache action: {action}'}), 400
+        
+        if not done and action == 'evict' and video_cache.is_leased(key):
+            return jsonify({'error': f'Cache entry {key} is in use by a running job'}), 409
+        if not done:
+            return jsonify({'error': f'Could not {action} cache entry {key}'}), 404
+        return jsonify({'success': True, 'key': key, 'action': action})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/queue', methods=['GET'])
+def get_queue():
+    """Report job queue occupancy."""
+    return jsonify(job_queue.get_stats())
+
+@app.route('/api/resources', methods=['GET'])
+def get_resources():
+    """Report the encode core budget and current thread reservations."""
+    return jsonify(get_resource_scheduler().get_allocations())
+
 @app.route('/api/system-info', methods=['GET'])
 def get_system_info():
     """Get system information for monitoring."""
@@ -493,17 +659,10 @@ def get_system_info():
         memory = psutil.virtual_memory()
         disk = psutil.disk_usage('/')
         
-        # Get cache information
-        cache_size = 0
-        cache_folder = VIDEO_CACHE_FOLDER
-        if os.path.exists(cache_folder):
-            for dirpath, dirnames, filenames in os.walk(cache_folder):
-                for f in filenames:
-                    fp = os.path.join(dirpath, f)
-                    cache_size += os.path.getsize(fp)
+        # Get cache information from the incremental size counter
+        cache_size = video_cache.total_bytes + mezzanine_cache.total_bytes + audio_cache.total_bytes + pcm_cache.total_bytes
         
         # Get GPU information
-        from merge_videos import is_gpu_acceleration_available
         gpu_available = is_gpu_acceleration_available()
         
         return jsonify({
@@ -548,6 +707,7 @@ def update_settings():
             
         if 'enable_gpu_acceleration' in data and isinstance(data['enable_gpu_acceleration'], bool):
             ENABLE_GPU_ACCELERATION = data['enable_gpu_acceleration']
+            encoder_registry.set_gpu_enabled(ENABLE_GPU_ACCELERATION)
         
         return jsonify({
             'success': True,
@@ -566,29 +726,15 @@ def update_settings():
 def get_gpu_info():
     """Get GPU information for monitoring."""
     try:
-        from merge_videos import is_gpu_acceleration_available
-        import subprocess
-        import shutil
-        
-        # Check if ffmpeg is available
-        ffmpeg_path = shutil.which('ffmpeg')
+        gpu_available = is_gpu_acceleration_available()
+        registry_info = encoder_registry.to_dict()
+        ffmpeg_path = registry_info['ffmpeg']['path']
         ffmpeg_info = {
             'available': ffmpeg_path is not None,
-            'path': ffmpeg_path if ffmpeg_path else 'Not found'
+            'path': ffmpeg_path if ffmpeg_path else 'Not found',
+            'version': registry_info['ffmpeg']['version'] or 'Unknown'
         }
         
-        # Get FFmpeg version if available
-        if ffmpeg_path:
-            try:
-                result = subprocess.run([ffmpeg_path, '-version'], capture_output=True, text=True)
-                version_line = result.stdout.split('\n')[0] if result.stdout else 'Unknown'
-                ffmpeg_info['version'] = version_line
-            except Exception as e:
-                ffmpeg_info['version'] = f'Error getting version: {str(e)}'
-        
-        # Check GPU acceleration
-        gpu_available = is_gpu_acceleration_available()
-        
         return jsonify({
             'gpu_acceleration_available': gpu_available,
             'gpu_acceleration_enabled': ENABLE_GPU_ACCELERATION,
@@ -600,6 +746,19 @@ def get_gpu_info():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/encoders', methods=['GET'])
+def get_encoders():
+    """List probed encoders and their tested status."""
+    return jsonify(encoder_registry.to_dict())
+
+@app.route('/api/encoders/refresh', methods=['POST'])
+def refresh_encoders():
+    """Re-probe encoders, clearing any marked unhealthy during jobs."""
+    try:
+        return jsonify(encoder_registry.refresh())
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/toggle-gpu', methods=['POST'])
 def toggle_gpu():
     """Toggle GPU acceleration on/off."""
@@ -609,6 +768,7 @@ def toggle_gpu():
         data = request.get_json()
         if data and 'enable_gpu' in data:
             ENABLE_GPU_ACCELERATION = bool(data['enable_gpu'])
+            encoder_registry.set_gpu_enabled(ENABLE_GPU_ACCELERATION)
             
         return jsonify({
             'success': True,
@@ -692,7 +852,6 @@ def get_logs():
         logger.info(f"CPU Codec: {FALLBACK_CPU_CODEC}")
         
         # Check GPU availability
-        from merge_videos import is_gpu_acceleration_available
         gpu_available = is_gpu_acceleration_available()
         logger.info(f"GPU Acceleration Available: {gpu_available}")
         if gpu_available:
@@ -0,0 +1,41 @@
+import math
+import hashlib
+import logging
+from config import *
+from cache_manager import CacheManager, get_source_identity
+from resource_scheduler import get_resource_scheduler
+from ffmpeg_engine import transcode_audio
+
+AAC_FRAME_SAMPLES = 1024  # Samples per AAC frame
+
+# AAC transcodes of library audio, muxed into outputs by packet copy
+audio_cache = CacheManager(AUDIO_CACHE_FOLDER, AUDIO_CACHE_MAX_BYTES, CACHE_EVICTION_POLICY, suffix='.m4a', name='audio cache')
+
+
+def get_audio_cache_key(audio_path):
+    """Generate a cache key from the source identity and the output audio format."""
+    hash_input = f"aac_{get_source_identity(audio_path)}_{AUDIO_SAMPLE_RATE}_{AUDIO_CHANNELS}_{AUDIO_BITRATE}"
+    return hashlib.md5(hash_input.encode()).hexdigest()
+
+
+def snap_to_aac_frame(seconds):
+    """Move a start time back to the nearest AAC frame boundary so a packet-copy trim starts on it."""
+    frame = AAC_FRAME_SAMPLES / AUDIO_SAMPLE_RATE
+    return math.floor(seconds / frame) * frame
+
+
+def get_cached_audio(audio_path):
+    """
+    Return (key, path) of the AAC transcode of audio_path, transcoding it on first use.
+    The entry is leased; call audio_cache.release(key) once the merge is done.
+    Raises FfmpegError if the transcode fails.
+    """
+    key = get_audio_cache_key(audio_path)
+    
+    def fill(temp_path):
+        logging.info(f"Transcoding {audio_path} to the audio cache")
+        with get_resource_scheduler().reserve('audio transcode', threads=1):
+            transcode_audio(audio_path, temp_path)
+        return True
+    
+    return key, audio_cache.get_or_fill(key, fill, lease=True)
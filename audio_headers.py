@@ -0,0 +1,307 @@
+import os
+import struct
+
+# MPEG audio bitrates in kbps, indexed by [version_group][layer][bitrate_index]
+# version_group 0 = MPEG-1, 1 = MPEG-2/2.5
+MP3_BITRATES = {
+    (0, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (0, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (0, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (1, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (1, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (1, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+
+# Sample rates indexed by MPEG version bits (3 = MPEG-1, 2 = MPEG-2, 0 = MPEG-2.5)
+MP3_SAMPLE_RATES = {
+    3: [44100, 48000, 32000],
+    2: [22050, 24000, 16000],
+    0: [11025, 12000, 8000],
+}
+
+MP3_SYNC_SEARCH_BYTES = 64 * 1024  # How far past the ID3 tag to look for the first frame
+MP3_CBR_CHECK_FRAMES = 32  # Frames sampled to decide whether a headerless file is CBR
+OGG_TAIL_BYTES = 64 * 1024  # Initial window searched for the last Ogg page
+
+
+class AudioHeaderError(Exception):
+    """Raised when an audio file's duration cannot be read from its headers."""
+
+
+def read_wav_info(file_path):
+    """Read duration and format from the RIFF header of a WAV file."""
+    file_size = os.path.getsize(file_path)
+    with open(file_path, 'rb') as f:
+        riff = f.read(12)
+        if len(riff) < 12 or riff[0:4] not in (b'RIFF', b'RF64') or riff[8:12] != b'WAVE':
+            raise AudioHeaderError("Not a RIFF/WAVE file")
+
+        fmt = None
+        data_size = None
+        ds64_data_size = None
+        offset = 12
+        while offset + 8 <= file_size:
+            f.seek(offset)
+            chunk_id, chunk_size = struct.unpack('<4sI', f.read(8))
+            if chunk_id == b'ds64':
+                ds64_data_size = struct.unpack('<QQ', f.read(16))[1]
+            elif chunk_id == b'fmt ':
+                fmt = struct.unpack('<HHIIHH', f.read(16))
+            elif chunk_id == b'data':
+                data_size = chunk_size
+                if chunk_size == 0xFFFFFFFF:
+                    data_size = ds64_data_size or (file_size - offset - 8)
+                # Streaming writers sometimes leave the size unset or too large
+                data_size = min(data_size, file_size - offset - 8)
+                break
+            offset += 8 + chunk_size + (chunk_size & 1)
+
+    if fmt is None or data_size is None:
+        raise AudioHeaderError("Missing fmt or data chunk")
+
+    _, channels, sample_rate, byte_rate, _, _ = fmt
+    if not byte_rate:
+        raise AudioHeaderError("Invalid WAV byte rate")
+
+    return {
+        'duration': data_size / byte_rate,
+        'sample_rate': sample_rate,
+        'channels': channels,
+        'codec': 'pcm'
+    }
+
+
+def _parse_mp3_header(header):
+    """Parse a 4-byte MPEG audio frame header, or return None if it is not one."""
+    if len(header) < 4 or header[0] != 0xFF or (header[1] & 0xE0) != 0xE0:
+        return None
+
+    version_bits = (header[1] >> 3) & 0x03
+    layer_bits = (header[1] >> 1) & 0x03
+    bitrate_index = (header[2] >> 4) & 0x0F
+    sample_rate_index = (header[2] >> 2) & 0x03
+    padding = (header[2] >> 1) & 0x01
+    channel_mode = (header[3] >> 6) & 0x03
+
+    if version_bits == 1 or layer_bits == 0 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+
+    layer = 4 - layer_bits
+    version_group = 0 if version_bits == 3 else 1
+    bitrate = MP3_BITRATES[(version_group, layer)][bitrate_index] * 1000
+    sample_rate = MP3_SAMPLE_RATES[version_bits][sample_rate_index]
+
+    if layer == 1:
+        samples_per_frame = 384
+        frame_length = (12 * bitrate // sample_rate + padding) * 4
+    elif layer == 2 or version_group == 0:
+        samples_per_frame = 1152
+        frame_length = 144 * bitrate // sample_rate + padding
+    else:
+        samples_per_frame = 576
+        frame_length = 72 * bitrate // sample_rate + padding
+
+    return {
+        'mpeg1': version_group == 0,
+        'layer': layer,
+        'bitrate': bitrate,
+        'sample_rate': sample_rate,
+        'channels': 1 if channel_mode == 3 else 2,
+        'samples_per_frame': samples_per_frame,
+        'frame_length': frame_length
+    }
+
+
+def _skip_id3v2(f):
+    """Return the offset of the first byte after an ID3v2 tag (0 if none)."""
+    f.seek(0)
+    header = f.read(10)
+    if len(header) == 10 and header[:3] == b'ID3':
+        size = (header[6] << 21) | (header[7] << 14) | (header[8] << 7) | header[9]
+        footer = 10 if header[5] & 0x10 else 0
+        return 10 + size + footer
+    return 0
+
+
+def _find_first_frame(f, start):
+    """Find the first frame header whose successor is also a valid frame."""
+    f.seek(start)
+    window = f.read(MP3_SYNC_SEARCH_BYTES)
+    index = window.find(b'\xff')
+    while index != -1 and index + 4 <= len(window):
+        frame = _parse_mp3_header(window[index:index + 4])
+        if frame:
+            next_index = index + frame['frame_length']
+            if next_index + 4 > len(window) or _parse_mp3_header(window[next_index:next_index + 4]):
+                return start + index, frame
+        index = window.find(b'\xff', index + 1)
+    raise AudioHeaderError("No MPEG audio frame found")
+
+
+def read_mp3_info(file_path):
+    """
+    Read the duration of an MP3 file from its Xing/Info or VBRI header.
+    Headerless files are treated as CBR when their first frames agree, otherwise frames are walked.
+    """
+    file_size = os.path.getsize(file_path)
+    with open(file_path, 'rb') as f:
+        frame_offset, frame = _find_first_frame(f, _skip_id3v2(f))
+        f.seek(frame_offset)
+        first_frame = f.read(max(frame['frame_length'], 4 + 32 + 18))
+
+        info = {
+            'sample_rate': frame['sample_rate'],
+            'channels': frame['channels'],
+            'codec': 'mp3'
+        }
+        seconds_per_frame = frame['samples_per_frame'] / frame['sample_rate']
+
+        # Xing/Info header sits right after the side information
+        if frame['mpeg1']:
+            side_info = 17 if frame['channels'] == 1 else 32
+        else:
+            side_info = 9 if frame['channels'] == 1 else 17
+        xing_offset = 4 + side_info
+        tag = first_frame[xing_offset:xing_offset + 4]
+        if tag in (b'Xing', b'Info'):
+            flags = struct.unpack('>I', first_frame[xing_offset + 4:xing_offset + 8])[0]
+            if flags & 0x01:
+                frames = struct.unpack('>I', first_frame[xing_offset + 8:xing_offset + 12])[0]
+                info['duration'] = frames * seconds_per_frame
+                return info
+
+        # VBRI header is always 32 bytes after the frame header
+        if first_frame[36:40] == b'VBRI':
+            frames = struct.unpack('>I', first_frame[50:54])[0]
+            info['duration'] = frames * seconds_per_frame
+            return info
+
+        # Exclude a trailing ID3v1 tag from the audio payload
+        audio_end = file_size
+        if file_size >= 128:
+            f.seek(file_size - 128)
+            if f.read(3) == b'TAG':
+                audio_end -= 128
+
+        # Sample the first frames; if the bitrate never changes assume CBR
+        offset = frame_offset
+        bitrates = set()
+        frames = 0
+        walk_all = False
+        while offset + 4 <= audio_end:
+            f.seek(offset)
+            current = _parse_mp3_header(f.read(4))
+            if not current:
+                break
+            bitrates.add(current['bitrate'])
+            frames += 1
+            offset += current['frame_length']
+            if not walk_all and frames >= MP3_CBR_CHECK_FRAMES:
+                if len(bitrates) == 1:
+                    info['duration'] = (audio_end - frame_offset) * 8 / frame['bitrate']
+                    return info
+                walk_all = True
+
+        if not frames:
+            raise AudioHeaderError("No MPEG audio frames found")
+        info['duration'] = frames * seconds_per_frame
+        return info
+
+
+def _parse_ogg_page_header(data, offset):
+    """Return (granule_position, serial, header_length, body_length) for the page at offset."""
+    if offset + 27 > len(data) or data[offset:offset + 4] != b'OggS' or data[offset + 4] != 0:
+        return None
+    granule, serial = struct.unpack_from('<qI', data, offset + 6)
+    segment_count = data[offset + 26]
+    if offset + 27 + segment_count > len(data):
+        return None
+    body_length = sum(data[offset + 27:offset + 27 + segment_count])
+    return granule, serial, 27 + segment_count, body_length
+
+
+def read_ogg_info(file_path):
+    """Read the duration of an Ogg Vorbis/Opus file from the last page's granule position."""
+    file_size = os.path.getsize(file_path)
+    with open(file_path, 'rb') as f:
+        head = f.read(4096)
+        first_page = _parse_ogg_page_header(head, 0)
+        if not first_page:
+            raise AudioHeaderError("Not an Ogg file")
+        _, serial, header_length, _ = first_page
+        packet = head[header_length:]
+
+        pre_skip = 0
+        if packet[:7] == b'\x01vorbis':
+            channels = packet[11]
+            sample_rate = struct.unpack_from('<I', packet, 12)[0]
+            codec = 'vorbis'
+            granule_rate = sample_rate
+        elif packet[:8] == b'OpusHead':
+            channels = packet[9]
+            pre_skip = struct.unpack_from('<H', packet, 10)[0]
+            sample_rate = struct.unpack_from('<I', packet, 12)[0] or 48000
+            codec = 'opus'
+            granule_rate = 48000
+        else:
+            raise AudioHeaderError("Unsupported Ogg codec")
+
+        if not granule_rate:
+            raise AudioHeaderError("Invalid Ogg sample rate")
+
+        # Search backwards for the last page of this logical stream
+        tail_size = OGG_TAIL_BYTES
+        while True:
+            start = max(0, file_size - tail_size)
+            f.seek(start)
+            tail = f.read(file_size - start)
+            index = tail.rfind(b'OggS')
+            while index != -1:
+                page = _parse_ogg_page_header(tail, index)
+                if page and page[1] == serial and page[0] >= 0:
+                    duration = max(0, page[0] - pre_skip) / granule_rate
+                    return {
+                        'duration': duration,
+                        'sample_rate': sample_rate,
+                        'channels': channels,
+                        'codec': codec
+                    }
+                index = tail.rfind(b'OggS', 0, index)
+            if start == 0:
+                raise AudioHeaderError("No final Ogg page found")
+            tail_size *= 4
+
+
+AUDIO_HEADER_READERS = {
+    '.wav': read_wav_info,
+    '.mp3': read_mp3_info,
+    '.ogg': read_ogg_info,
+    '.oga': read_ogg_info,
+    '.opus': read_ogg_info,
+}
+
+
+def probe_audio_header_metadata(file_path):
+    """Return media catalog metadata for an audio file by reading only its headers."""
+    reader = AUDIO_HEADER_READERS.get(os.path.splitext(file_path)[1].lower())
+    if not reader:
+        raise AudioHeaderError(f"No header reader for {file_path}")
+
+    try:
+        info = reader(file_path)
+    except (struct.error, IndexError) as e:
+        raise AudioHeaderError(f"Malformed audio header: {e}")
+
+    if not info.get('duration'):
+        raise AudioHeaderError("Duration not available from audio header")
+
+    return {
+        'duration': info['duration'],
+        'fps': None,
+        'width': None,
+        'height': None,
+        'codec': info.get('codec'),
+        'has_audio': True,
+        'sample_rate': info.get('sample_rate'),
+        'channels': info.get('channels')
+    }
@@ -0,0 +1,357 @@
+import os
+import re
+import uuid
+import hashlib
+import json
+import time
+import logging
+import threading
+from config import *
+
+CACHE_KEY_PATTERN = re.compile(r'^[A-Za-z0-9_-]+$')
+PINS_FILENAME = '.pinned.json'
+PART_MARKER = '.part-'
+
+
+def get_content_fingerprint(file_path, file_size=None):
+    """Fingerprint a file by hashing its size and samples from its start, middle and end."""
+    if file_size is None:
+        file_size = os.path.getsize(file_path)
+
+    sample_size = CACHE_FINGERPRINT_SAMPLE_BYTES
+    digest = hashlib.md5(str(file_size).encode())
+    with open(file_path, 'rb') as f:
+        for offset in (0, max(0, file_size // 2 - sample_size // 2), max(0, file_size - sample_size)):
+            f.seek(offset)
+            digest.update(f.read(sample_size))
+    return digest.hexdigest()
+
+
+def get_source_identity(file_path):
+    """Identify the real source behind a (possibly symlinked or copied) file."""
+    real_path = os.path.realpath(file_path)
+    stat = os.stat(real_path)
+    if CACHE_CONTENT_FINGERPRINT:
+        return f"fingerprint:{get_content_fingerprint(real_path, stat.st_size)}"
+    return f"{real_path}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+class _Flight:
+    """A cache fill in progress that other callers can wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.succeeded = False
+
+
+class CacheManager:
+    """
+    Size-bounded file cache with LRU/LFU eviction.
+    Sizes are tracked incrementally so the directory is only walked once at startup.
+    """
+
+    def __init__(self, folder, max_bytes, policy='lru', suffix='.mp4', name='cache'):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.suffix = suffix
+        self.name = name
+        self.total_bytes = 0
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'evicted_bytes': 0}
+        self._entries = {}
+        self._pinned = set()
+        self._inflight = {}
+        self._leases = {}
+        self._lock = threading.RLock()
+
+        os.makedirs(folder, exist_ok=True)
+        self._load()
+
+    def _validate_key(self, key):
+        if not key or not CACHE_KEY_PATTERN.match(key):
+            raise ValueError(f"Invalid cache key: {key}")
+        return key
+
+    def path_for(self, key):
+        """Return the file path used for a cache key."""
+        return os.path.join(self.folder, f"{self._validate_key(key)}{self.suffix}")
+
+    def temp_path_for(self, key):
+        """Return a unique hidden path to write a fill to before it is renamed into place."""
+        return os.path.join(self.folder, f".{self._validate_key(key)}{PART_MARKER}{uuid.uuid4().hex}{self.suffix}")
+
+    def _pins_path(self):
+        return os.path.join(self.folder, PINS_FILENAME)
+
+    def _load(self):
+        """Index existing cache files once; access time is kept in each file's atime."""
+        try:
+            with open(self._pins_path()) as f:
+                self._pinned = set(json.load(f))
+        except (OSError, ValueError):
+            self._pinned = set()
+
+        with os.scandir(self.folder) as it:
+            for entry in it:
+                if entry.is_file() and PART_MARKER in entry.name:
+                    # Leftover from a fill interrupted by a crash or restart
+                    try:
+                        os.remove(entry.path)
+                    except OSError:
+                        pass
+                    continue
+                if not entry.is_file() or not entry.name.endswith(self.suffix):
+                    continue
+                key = entry.name[:-len(self.suffix)]
+                if not CACHE_KEY_PATTERN.match(key):
+                    continue
+                st = entry.stat()
+                self._entries[key] = {
+                    'size': st.st_size,
+                    'created': st.st_mtime,
+                    'last_access': max(st.st_atime, st.st_mtime),
+                    'hits': 0
+                }
+                self.total_bytes += st.st_size
+
+        logging.info(f"Indexed {len(self._entries)} {self.name} entries ({self.total_bytes} bytes)")
+
+    def _save_pins(self):
+        try:
+            with open(self._pins_path(), 'w') as f:
+                json.dump(sorted(self._pinned), f)
+        except OSError as e:
+            logging.warning(f"Failed to save pinned {self.name} entries: {e}")
+
+    def _touch(self, key, entry):
+        now = time.time()
+        entry['last_access'] = now
+        entry['hits'] += 1
+        try:
+            # Persist the access time in atime so LRU order survives restarts
+            os.utime(self.path_for(key), (now, entry['created']))
+        except OSError:
+            pass
+
+    def lookup(self, key, record=True):
+        """Return the cached path for a key and record a hit, or record a miss and return None."""
+        path = self.path_for(key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and not os.path.exists(path):
+                # File was removed behind our back
+                self._forget(key)
+                entry = None
+            if entry is None and os.path.exists(path):
+                # File was produced outside the manager; adopt it
+                self.commit(key)
+                entry = self._entries.get(key)
+            if entry is None:
+                if record:
+                    self.stats['misses'] += 1
+                return None
+            if record:
+                self.stats['hits'] += 1
+            self._touch(key, entry)
+            return path
+
+    def get_or_fill(self, key, fill, lease=False, refresh=False):
+        """
+        Return the path for key, calling fill(temp_path) to create it on a miss.
+        Concurrent callers for the same key wait for a single fill, which is written
+        to a temporary name and atomically renamed so readers never see partial files.
+        With lease=True the entry is protected from eviction until release() is called.
+        """
+        with self._lock:
+            path = None if refresh else self.lookup(key)
+            if path:
+                if lease:
+                    self.acquire(key)
+                return path
+            flight = self._inflight.get(key)
+            owner = flight is None
+            if owner:
+                flight = _Flight()
+                self._inflight[key] = flight
+
+        if not owner:
+            logging.info(f"Waiting for in-flight {self.name} fill of {key}")
+            flight.done.wait()
+            if not flight.succeeded:
+                return None
+            with self._lock:
+                path = self.lookup(key, record=False)
+                if path and lease:
+                    self.acquire(key)
+                return path
+
+        temp_path = self.temp_path_for(key)
+        try:
+            if fill(temp_path) and os.path.exists(temp_path) and os.path.getsize(temp_path) > 0:
+                path = self.path_for(key)
+                os.replace(temp_path, path)
+                with self._lock:
+                    # Lease before committing so budget enforcement cannot evict the new entry
+                    if lease:
+                        self.acquire(key)
+                    self.commit(key)
+                flight.succeeded = True
+                return path
+            return None
+        finally:
+            if os.path.exists(temp_path):
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.done.set()
+
+    def acquire(self, key):
+        """Protect an entry from eviction while it is in use."""
+        with self._lock:
+            self._leases[key] = self._leases.get(key, 0) + 1
+
+    def release(self, key):
+        with self._lock:
+            count = self._leases.get(key, 0) - 1
+            if count > 0:
+                self._leases[key] = count
+            else:
+                self._leases.pop(key, None)
+                self._evict_to_budget()
+
+    def is_leased(self, key):
+        with self._lock:
+            return key in self._leases
+
+    def release_paths(self, paths):
+        """Release leases for any of the given paths that belong to this cache."""
+        for path in paths:
+            name = os.path.basename(path)
+            if os.path.dirname(os.path.abspath(path)) == os.path.abspath(self.folder) and name.endswith(self.suffix):
+                # release() tolerates keys without a lease
+                self.release(name[:-len(self.suffix)])
+
+    def commit(self, key):
+        """Register a file that has been written to path_for(key), then enforce the budget."""
+        path = self.path_for(key)
+        size = os.path.getsize(path)
+        now = time.time()
+        with self._lock:
+            previous = self._entries.get(key)
+            if previous:
+                self.total_bytes -= previous['size']
+            self._entries[key] = {
+                'size': size,
+                'created': now,
+                'last_access': now,
+                'hits': previous['hits'] if previous else 0
+            }
+            self.total_bytes += size
+            self._evict_to_budget()
+        return path
+
+    def _forget(self, key):
+        entry = self._entries.pop(key, None)
+        if entry:
+            self.total_bytes -= entry['size']
+        return entry
+
+    def _can_evict(self, key):
+        return key not in self._pinned and key not in self._leases
+
+    def evict(self, key, force=False):
+        """Remove one entry. Pinned entries are kept unless force is set; leased entries are always kept."""
+        with self._lock:
+            if key not in self._entries or key in self._leases:
+                # Entries used by a running job are never removed
+                return False
+            if not force and not self._can_evict(key):
+                return False
+            try:
+                os.remove(self.path_for(key))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logging.warning(f"Failed to evict {self.name} entry {key}: {e}")
+                return False
+            entry = self._forget(key)
+            self.stats['evictions'] += 1
+            self.stats['evicted_bytes'] += entry['size']
+            if force and key in self._pinned:
+                self._pinned.discard(key)
+                self._save_pins()
+            return True
+
+    def _victim_order(self):
+        candidates = [key for key in self._entries if self._can_evict(key)]
+        if self.policy == 'lfu':
+            return sorted(candidates, key=lambda k: (self._entries[k]['hits'], self._entries[k]['last_access']))
+        return sorted(candidates, key=lambda k: self._entries[k]['last_access'])
+
+    def _evict_to_budget(self):
+        if not self.max_bytes or self.total_bytes <= self.max_bytes:
+            return
+        for key in self._victim_order():
+            if self.total_bytes <= self.max_bytes:
+                break
+            if self.evict(key):
+                logging.info(f"Evicted {self.name} entry {key} ({self.policy})")
+
+    def pin(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return False
+            self._pinned.add(key)
+            self._save_pins()
+            return True
+
+    def unpin(self, key):
+        with self._lock:
+            if key not in self._pinned:
+                return False
+            self._pinned.discard(key)
+            self._save_pins()
+            self._evict_to_budget()
+            return True
+
+    def cleanup_older_than(self, days):
+        """Evict entries that have not been used for the given number of days."""
+        cutoff = time.time() - days * 86400
+        with self._lock:
+            stale = [key for key, entry in self._entries.items() if entry['last_access'] < cutoff]
+            removed = sum(1 for key in stale if self.evict(key))
+        if removed:
+            logging.info(f"Removed {removed} {self.name} entries unused for {days} days")
+        return removed
+
+    def clear(self):
+        """Evict every entry that is not pinned."""
+        with self._lock:
+            return sum(1 for key in list(self._entries) if self.evict(key))
+
+    def list_entries(self):
+        with self._lock:
+            return sorted(
+                ({'key': key, 'pinned': key in self._pinned, 'in_use': key in self._leases, **entry}
+                 for key, entry in self._entries.items()),
+                key=lambda e: e['last_access'],
+                reverse=True
+            )
+
+    def get_stats(self):
+        with self._lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return {
+                'entries': len(self._entries),
+                'total_bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'policy': self.policy,
+                'pinned': len(self._pinned),
+                'in_use': len(self._leases),
+                'in_flight': len(self._inflight),
+                'hit_rate': round(self.stats['hits'] / lookups, 3) if lookups else None,
+                **self.stats
+            }
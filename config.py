@@ -15,6 +15,9 @@ MAX_OUTPUT_COUNT = 10
 TEMP_FOLDER = 'temp'
 OUTPUT_FOLDER = 'outputs'
 VIDEO_CACHE_FOLDER = os.path.join('temp', 'video_cache')
+MEZZANINE_CACHE_FOLDER = os.path.join('temp', 'mezzanine_cache')
+AUDIO_CACHE_FOLDER = os.path.join('temp', 'audio_cache')
+PCM_CACHE_FOLDER = os.path.join('temp', 'pcm_cache')
 ALLOWED_EXTENSIONS = {'mp4'}
 ALLOWED_AUDIO_EXTENSIONS = {'mp3', 'ogg', 'wav'}
 
@@ -27,7 +30,66 @@ TARGET_WIDTH = None  # None to maintain aspect ratio
 MAX_WORKERS = min(8, (os.cpu_count() or 1) + 4)  # Optimal thread pool size
 TRANSITION_DURATION = 0.3  # Duration of video transitions in seconds
 ENABLE_CACHING = True  # Enable video caching for faster processing
-CLEANUP_CACHE_DAYS = 7  # Clean up cache files older than this many days
+CLEANUP_CACHE_DAYS = 7  # Clean up cache files not used for this many days
+VIDEO_CACHE_MAX_BYTES = 20 * 1024 ** 3  # Byte budget for normalized segments (0 = unbounded)
+CACHE_EVICTION_POLICY = 'lru'  # Options: 'lru' (least recently used), 'lfu' (least frequently used)
+CACHE_CONTENT_FINGERPRINT = False  # Key cache entries by sampled file content instead of realpath + size + mtime
+CACHE_FINGERPRINT_SAMPLE_BYTES = 64 * 1024  # Bytes hashed from the start, middle and end of a source
+ENABLE_MEZZANINE_CACHE = True  # Normalize whole sources once and cut random-mode trims from them
+MEZZANINE_CACHE_MAX_BYTES = 50 * 1024 ** 3  # Byte budget for normalized full-length sources (0 = unbounded)
+ENABLE_AUDIO_CACHE = True  # Transcode library audio to AAC once and mux it into outputs by packet copy
+AUDIO_CACHE_MAX_BYTES = 5 * 1024 ** 3  # Byte budget for AAC transcodes of library audio (0 = unbounded)
+PCM_CACHE_MAX_BYTES = 10 * 1024 ** 3  # Byte budget for decoded audio used by the NumPy voice mixer (0 = unbounded)
+PCM_CACHE_DTYPE = 'float32'  # Options: 'float32', 'int16' (half the size)
+MEZZANINE_SNAP_TO_KEYFRAME = True  # Move random trim starts to the previous keyframe so cuts are pure stream copies
+
+# Media Catalog Settings
+ENABLE_MEDIA_CATALOG = True  # Persist scanned media metadata between requests
+MEDIA_CATALOG_PATH = os.path.join('temp', 'media_catalog.db')  # SQLite catalog keyed by path + size + mtime
+SCAN_WORKERS = max(4, (os.cpu_count() or 1) * 2)  # Concurrent ffprobe calls during cold scans
+FFPROBE_TIMEOUT = 30  # Seconds before a single ffprobe call is abandoned
+SCAN_PAGE_CHUNK_SIZE = 200  # Files probed per step when filling a filtered scan page
+MP4_MAX_MOOV_BYTES = 64 * 1024 * 1024  # Larger moov boxes are left to ffprobe
+
+# Folder Watcher Settings
+ENABLE_FOLDER_WATCHER = os.environ.get('ENABLE_FOLDER_WATCHER', 'False').lower() == 'true'
+WATCH_VIDEO_FOLDERS = [p for p in os.environ.get('WATCH_VIDEO_FOLDERS', '').split(os.pathsep) if p]
+WATCH_AUDIO_FOLDERS = [p for p in os.environ.get('WATCH_AUDIO_FOLDERS', '').split(os.pathsep) if p]
+WATCHER_POLL_INTERVAL = 5  # Seconds between polls when inotify (watchdog) is unavailable
+WATCHER_EVENT_POLL_MULTIPLIER = 12  # Safety-net poll interval multiplier when native events are used
+WATCHER_MAX_CHANGES = 10000  # Change log entries kept for /api/catalog/changes
+
+# Normalization engine: 'ffmpeg' runs one filtergraph per segment, 'moviepy' uses the frame pipeline
+NORMALIZE_ENGINE = 'ffmpeg'
+NORMALIZE_GOP_SECONDS = 1  # Keyframe interval of normalized segments; short GOPs let smart merges cut close to transitions
+
+# Pass-through: sources already matching the target profile are trimmed by stream copy
+ENABLE_PASSTHROUGH = True
+PASSTHROUGH_CODECS = ('h264',)  # Source video codecs accepted without re-encoding
+PASSTHROUGH_PROFILES = (66, 77, 100)  # H.264 baseline, main and high; sources must also be 8-bit 4:2:0 with square pixels
+PASSTHROUGH_FPS_TOLERANCE = 0.01  # Maximum difference from TARGET_FPS
+PASSTHROUGH_KEYFRAME_SNAP = 0.25  # Move a trim start back to a keyframe this close; farther trims are normalized instead
+
+# Merge modes: 'standard' normalizes cached segments then joins them with MoviePy,
+# 'single_pass' renders each output with one ffmpeg filter_complex,
+# 'concat' joins cached segments without transitions by stream copy,
+# 'smart' stream-copies segment bodies and re-encodes only the transition windows
+MERGE_MODES = ('standard', 'single_pass', 'concat', 'smart')
+DEFAULT_MERGE_MODE = 'standard'
+
+# Video+audio merging: 'remux' copies the video stream and encodes only the new soundtrack,
+# 'moviepy' re-encodes the whole video
+VIDEO_AUDIO_ENGINE = 'remux'
+
+# Voice adder: 'numpy' mixes memory-mapped PCM cache entries and pipes them to the encoder,
+# 'ffmpeg' mixes with volume+amix; both copy the video stream. 'moviepy' re-encodes the whole video
+VOICE_MIX_ENGINE = 'numpy'
+PCM_MIX_BLOCK_FRAMES = 1 << 18  # Sample frames mixed and piped to ffmpeg per block
+
+# Audio settings shared by every normalized segment
+AUDIO_SAMPLE_RATE = 44100
+AUDIO_CHANNELS = 2
+AUDIO_BITRATE = '128k'
 
 # Video Quality Settings
 VIDEO_BITRATE = '2000k'  # Target bitrate for output videos
@@ -41,10 +103,24 @@ FALLBACK_CPU_CODEC = 'libx264'  # Fallback to CPU-based codec when GPU not avail
 GPU_ENCODING_PRESET = 'fast'  # Encoding preset for GPU
 GPU_RATE_CONTROL = 'cbr'  # Rate control method for GPU
 GPU_BITRATE = '2000k'  # Target bitrate for GPU encoding
+VAAPI_DEVICE = '/dev/dri/renderD128'  # Render node used to test VAAPI encoders
+ENCODER_PROBE_TIMEOUT = 20  # Seconds allowed for each encoder capability test
 
 # Performance Optimization Settings
 MAX_WORKERS = min(16, (os.cpu_count() or 1) + 4)  # Increased thread pool size
 FFMPEG_BUFFER_SIZE = '2M'  # Buffer size for FFmpeg processing
+CPU_CORE_BUDGET = os.cpu_count() or 1  # Cores shared by all concurrent encodes across jobs
+ENCODER_THREADS = min(4, CPU_CORE_BUDGET)  # Threads requested by a single encode
+SEGMENT_EXECUTION_MODE = 'thread'  # 'process' runs segment encodes in a pool of worker processes
+SEGMENT_PROCESS_WORKERS = None  # Worker processes; None sizes the pool from the core budget
+MAX_CONCURRENT_OUTPUTS = 2  # Final encodes of one batch that may run at the same time
+SEGMENT_PROGRESS_SHARE = 50  # Percent of each output's progress credited to its segment encodes
+
+# Job queue: background jobs run on a fixed pool of workers
+JOB_WORKERS = 2  # Jobs processed at the same time
+JOB_QUEUE_MAX_SIZE = 20  # Waiting jobs accepted before submissions get HTTP 429
+JOB_TYPE_LIMITS = {}  # Per job type concurrency caps, e.g. {'batch': 1}
+JOB_HISTORY_SIZE = 1000  # Finished jobs remembered for queue statistics
 
 # Quality Profiles for performance/quality balance
 QUALITY_PROFILES = {
@@ -0,0 +1,148 @@
+import time
+import logging
+import threading
+import subprocess
+from config import *
+from ffmpeg_engine import get_ffmpeg_path
+
+# Encoders the registry knows how to test; extra_args set up the hardware device where needed
+ENCODER_CANDIDATES = {
+    'libx264': {'type': 'cpu', 'codec': 'h264', 'extra_args': []},
+    'libx265': {'type': 'cpu', 'codec': 'hevc', 'extra_args': []},
+    'h264_nvenc': {'type': 'gpu', 'codec': 'h264', 'extra_args': []},
+    'hevc_nvenc': {'type': 'gpu', 'codec': 'hevc', 'extra_args': []},
+    'h264_vaapi': {'type': 'gpu', 'codec': 'h264',
+                   'extra_args': ['-vaapi_device', VAAPI_DEVICE, '-vf', 'format=nv12,hwupload']},
+    'hevc_vaapi': {'type': 'gpu', 'codec': 'hevc',
+                   'extra_args': ['-vaapi_device', VAAPI_DEVICE, '-vf', 'format=nv12,hwupload']},
+    'h264_qsv': {'type': 'gpu', 'codec': 'h264', 'extra_args': ['-vf', 'format=nv12']},
+    'hevc_qsv': {'type': 'gpu', 'codec': 'hevc', 'extra_args': ['-vf', 'format=nv12']},
+}
+
+
+class EncoderRegistry:
+    """
+    Encoder capabilities probed once and looked up in O(1) afterwards.
+    Encoders that fail during a job are marked unhealthy until the next refresh.
+    """
+
+    def __init__(self, gpu_enabled=None, gpu_codec=None):
+        self.gpu_enabled = ENABLE_GPU_ACCELERATION if gpu_enabled is None else gpu_enabled
+        self.gpu_codec = gpu_codec or GPU_CODEC
+        self.ffmpeg_path = None
+        self.ffmpeg_version = None
+        self.probed_at = None
+        self.encoders = {}
+        self._probe_lock = threading.Lock()
+
+    def _run(self, args):
+        return subprocess.run([self.ffmpeg_path] + args, capture_output=True, text=True, timeout=ENCODER_PROBE_TIMEOUT)
+
+    def _test_encoder(self, name):
+        """Encode one test frame to the null muxer to confirm the encoder really works."""
+        args = ['-hide_banner', '-loglevel', 'error', '-nostdin',
+                '-f', 'lavfi', '-i', 'testsrc=duration=1:size=320x240:rate=1']
+        args += ENCODER_CANDIDATES[name]['extra_args']
+        args += ['-frames:v', '1', '-c:v', name, '-f', 'null', '-']
+        try:
+            result = self._run(args)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            return False, str(e)
+        if result.returncode != 0:
+            return False, result.stderr.strip()[-500:] or f"exit code {result.returncode}"
+        return True, None
+
+    def refresh(self):
+        """Probe ffmpeg's encoder list and test every known encoder it reports."""
+        with self._probe_lock:
+            return self._probe()
+
+    def _probe(self):
+        encoders = {}
+        self.ffmpeg_path = get_ffmpeg_path()
+        self.ffmpeg_version = None
+        listed = set()
+
+        if self.ffmpeg_path:
+            try:
+                version = self._run(['-hide_banner', '-version'])
+                self.ffmpeg_version = version.stdout.split('\n')[0] if version.stdout else None
+                result = self._run(['-hide_banner', '-encoders'])
+                listed = {line.split()[1] for line in result.stdout.split('\n')
+                          if len(line.split()) > 1 and line.split()[0].startswith('V')}
+            except (OSError, subprocess.TimeoutExpired) as e:
+                logging.warning(f"Failed to list ffmpeg encoders: {e}")
+        else:
+            logging.info("FFmpeg not found, no encoders available")
+
+        for name, candidate in ENCODER_CANDIDATES.items():
+            working, error = self._test_encoder(name) if name in listed else (False, None)
+            encoders[name] = {
+                'type': candidate['type'],
+                'codec': candidate['codec'],
+                'listed': name in listed,
+                'working': working,
+                'healthy': working,
+                'error': error
+            }
+
+        self.encoders = encoders
+        self.probed_at = time.time()
+        working = [name for name, info in encoders.items() if info['working']]
+        logging.info(f"Encoder registry probed, working encoders: {working}")
+        return self.to_dict()
+
+    def _ensure_probed(self):
+        if self.probed_at is None:
+            with self._probe_lock:
+                if self.probed_at is None:
+                    self._probe()
+
+    def is_available(self, name):
+        """Return True if an encoder was tested successfully and has not failed since."""
+        self._ensure_probed()
+        info = self.encoders.get(name)
+        return bool(info and info['healthy'])
+
+    def gpu_available(self):
+        """Return True if GPU encoding is enabled and the configured GPU encoder is healthy."""
+        return self.gpu_enabled and self.is_available(self.gpu_codec)
+
+    def mark_unhealthy(self, name, error=None):
+        """Stop routing work to an encoder that failed during a job."""
+        info = self.encoders.get(name)
+        if info and info['healthy']:
+            info['healthy'] = False
+            info['error'] = str(error)[-500:] if error else 'Failed during encoding'
+            logging.warning(f"Encoder {name} marked unhealthy until the next refresh: {info['error']}")
+
+    def set_gpu_enabled(self, enabled):
+        self.gpu_enabled = bool(enabled)
+
+    def to_dict(self):
+        return {
+            'ffmpeg': {'path': self.ffmpeg_path, 'version': self.ffmpeg_version},
+            'gpu_enabled': self.gpu_enabled,
+            'gpu_codec': self.gpu_codec,
+            'gpu_available': self.gpu_enabled and bool(self.encoders.get(self.gpu_codec, {}).get('healthy')),
+            'probed_at': self.probed_at,
+            'encoders': self.encoders
+        }
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_encoder_registry():
+    """Return the shared encoder registry."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = EncoderRegistry()
+        return _registry
+
+
+def is_gpu_acceleration_available():
+    """Check if GPU acceleration is enabled and the GPU encoder is healthy, using the cached encoder registry."""
+    return get_encoder_registry().gpu_available()
@@ -0,0 +1,663 @@
+import os
+import math
+import shutil
+import logging
+import tempfile
+import threading
+import subprocess
+from contextlib import contextmanager
+from config import *
+
+
+class FfmpegError(Exception):
+    """Raised when an ffmpeg invocation fails."""
+
+
+# Raw sample formats for decoded PCM, by NumPy dtype name
+PCM_FORMATS = {'float32': 'f32le', 'int16': 's16le'}
+
+
+_ffmpeg_path = None
+
+
+def get_ffmpeg_path():
+    """Return the ffmpeg binary, preferring the system one over MoviePy's bundled copy."""
+    global _ffmpeg_path
+    if _ffmpeg_path is None:
+        _ffmpeg_path = shutil.which('ffmpeg')
+        if not _ffmpeg_path:
+            try:
+                from imageio_ffmpeg import get_ffmpeg_exe
+                _ffmpeg_path = get_ffmpeg_exe()
+            except Exception:
+                _ffmpeg_path = ''
+    return _ffmpeg_path or None
+
+
+def run_ffmpeg(args, timeout=None, progress=None):
+    """
+    Run ffmpeg with the given arguments, raising FfmpegError on failure.
+    progress, if given, is called with the output timestamp in seconds as encoding advances.
+    """
+    ffmpeg_path = get_ffmpeg_path()
+    if not ffmpeg_path:
+        raise FfmpegError("FFmpeg not found")
+
+    cmd = [ffmpeg_path, '-hide_banner', '-loglevel', 'error', '-nostdin', '-y'] + args
+    logging.debug(f"Running: {' '.join(cmd)}")
+    if progress:
+        return _run_ffmpeg_with_progress(cmd, timeout, progress)
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        raise FfmpegError(f"FFmpeg timed out after {timeout}s")
+    if result.returncode != 0:
+        raise FfmpegError(result.stderr.strip()[-2000:] or f"FFmpeg exited with code {result.returncode}")
+    return result
+
+
+def _run_ffmpeg_with_progress(cmd, timeout, progress):
+    cmd = cmd[:1] + ['-progress', 'pipe:1', '-nostats'] + cmd[1:]
+    # stderr goes to a file so it can never fill up while stdout is being read
+    with tempfile.TemporaryFile() as stderr:
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr, text=True)
+        timed_out = threading.Event()
+
+        def expire():
+            timed_out.set()
+            process.kill()
+
+        timer = threading.Timer(timeout, expire) if timeout else None
+        if timer:
+            timer.start()
+        try:
+            for line in process.stdout:
+                key, _, value = line.strip().partition('=')
+                # out_time_ms is in microseconds despite its name
+                if key in ('out_time_us', 'out_time_ms') and value.isdigit():
+                    progress(int(value) / 1000000)
+            returncode = process.wait()
+        except BaseException:
+            process.kill()
+            process.wait()
+            raise
+        finally:
+            if timer:
+                timer.cancel()
+
+        stderr.seek(0)
+        message = stderr.read().decode(errors='replace').strip()
+    if timed_out.is_set():
+        raise FfmpegError(f"FFmpeg timed out after {timeout}s")
+    if returncode != 0:
+        raise FfmpegError(message[-2000:] or f"FFmpeg exited with code {returncode}")
+    return subprocess.CompletedProcess(cmd, returncode, '', message)
+
+
+# GPU failures collected by capture_gpu_failures() instead of being reported directly
+_gpu_failure_capture = threading.local()
+
+
+def report_gpu_failure(error):
+    """
+    Mark the GPU encoder unhealthy so later jobs go straight to the CPU encoder.
+    Inside capture_gpu_failures() the error is only recorded, for the caller to report.
+    """
+    captured = getattr(_gpu_failure_capture, 'errors', None)
+    if captured is not None:
+        captured.append(str(error))
+        return
+    from encoder_registry import get_encoder_registry
+    get_encoder_registry().mark_unhealthy(GPU_CODEC, error)
+
+
+@contextmanager
+def capture_gpu_failures():
+    """
+    Collect GPU failures reported in this thread instead of marking the registry.
+    Worker processes use this because their registry copy is not the one jobs consult.
+    """
+    previous = getattr(_gpu_failure_capture, 'errors', None)
+    _gpu_failure_capture.errors = []
+    try:
+        yield _gpu_failure_capture.errors
+    finally:
+        _gpu_failure_capture.errors = previous
+
+
+def get_quality_settings():
+    """Return (crf, bitrate) for the configured VIDEO_QUALITY."""
+    if VIDEO_QUALITY == 'low':
+        return 28, '1000k'
+    if VIDEO_QUALITY == 'high':
+        return 18, '4000k'
+    return CRF_VALUE, VIDEO_BITRATE
+
+
+def video_encoder_args(use_gpu, threads=None):
+    """Return the ffmpeg video encoder arguments matching the MoviePy GPU/CPU settings."""
+    if use_gpu:
+        return ['-c:v', GPU_CODEC, '-preset', GPU_ENCODING_PRESET, '-b:v', GPU_BITRATE]
+
+    _, bitrate = get_quality_settings()
+    args = ['-c:v', FALLBACK_CPU_CODEC, '-preset', VIDEO_PRESET, '-b:v', bitrate]
+    if threads:
+        args += ['-threads', str(threads)]
+    return args
+
+
+def audio_encoder_args():
+    """Return the AAC settings shared by every normalized segment."""
+    return ['-c:a', 'aac', '-b:a', AUDIO_BITRATE, '-ar', str(AUDIO_SAMPLE_RATE), '-ac', str(AUDIO_CHANNELS)]
+
+
+def scale_filter():
+    if TARGET_WIDTH:
+        return f"scale={TARGET_WIDTH}:{TARGET_HEIGHT}:flags=lanczos"
+    return f"scale=-2:{TARGET_HEIGHT}:flags=lanczos"
+
+
+def normalize_filter():
+    """Filter chain that brings any source to the target size, frame rate and pixel format."""
+    return f"{scale_filter()},fps={TARGET_FPS},format=yuv420p,setsar=1"
+
+
+def single_pass_canvas(segments):
+    """
+    Return the (width, height) every single-pass input is fitted into: the widest segment
+    at TARGET_HEIGHT, like concatenate_videoclips(method='compose') on normalized clips.
+    """
+    widths = []
+    for segment in segments:
+        if not segment.get('width') or not segment.get('height'):
+            raise ValueError(f"Unknown frame size for {segment['path']}")
+        widths.append(math.ceil(segment['width'] * TARGET_HEIGHT / segment['height'] / 2) * 2)
+    return max(widths), TARGET_HEIGHT
+
+
+def canvas_filter(width, height):
+    """Fit a source inside width x height, padding the remainder, at the target frame rate and pixel format."""
+    return (f"scale={width}:{height}:force_original_aspect_ratio=decrease:force_divisible_by=2:flags=lanczos,"
+            f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,fps={TARGET_FPS},format=yuv420p,setsar=1")
+
+
+def silence_input_args(duration=None):
+    """lavfi input producing silence in the segment audio format."""
+    layout = 'stereo' if AUDIO_CHANNELS == 2 else 'mono'
+    args = ['-f', 'lavfi']
+    if duration:
+        args += ['-t', f"{duration:.3f}"]
+    return args + ['-i', f"anullsrc=r={AUDIO_SAMPLE_RATE}:cl={layout}"]
+
+
+def trim_bounds(trim_info):
+    """Return (start, duration) from trim info; duration is None when untrimmed at the end."""
+    if not trim_info:
+        return 0.0, None
+    start = float(trim_info.get('start', 0))
+    end = float(trim_info['end']) if trim_info.get('end') else None
+    if end is not None and start >= end:
+        raise ValueError(f"Invalid trim times: start ({start}) >= end ({end})")
+    return start, (end - start) if end is not None else None
+
+
+def build_normalize_command(input_path, output_path, trim_info=None, has_audio=True, use_gpu=False, threads=None):
+    """Build ffmpeg arguments that trim, scale, resample and encode a segment in one pass."""
+    start, duration = trim_bounds(trim_info)
+
+    args = []
+    if start > 0:
+        args += ['-ss', f"{start:.3f}"]
+    if duration:
+        args += ['-t', f"{duration:.3f}"]
+    args += ['-i', input_path]
+
+    if has_audio:
+        args += ['-map', '0:v:0', '-map', '0:a:0']
+    else:
+        # Give every segment an audio track so segments can be joined uniformly
+        args += silence_input_args(duration)
+        args += ['-map', '0:v:0', '-map', '1:a:0', '-shortest']
+
+    args += ['-vf', normalize_filter()]
+    args += video_encoder_args(use_gpu, threads)
+    args += ['-g', str(max(1, round(TARGET_FPS * NORMALIZE_GOP_SECONDS)))]
+    args += audio_encoder_args()
+    args += ['-movflags', '+faststart', output_path]
+    return args
+
+
+def source_has_audio(input_path):
+    """Check whether a source has an audio stream using the media catalog."""
+    try:
+        from media_catalog import get_media_metadata
+        return bool(get_media_metadata(input_path, 'video').get('has_audio'))
+    except Exception as e:
+        logging.info(f"Could not determine audio presence for {input_path}, assuming audio: {e}")
+        return True
+
+
+def normalize_with_ffmpeg(input_path, output_path, trim_info=None, use_gpu=False, threads=None):
+    """
+    Normalize a segment with a single ffmpeg invocation, keeping frames out of Python.
+    Tries the GPU encoder first when requested and falls back to the CPU encoder; the GPU
+    is only reported unhealthy when the CPU retry succeeds. Returns True on success.
+    """
+    thread_id = threading.get_ident()
+    has_audio = source_has_audio(input_path)
+
+    attempts = [True, False] if use_gpu else [False]
+    gpu_error = None
+    for gpu in attempts:
+        try:
+            args = build_normalize_command(input_path, output_path, trim_info, has_audio, gpu, threads)
+            run_ffmpeg(args)
+            if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
+                logging.info(f"Thread {thread_id}: Normalized {os.path.basename(input_path)} with ffmpeg ({'GPU' if gpu else 'CPU'})")
+                if gpu_error:
+                    # The CPU encoder handled the same command, so the failure was the GPU's
+                    report_gpu_failure(gpu_error)
+                return True
+        except ValueError as e:
+            logging.warning(f"Thread {thread_id}: Cannot normalize {input_path}: {e}")
+            return False
+        except FfmpegError as e:
+            if gpu:
+                logging.warning(f"Thread {thread_id}: GPU ffmpeg normalization failed, falling back to CPU: {e}")
+                gpu_error = e
+            else:
+                logging.warning(f"Thread {thread_id}: ffmpeg normalization failed for {input_path}: {e}")
+        if os.path.exists(output_path):
+            os.remove(output_path)
+    return False
+
+
+def _segment_audio_filter(label_in, label_out):
+    layout = 'stereo' if AUDIO_CHANNELS == 2 else 'mono'
+    return (f"[{label_in}]aresample={AUDIO_SAMPLE_RATE},"
+            f"aformat=sample_fmts=fltp:channel_layouts={layout},asetpts=PTS-STARTPTS[{label_out}]")
+
+
+def build_single_pass_merge_command(segments, output_path, transition_duration=0, use_gpu=False, threads=None):
+    """
+    Build one ffmpeg invocation that trims, scales and joins every segment.
+    segments is a list of {'path', 'start', 'duration', 'has_audio', 'width', 'height'} dicts.
+    Every segment is fitted onto one shared canvas, since concat and xfade need equal frame sizes.
+    Segments are crossfaded with xfade/acrossfade when transition_duration > 0,
+    otherwise joined with the concat filter.
+    """
+    if not segments:
+        raise ValueError("No segments to merge")
+    # A fixed TARGET_WIDTH already scales every input to the same size
+    video_filter = normalize_filter() if TARGET_WIDTH else canvas_filter(*single_pass_canvas(segments))
+
+    args = []
+    for segment in segments:
+        if segment['start'] > 0:
+            args += ['-ss', f"{segment['start']:.3f}"]
+        args += ['-t', f"{segment['duration']:.3f}", '-i', segment['path']]
+
+    # Silent inputs for segments without audio come after the video inputs
+    audio_inputs = []
+    next_input = len(segments)
+    for segment in segments:
+        if segment['has_audio']:
+            audio_inputs.append(None)
+        else:
+            args += silence_input_args(segment['duration'])
+            audio_inputs.append(next_input)
+            next_input += 1
+
+    filters = []
+    for i, segment in enumerate(segments):
+        filters.append(f"[{i}:v]{video_filter},setpts=PTS-STARTPTS[v{i}]")
+        source = f"{i}:a" if audio_inputs[i] is None else f"{audio_inputs[i]}:a"
+        filters.append(_segment_audio_filter(source, f"a{i}"))
+
+    # Crossfades cannot be longer than half of the shortest segment
+    fade = min(transition_duration or 0, min(s['duration'] for s in segments) / 2)
+    if len(segments) > 1 and fade > 0:
+        video_label, audio_label = 'v0', 'a0'
+        timeline = segments[0]['duration']
+        for i in range(1, len(segments)):
+            offset = timeline - fade
+            filters.append(f"[{video_label}][v{i}]xfade=transition=fade:duration={fade:.3f}:offset={offset:.3f}[xv{i}]")
+            filters.append(f"[{audio_label}][a{i}]acrossfade=d={fade:.3f}[xa{i}]")
+            video_label, audio_label = f"xv{i}", f"xa{i}"
+            timeline += segments[i]['duration'] - fade
+        video_out, audio_out = video_label, audio_label
+    else:
+        inputs = ''.join(f"[v{i}][a{i}]" for i in range(len(segments)))
+        filters.append(f"{inputs}concat=n={len(segments)}:v=1:a=1[vout][aout]")
+        video_out, audio_out = 'vout', 'aout'
+
+    args += ['-filter_complex', ';'.join(filters), '-map', f"[{video_out}]", '-map', f"[{audio_out}]"]
+    args += video_encoder_args(use_gpu, threads)
+    args += audio_encoder_args()
+    args += ['-movflags', '+faststart', output_path]
+    return args
+
+
+def merge_single_pass(segments, output_path, transition_duration=0, use_gpu=False, threads=None, progress=None):
+    """
+    Render a complete output in one ffmpeg process; GPU failures retry on the CPU encoder.
+    The GPU is only reported unhealthy when the CPU retry succeeds.
+    progress, if given, is called with the rendered fraction (0-1) of the output.
+    """
+    attempts = [True, False] if use_gpu else [False]
+    last_error = None
+    gpu_error = None
+    on_time = None
+    if progress:
+        fade = min(transition_duration or 0, min(s['duration'] for s in segments) / 2) if len(segments) > 1 else 0
+        total = sum(s['duration'] for s in segments) - fade * (len(segments) - 1)
+        if total > 0:
+            on_time = lambda seconds: progress(min(1.0, seconds / total))
+    for gpu in attempts:
+        try:
+            run_ffmpeg(build_single_pass_merge_command(segments, output_path, transition_duration, gpu, threads),
+                       progress=on_time)
+            logging.info(f"Rendered {len(segments)} segments in a single ffmpeg pass ({'GPU' if gpu else 'CPU'})")
+            if gpu_error:
+                report_gpu_failure(gpu_error)
+            return output_path
+        except FfmpegError as e:
+            last_error = e
+            logging.warning(f"Single-pass merge failed ({'GPU' if gpu else 'CPU'}): {e}")
+            if gpu:
+                gpu_error = e
+            if os.path.exists(output_path):
+                os.remove(output_path)
+    raise FfmpegError(f"Single-pass merge failed: {last_error}")
+
+
+def write_concat_list(paths, list_path):
+    """Write an ffmpeg concat demuxer list for the given files."""
+    with open(list_path, 'w') as f:
+        for path in paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    return list_path
+
+
+def concat_copy(paths, output_path):
+    """Join parameter-identical segments with the concat demuxer without re-encoding."""
+    list_path = f"{output_path}.concat.txt"
+    try:
+        write_concat_list(paths, list_path)
+        run_ffmpeg(['-f', 'concat', '-safe', '0', '-i', list_path, '-map', '0', '-c', 'copy',
+                    '-movflags', '+faststart', output_path])
+        logging.info(f"Joined {len(paths)} segments with stream copy")
+        return output_path
+    except FfmpegError:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise
+    finally:
+        if os.path.exists(list_path):
+            os.remove(list_path)
+
+
+def transcode_audio(input_path, output_path):
+    """Encode the first audio stream of input_path to AAC in the segment audio format."""
+    run_ffmpeg(['-i', input_path, '-map', '0:a:0'] + audio_encoder_args() + ['-movflags', '+faststart', output_path])
+    return output_path
+
+
+def build_remux_audio_command(video_path, audio_path, output_path, duration, audio_start=0, copy_audio=False):
+    """
+    Copy the video stream and replace its audio with duration seconds of audio_path from audio_start.
+    With copy_audio the audio packets are copied too; audio_path must then already be AAC.
+    """
+    audio_args = ['-c:a', 'copy'] if copy_audio else audio_encoder_args()
+    return ['-i', video_path,
+            '-ss', f"{audio_start:.3f}", '-t', f"{duration:.3f}", '-i', audio_path,
+            '-map', '0:v:0', '-map', '1:a:0', '-c:v', 'copy'] + audio_args + \
+           ['-movflags', '+faststart', output_path]
+
+
+def remux_with_audio(video_path, audio_path, output_path, duration, audio_start=0, copy_audio=False):
+    """Replace a video's soundtrack without re-encoding the picture. Raises FfmpegError on failure."""
+    try:
+        run_ffmpeg(build_remux_audio_command(video_path, audio_path, output_path, duration, audio_start, copy_audio))
+        return output_path
+    except FfmpegError:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise
+
+
+def build_voice_mix_command(video_path, voice_path, output_path, duration, original_volume=None):
+    """
+    Copy the first duration seconds of video and lay voice_path over its audio.
+    The original audio is scaled by original_volume (a 0-1 multiplier) and summed with the
+    voice without amix's default 1/n attenuation; None means the video has no audio to keep.
+    """
+    args = ['-i', video_path, '-i', voice_path]
+    if original_volume is None:
+        args += ['-map', '0:v:0', '-map', '1:a:0']
+    else:
+        graph = (f"[0:a:0]volume={original_volume:.3f}[original];"
+                 f"[original][1:a:0]amix=inputs=2:duration=longest:dropout_transition=0:normalize=0[aout]")
+        args += ['-filter_complex', graph, '-map', '0:v:0', '-map', '[aout]']
+    return args + ['-c:v', 'copy'] + audio_encoder_args() + \
+           ['-t', f"{duration:.3f}", '-movflags', '+faststart', output_path]
+
+
+def mix_voice_over(video_path, voice_path, output_path, duration, original_volume=None):
+    """Add a voice track to a video, encoding only the audio. Raises FfmpegError on failure."""
+    try:
+        run_ffmpeg(build_voice_mix_command(video_path, voice_path, output_path, duration, original_volume))
+        return output_path
+    except FfmpegError:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise
+
+
+def decode_audio_to_raw(input_path, output_path, dtype='float32'):
+    """Decode the first audio stream to interleaved raw samples in the segment sample rate and layout."""
+    run_ffmpeg(['-i', input_path, '-map', '0:a:0', '-f', PCM_FORMATS[dtype],
+                '-ar', str(AUDIO_SAMPLE_RATE), '-ac', str(AUDIO_CHANNELS), output_path])
+    return output_path
+
+
+def build_pcm_mux_command(video_path, output_path, duration):
+    """Copy the video stream and encode float32 PCM read from stdin as its audio."""
+    return ['-i', video_path,
+            '-f', PCM_FORMATS['float32'], '-ar', str(AUDIO_SAMPLE_RATE), '-ac', str(AUDIO_CHANNELS), '-i', 'pipe:0',
+            '-map', '0:v:0', '-map', '1:a:0', '-c:v', 'copy'] + audio_encoder_args() + \
+           ['-t', f"{duration:.3f}", '-movflags', '+faststart', output_path]
+
+
+def mux_pcm_stream(video_path, blocks, output_path, duration):
+    """
+    Write float32 sample blocks to ffmpeg's stdin as the audio of a stream-copied video.
+    Raises FfmpegError on failure; any exception from blocks aborts the encode.
+    """
+    ffmpeg_path = get_ffmpeg_path()
+    if not ffmpeg_path:
+        raise FfmpegError("FFmpeg not found")
+
+    cmd = [ffmpeg_path, '-hide_banner', '-loglevel', 'error', '-nostdin', '-y'] + \
+        build_pcm_mux_command(video_path, output_path, duration)
+    logging.debug(f"Running: {' '.join(cmd)}")
+    # stderr goes to a file so a chatty ffmpeg can never block while we are writing stdin
+    with tempfile.TemporaryFile() as stderr:
+        process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=stderr)
+        try:
+            try:
+                for block in blocks:
+                    process.stdin.write(block.tobytes())
+            except BrokenPipeError:
+                # ffmpeg exited early; its exit code and stderr explain why
+                pass
+            finally:
+                try:
+                    process.stdin.close()
+                except BrokenPipeError:
+                    pass
+            returncode = process.wait()
+        except BaseException:
+            process.kill()
+            process.wait()
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            raise
+
+        if returncode != 0:
+            stderr.seek(0)
+            message = stderr.read().decode(errors='replace').strip()[-2000:]
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            raise FfmpegError(message or f"FFmpeg exited with code {returncode}")
+    return output_path
+
+
+def plan_smart_render(segments, fade):
+    """
+    Return (body_start, body_end) for each segment: the keyframe-aligned span that can be
+    stream-copied because it lies outside the transition windows at either end.
+    """
+    plan = []
+    last = len(segments) - 1
+    for i, segment in enumerate(segments):
+        keyframes = segment['keyframes']
+        body_start = 0.0 if i == 0 else next((t for t in keyframes if t >= fade), None)
+        body_end = segment['duration'] if i == last else next(
+            (t for t in reversed(keyframes) if t <= segment['duration'] - fade), None)
+        if body_start is None or body_end is None or body_end <= body_start:
+            raise ValueError(f"No keyframe-aligned body between transitions in {segment['path']}")
+        plan.append((body_start, body_end))
+    return plan
+
+
+def build_transition_command(outgoing, incoming, tail_start, head_length, fade, output_path, use_gpu=False, threads=None):
+    """Encode the crossfade between the tail of one segment and the head of the next as MPEG-TS."""
+    tail_length = outgoing['duration'] - tail_start
+    filters = (f"[0:v]setpts=PTS-STARTPTS[tail];[1:v]setpts=PTS-STARTPTS[head];"
+               f"[tail][head]xfade=transition=fade:duration={fade:.3f}:offset={tail_length - fade:.6f},format=yuv420p[v]")
+    args = ['-ss', f"{tail_start:.6f}", '-i', outgoing['path'],
+            '-t', f"{head_length:.6f}", '-i', incoming['path'],
+            '-filter_complex', filters, '-map', '[v]', '-an']
+    args += video_encoder_args(use_gpu, threads)
+    return args + ['-f', 'mpegts', output_path]
+
+
+def build_crossfade_audio_command(segments, output_path, fade):
+    """Render the joined audio track of all segments in one audio-only pass."""
+    args = []
+    for segment in segments:
+        if segment['has_audio']:
+            args += ['-i', segment['path']]
+        else:
+            args += silence_input_args(segment['duration'])
+
+    filters = [_segment_audio_filter(f"{i}:a", f"a{i}") for i in range(len(segments))]
+    if len(segments) > 1 and fade > 0:
+        label = 'a0'
+        for i in range(1, len(segments)):
+            filters.append(f"[{label}][a{i}]acrossfade=d={fade:.3f}[xa{i}]")
+            label = f"xa{i}"
+    else:
+        filters.append(f"{''.join(f'[a{i}]' for i in range(len(segments)))}concat=n={len(segments)}:v=0:a=1[xa]")
+        label = 'xa'
+
+    args += ['-filter_complex', ';'.join(filters), '-map', f"[{label}]", '-vn']
+    return args + audio_encoder_args() + [output_path]
+
+
+def smart_render(segments, output_path, transition_duration, use_gpu=False, threads=None):
+    """
+    Join normalized segments with crossfades, re-encoding only the transition windows.
+    segments is a list of {'path', 'duration', 'keyframes', 'has_audio'} dicts for
+    parameter-identical files. Bodies are stream-copied between keyframes, the audio is
+    rendered in a separate pass, and everything is muxed without further encoding.
+    """
+    fade = min(transition_duration, min(s['duration'] for s in segments) / 2)
+    plan = plan_smart_render(segments, fade)
+    work_dir = f"{output_path}.parts"
+    os.makedirs(work_dir, exist_ok=True)
+
+    try:
+        pieces = []
+        copied = 0.0
+        for i, segment in enumerate(segments):
+            body_start, body_end = plan[i]
+            body_path = os.path.join(work_dir, f"{len(pieces):03d}.ts")
+            args = ['-ss', f"{body_start:.6f}"] if body_start > 0 else []
+            # The mpegts muxer inserts the annex-B bitstream filter itself
+            args += ['-i', segment['path'], '-t', f"{body_end - body_start:.6f}",
+                     '-map', '0:v:0', '-c', 'copy', '-f', 'mpegts', body_path]
+            run_ffmpeg(args)
+            pieces.append(body_path)
+            copied += body_end - body_start
+
+            if i < len(segments) - 1:
+                transition_path = os.path.join(work_dir, f"{len(pieces):03d}.ts")
+                run_ffmpeg(build_transition_command(
+                    segment, segments[i + 1], body_end, plan[i + 1][0], fade, transition_path, use_gpu, threads))
+                pieces.append(transition_path)
+
+        audio_path = os.path.join(work_dir, 'audio.m4a')
+        run_ffmpeg(build_crossfade_audio_command(segments, audio_path, fade))
+
+        list_path = write_concat_list(pieces, os.path.join(work_dir, 'pieces.txt'))
+        run_ffmpeg(['-f', 'concat', '-safe', '0', '-i', list_path, '-i', audio_path,
+                    '-map', '0:v:0', '-map', '1:a:0', '-c', 'copy', '-movflags', '+faststart', output_path])
+
+        total = sum(s['duration'] for s in segments) - fade * (len(segments) - 1)
+        logging.info(f"Smart render stream-copied {copied:.1f}s of {total:.1f}s across {len(segments)} segments")
+        return output_path
+    except FfmpegError:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def cut_segment(source_path, start, duration, output_path, keyframes, use_gpu=False, threads=None):
+    """
+    Cut [start, start + duration) from an already normalized file.
+    Cuts starting on a keyframe are pure stream copies; otherwise only the frames up to
+    the next keyframe are re-encoded and the rest of the video is copied.
+    """
+    tolerance = 0.5 / TARGET_FPS
+    next_keyframe = next((t for t in keyframes if t > start + tolerance), None)
+    on_keyframe = any(abs(t - start) <= tolerance for t in keyframes)
+
+    if on_keyframe:
+        run_ffmpeg(['-ss', f"{start:.6f}", '-i', source_path, '-t', f"{duration:.6f}", '-map', '0',
+                    '-c', 'copy', '-avoid_negative_ts', 'make_zero', '-movflags', '+faststart', output_path])
+        return 'copy'
+
+    if next_keyframe is None or next_keyframe >= start + duration:
+        # The whole cut fits inside one GOP, so re-encoding it is already cheap
+        args = ['-ss', f"{start:.6f}", '-i', source_path, '-t', f"{duration:.6f}", '-map', '0']
+        args += video_encoder_args(use_gpu, threads)
+        args += ['-g', str(max(1, round(TARGET_FPS * NORMALIZE_GOP_SECONDS)))]
+        args += audio_encoder_args() + ['-movflags', '+faststart', output_path]
+        run_ffmpeg(args)
+        return 'encode'
+
+    work_dir = f"{output_path}.parts"
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        head_path = os.path.join(work_dir, 'head.ts')
+        body_path = os.path.join(work_dir, 'body.ts')
+        audio_path = os.path.join(work_dir, 'audio.m4a')
+
+        head = ['-ss', f"{start:.6f}", '-i', source_path, '-t', f"{next_keyframe - start:.6f}", '-map', '0:v:0', '-an']
+        run_ffmpeg(head + video_encoder_args(use_gpu, threads) + ['-f', 'mpegts', head_path])
+        run_ffmpeg(['-ss', f"{next_keyframe:.6f}", '-i', source_path, '-t', f"{start + duration - next_keyframe:.6f}",
+                    '-map', '0:v:0', '-c', 'copy', '-f', 'mpegts', body_path])
+        run_ffmpeg(['-ss', f"{start:.6f}", '-i', source_path, '-t', f"{duration:.6f}", '-map', '0:a:0',
+                    '-c', 'copy', audio_path])
+
+        list_path = write_concat_list([head_path, body_path], os.path.join(work_dir, 'pieces.txt'))
+        run_ffmpeg(['-f', 'concat', '-safe', '0', '-i', list_path, '-i', audio_path,
+                    '-map', '0:v:0', '-map', '1:a:0', '-c', 'copy', '-movflags', '+faststart', output_path])
+        return 'head_encode'
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
@@ -0,0 +1,223 @@
+import os
+import logging
+import threading
+from collections import deque
+from config import *
+from media_scanner import MediaScanner
+
+# Optional inotify/FSEvents backend; polling is used when watchdog is not installed
+try:
+    from watchdog.observers import Observer
+    WATCHDOG_AVAILABLE = True
+except ImportError:
+    Observer = None
+    WATCHDOG_AVAILABLE = False
+
+SCAN_EXTENSIONS = {
+    'video': tuple(f'.{ext}' for ext in ALLOWED_EXTENSIONS),
+    'audio': tuple(f'.{ext}' for ext in ALLOWED_AUDIO_EXTENSIONS),
+}
+
+
+class _FolderEventHandler:
+    """Minimal watchdog event handler that flags a watched folder for resync."""
+
+    def __init__(self, watcher, folder):
+        self.watcher = watcher
+        self.folder = folder
+
+    def dispatch(self, event):
+        if not getattr(event, 'is_directory', False):
+            self.watcher.mark_dirty(self.folder)
+
+
+class CatalogWatcher:
+    """
+    Keep an in-memory snapshot of watched media folders current.
+    Every change bumps the catalog version so clients can fetch deltas.
+    """
+
+    def __init__(self, scanner=None, poll_interval=None, max_changes=None):
+        self.scanner = scanner or MediaScanner()
+        self.poll_interval = poll_interval or WATCHER_POLL_INTERVAL
+        self.version = 0
+        self._folders = {}
+        self._changes = deque(maxlen=max_changes or WATCHER_MAX_CHANGES)
+        self._dirty = set()
+        self._lock = threading.RLock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._observer = None
+        self._watches = {}
+
+    def start(self):
+        """Start the background sync thread and, if available, the inotify observer."""
+        if self._thread and self._thread.is_alive():
+            return
+
+        if WATCHDOG_AVAILABLE:
+            try:
+                self._observer = Observer()
+                self._observer.daemon = True
+                self._observer.start()
+                logging.info("Folder watcher using native filesystem events")
+            except Exception as e:
+                logging.warning(f"Failed to start filesystem observer, using polling: {e}")
+                self._observer = None
+        else:
+            logging.info(f"watchdog not installed, folder watcher polling every {self.poll_interval}s")
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='catalog-watcher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop the sync thread and the filesystem observer."""
+        self._stop.set()
+        self._wake.set()
+        if self._observer:
+            self._observer.stop()
+            self._observer = None
+
+    def watch(self, folder_path, kind='video'):
+        """Start watching a folder and return its initial snapshot."""
+        folder = os.path.abspath(folder_path)
+        key = (folder, kind)
+        with self._lock:
+            if key not in self._folders:
+                self._folders[key] = {
+                    'sync_lock': threading.Lock(),
+                    'signatures': {},
+                    'entries': {},
+                    'snapshot': []
+                }
+        self._sync(key)
+
+        if self._observer and folder not in self._watches:
+            try:
+                self._watches[folder] = self._observer.schedule(_FolderEventHandler(self, folder), folder, recursive=False)
+            except Exception as e:
+                logging.warning(f"Failed to watch {folder} for events, relying on polling: {e}")
+
+        logging.info(f"Watching {kind} folder {folder}")
+        return self.snapshot(folder, kind)
+
+    def snapshot(self, folder_path, kind='video'):
+        """Return the current entries for a watched folder, or None if it is not watched."""
+        state = self._folders.get((os.path.abspath(folder_path), kind))
+        return state['snapshot'] if state else None
+
+    def mark_dirty(self, folder):
+        with self._lock:
+            self._dirty.add(folder)
+        self._wake.set()
+
+    def changes_since(self, version):
+        """Return the changes made after the given catalog version."""
+        with self._lock:
+            truncated = self._changes and version < self._changes[0]['version'] - 1
+            if truncated or version > self.version:
+                # Requested version fell out of the change log or predates a restart
+                return {
+                    'version': self.version,
+                    'reset': True,
+                    'folders': [
+                        {'folder': folder, 'kind': kind, 'entries': state['snapshot']}
+                        for (folder, kind), state in self._folders.items()
+                    ]
+                }
+            return {
+                'version': self.version,
+                'reset': False,
+                'changes': [change for change in self._changes if change['version'] > version]
+            }
+
+    def _record(self, op, folder, kind, entry):
+        self.version += 1
+        self._changes.append({
+            'version': self.version,
+            'op': op,
+            'folder': folder,
+            'kind': kind,
+            'entry': entry
+        })
+
+    def _sync(self, key):
+        """Bring one folder's snapshot up to date, probing only new or changed files."""
+        with self._folders[key]['sync_lock']:
+            self._sync_locked(key)
+
+    def _sync_locked(self, key):
+        folder, kind = key
+        state = self._folders[key]
+        extensions = SCAN_EXTENSIONS[kind]
+
+        current = {}
+        try:
+            with os.scandir(folder) as it:
+                for entry in it:
+                    if entry.is_file() and entry.name.lower().endswith(extensions):
+                        st = entry.stat()
+                        current[entry.path] = (st.st_size, st.st_mtime)
+        except OSError as e:
+            logging.warning(f"Failed to list watched folder {folder}: {e}")
+            return
+
+        previous = state['signatures']
+        removed = [path for path in previous if path not in current]
+        changed = [path for path, signature in current.items() if previous.get(path) != signature]
+        if not removed and not changed:
+            return
+
+        results = self.scanner.scan(changed, kind) if changed else {}
+
+        with self._lock:
+            entries = state['entries']
+            for path in removed:
+                previous.pop(path, None)
+                if entries.pop(path, None):
+                    self._record('removed', folder, kind, {'path': path})
+
+            for path in changed:
+                # Remember the signature even on failure so half-written files are retried only once they change
+                previous[path] = current[path]
+                metadata = results.get(path)
+                if not metadata:
+                    if entries.pop(path, None):
+                        self._record('removed', folder, kind, {'path': path})
+                    continue
+                entry = {
+                    'name': os.path.basename(path),
+                    'path': path,
+                    'duration': metadata['duration']
+                }
+                op = 'modified' if path in entries else 'added'
+                entries[path] = entry
+                self._record(op, folder, kind, entry)
+
+            state['snapshot'] = sorted(entries.values(), key=lambda e: e['name'])
+
+    def _run(self):
+        while not self._stop.is_set():
+            # With native events the poll is only a safety net
+            timeout = self.poll_interval * (WATCHER_EVENT_POLL_MULTIPLIER if self._observer else 1)
+            self._wake.wait(timeout)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+
+            with self._lock:
+                dirty = self._dirty
+                self._dirty = set()
+                keys = list(self._folders)
+
+            for key in keys:
+                # A plain timeout means poll everything, otherwise only folders with events
+                if dirty and key[0] not in dirty:
+                    continue
+                try:
+                    self._sync(key)
+                except Exception as e:
+                    logging.warning(f"Error syncing watched folder {key[0]}: {e}")
@@ -0,0 +1,133 @@
+import time
+import logging
+import threading
+from collections import deque, OrderedDict
+from config import *
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+
+class JobQueue:
+    """
+    Bounded FIFO job queue served by a fixed pool of worker threads.
+    Job types can be limited to fewer concurrent slots than the pool size.
+    """
+
+    def __init__(self, workers=None, max_queued=None, type_limits=None, history_size=None):
+        self.workers = max(1, workers or JOB_WORKERS)
+        self.max_queued = max_queued or JOB_QUEUE_MAX_SIZE
+        self.type_limits = dict(JOB_TYPE_LIMITS if type_limits is None else type_limits)
+        self._history_size = history_size or JOB_HISTORY_SIZE
+        self._pending = deque()
+        self._jobs = OrderedDict()
+        self._running_by_type = {}
+        self._durations = deque(maxlen=50)
+        self._condition = threading.Condition()
+        self._threads = []
+
+    def start(self):
+        """Start the worker threads."""
+        with self._condition:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f'job-worker-{i + 1}')
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+        logging.info(f"Job queue started with {self.workers} workers, up to {self.max_queued} queued jobs")
+
+    def submit(self, job_id, job_type, fn, on_start=None):
+        """Queue fn() to run on a worker. Raises QueueFullError when the queue is at capacity."""
+        with self._condition:
+            if len(self._pending) >= self.max_queued:
+                raise QueueFullError(f"Job queue is full ({self.max_queued} jobs waiting), try again later")
+            self._jobs[job_id] = {
+                'type': job_type,
+                'state': 'queued',
+                'submitted': time.time(),
+                'started': None,
+                'finished': None
+            }
+            self._pending.append((job_id, job_type, fn, on_start))
+            self._trim_history()
+            self._condition.notify_all()
+
+    def _trim_history(self):
+        while len(self._jobs) > self._history_size:
+            oldest_id, oldest = next(iter(self._jobs.items()))
+            if oldest['state'] != 'finished':
+                break
+            self._jobs.pop(oldest_id)
+
+    def _can_run(self, job_type):
+        limit = self.type_limits.get(job_type)
+        return not limit or self._running_by_type.get(job_type, 0) < limit
+
+    def _next_job(self):
+        """Pop the oldest pending job whose type still has a free slot."""
+        for index, job in enumerate(self._pending):
+            if self._can_run(job[1]):
+                del self._pending[index]
+                return job
+        return None
+
+    def _worker(self):
+        while True:
+            with self._condition:
+                job = self._next_job()
+                while job is None:
+                    self._condition.wait()
+                    job = self._next_job()
+                job_id, job_type, fn, on_start = job
+                self._running_by_type[job_type] = self._running_by_type.get(job_type, 0) + 1
+                info = self._jobs[job_id]
+                info['state'] = 'running'
+                info['started'] = time.time()
+
+            try:
+                if on_start:
+                    on_start()
+                fn()
+            except Exception as e:
+                logging.error(f"Job {job_id} ({job_type}) failed: {e}")
+            finally:
+                with self._condition:
+                    self._running_by_type[job_type] -= 1
+                    info['state'] = 'finished'
+                    info['finished'] = time.time()
+                    self._durations.append(info['finished'] - info['started'])
+                    self._trim_history()
+                    self._condition.notify_all()
+
+    def get_job_info(self, job_id):
+        """Return queue position and wait time for a job, or None if the queue does not know it."""
+        with self._condition:
+            info = self._jobs.get(job_id)
+            if not info:
+                return None
+            now = time.time()
+            result = {
+                'queue_position': None,
+                'wait_time': round((info['started'] or now) - info['submitted'], 1)
+            }
+            if info['state'] == 'queued':
+                position = next((i for i, job in enumerate(self._pending) if job[0] == job_id), 0) + 1
+                result['queue_position'] = position
+                if self._durations:
+                    average = sum(self._durations) / len(self._durations)
+                    result['estimated_wait'] = round(average * position / self.workers, 1)
+            return result
+
+    def get_stats(self):
+        with self._condition:
+            return {
+                'workers': self.workers,
+                'max_queued': self.max_queued,
+                'queued': len(self._pending),
+                'running': sum(self._running_by_type.values()),
+                'running_by_type': {t: n for t, n in self._running_by_type.items() if n},
+                'type_limits': self.type_limits
+            }
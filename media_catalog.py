@@ -0,0 +1,172 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+from config import *
+
+# Columns stored for every catalogued file, in table order
+CATALOG_FIELDS = ('duration', 'fps', 'width', 'height', 'codec', 'has_audio', 'sample_rate', 'channels')
+
+
+def probe_video_metadata(file_path):
+    """Probe a video file with FFmpeg and return its metadata."""
+    from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+    infos = ffmpeg_parse_infos(file_path)
+    if not infos.get('video_found'):
+        raise ValueError(f"No video stream found in {file_path}")
+
+    width, height = infos.get('video_size') or (None, None)
+    return {
+        'duration': infos.get('duration'),
+        'fps': infos.get('video_fps'),
+        'width': width,
+        'height': height,
+        'codec': None,
+        'has_audio': bool(infos.get('audio_found')),
+        'sample_rate': infos.get('audio_fps'),
+        'channels': None
+    }
+
+
+def probe_audio_metadata(file_path):
+    """Probe an audio file with FFmpeg and return its metadata."""
+    from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+    infos = ffmpeg_parse_infos(file_path)
+    if not infos.get('audio_found'):
+        raise ValueError(f"No audio stream found in {file_path}")
+
+    return {
+        'duration': infos.get('duration'),
+        'fps': None,
+        'width': None,
+        'height': None,
+        'codec': None,
+        'has_audio': True,
+        'sample_rate': infos.get('audio_fps'),
+        'channels': None
+    }
+
+
+class MediaCatalog:
+    """Persistent SQLite catalog of media metadata keyed by path, size and mtime."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+
+        db_folder = os.path.dirname(db_path)
+        if db_folder:
+            os.makedirs(db_folder, exist_ok=True)
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS media (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                kind TEXT NOT NULL,
+                duration REAL,
+                fps REAL,
+                width INTEGER,
+                height INTEGER,
+                codec TEXT,
+                has_audio INTEGER,
+                sample_rate INTEGER,
+                channels INTEGER,
+                updated_at REAL
+            )
+        ''')
+        self._conn.commit()
+
+    def _row_to_metadata(self, row):
+        metadata = dict(zip(CATALOG_FIELDS, row))
+        if metadata['has_audio'] is not None:
+            metadata['has_audio'] = bool(metadata['has_audio'])
+        return metadata
+
+    def lookup(self, path, size, mtime, kind):
+        """Return cached metadata if the file is unchanged, otherwise None."""
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(CATALOG_FIELDS)} FROM media "
+                "WHERE path = ? AND size = ? AND mtime = ? AND kind = ?",
+                (path, size, mtime, kind)
+            ).fetchone()
+        return self._row_to_metadata(row) if row else None
+
+    def store(self, path, size, mtime, kind, metadata):
+        """Insert or replace the metadata for a file."""
+        values = [metadata.get(field) for field in CATALOG_FIELDS]
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO media (path, size, mtime, kind, {', '.join(CATALOG_FIELDS)}, updated_at) "
+                f"VALUES (?, ?, ?, ?, {', '.join('?' for _ in CATALOG_FIELDS)}, ?)",
+                [path, size, mtime, kind] + values + [time.time()]
+            )
+            self._conn.commit()
+
+    def count(self):
+        """Return the number of catalogued files."""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM media").fetchone()[0]
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_media_catalog():
+    """Return the process-wide media catalog, or None if disabled."""
+    global _catalog
+    if not ENABLE_MEDIA_CATALOG:
+        return None
+
+    with _catalog_lock:
+        if _catalog is None:
+            try:
+                _catalog = MediaCatalog(MEDIA_CATALOG_PATH)
+                logging.info(f"Media catalog opened at {MEDIA_CATALOG_PATH} ({_catalog.count()} entries)")
+            except Exception as e:
+                logging.warning(f"Failed to open media catalog, scanning without it: {e}")
+                return None
+        return _catalog
+
+
+def reset_media_catalog():
+    """Forget the catalog connection inherited by a forked worker so it opens its own."""
+    global _catalog, _catalog_lock
+    _catalog = None
+    _catalog_lock = threading.Lock()
+
+
+def get_media_metadata(file_path, kind='video', catalog=None):
+    """Return metadata for a file, probing only when the catalog has no fresh entry."""
+    stat = os.stat(file_path)
+    # Key by the real file so per-job symlinks share the source's row instead of adding their own
+    path = os.path.realpath(file_path)
+    if catalog is None:
+        catalog = get_media_catalog()
+
+    if catalog:
+        metadata = catalog.lookup(path, stat.st_size, stat.st_mtime, kind)
+        if metadata:
+            return metadata
+
+    from media_scanner import probe_media
+    metadata = probe_media(file_path, kind)
+
+    if not metadata.get('duration'):
+        raise ValueError(f"Could not determine duration of {file_path}")
+
+    if catalog:
+        try:
+            catalog.store(path, stat.st_size, stat.st_mtime, kind, metadata)
+        except Exception as e:
+            logging.warning(f"Failed to store catalog entry for {file_path}: {e}")
+
+    return metadata
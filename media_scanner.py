@@ -0,0 +1,201 @@
+import os
+import json
+import time
+import shutil
+import logging
+import subprocess
+import concurrent.futures
+from config import *
+from media_catalog import get_media_catalog, probe_video_metadata, probe_audio_metadata
+from mp4_parser import probe_mp4_metadata, Mp4ParseError, MP4_EXTENSIONS
+from audio_headers import probe_audio_header_metadata, AudioHeaderError, AUDIO_HEADER_READERS
+
+
+def _parse_frame_rate(rate):
+    """Convert an ffprobe rational such as '30000/1001' to a float."""
+    try:
+        num, _, den = rate.partition('/')
+        num = float(num)
+        den = float(den) if den else 1.0
+        return num / den if num and den else None
+    except (AttributeError, ValueError):
+        return None
+
+
+def probe_with_ffprobe(file_path, kind='video'):
+    """Probe a media file with a single ffprobe JSON call and return its metadata."""
+    ffprobe_path = shutil.which('ffprobe')
+    if not ffprobe_path:
+        raise FileNotFoundError("ffprobe not found in PATH")
+
+    result = subprocess.run(
+        [ffprobe_path, '-v', 'error', '-print_format', 'json',
+         '-show_format', '-show_streams', file_path],
+        capture_output=True, text=True, timeout=FFPROBE_TIMEOUT
+    )
+    if result.returncode != 0:
+        raise ValueError(f"ffprobe failed for {file_path}: {result.stderr.strip()}")
+
+    info = json.loads(result.stdout or '{}')
+    streams = info.get('streams', [])
+    video_stream = next((s for s in streams if s.get('codec_type') == 'video'), None)
+    audio_stream = next((s for s in streams if s.get('codec_type') == 'audio'), None)
+
+    if kind == 'video' and not video_stream:
+        raise ValueError(f"No video stream found in {file_path}")
+    if kind == 'audio' and not audio_stream:
+        raise ValueError(f"No audio stream found in {file_path}")
+
+    duration = info.get('format', {}).get('duration')
+    if duration is None:
+        primary = video_stream if kind == 'video' else audio_stream
+        duration = primary.get('duration')
+
+    metadata = {
+        'duration': float(duration) if duration is not None else None,
+        'fps': None,
+        'width': None,
+        'height': None,
+        'codec': None,
+        'has_audio': audio_stream is not None,
+        'sample_rate': int(audio_stream['sample_rate']) if audio_stream and audio_stream.get('sample_rate') else None,
+        'channels': audio_stream.get('channels') if audio_stream else None
+    }
+
+    if kind == 'video':
+        metadata.update({
+            'fps': _parse_frame_rate(video_stream.get('avg_frame_rate')) or _parse_frame_rate(video_stream.get('r_frame_rate')),
+            'width': video_stream.get('width'),
+            'height': video_stream.get('height'),
+            'codec': video_stream.get('codec_name')
+        })
+    else:
+        metadata['codec'] = audio_stream.get('codec_name')
+
+    return metadata
+
+
+def probe_media(file_path, kind='video'):
+    """
+    Probe a media file, reading MP4/WAV/MP3/OGG headers directly when possible.
+    Falls back to ffprobe, then to MoviePy's FFmpeg parser.
+    """
+    if kind == 'video' and file_path.lower().endswith(MP4_EXTENSIONS):
+        try:
+            return probe_mp4_metadata(file_path)
+        except (Mp4ParseError, OSError) as e:
+            logging.info(f"MP4 header read failed for {file_path}, falling back to ffprobe: {e}")
+
+    if kind == 'audio' and file_path.lower().endswith(tuple(AUDIO_HEADER_READERS)):
+        try:
+            return probe_audio_header_metadata(file_path)
+        except (AudioHeaderError, OSError) as e:
+            logging.info(f"Audio header read failed for {file_path}, falling back to ffprobe: {e}")
+
+    try:
+        return probe_with_ffprobe(file_path, kind)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logging.info(f"ffprobe could not read {file_path}, falling back to FFmpeg info: {e}")
+
+    if kind == 'audio':
+        return probe_audio_metadata(file_path)
+    return probe_video_metadata(file_path)
+
+
+class MediaScanner:
+    """Concurrent media scanner backed by the persistent media catalog."""
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or SCAN_WORKERS
+
+    def new_stats(self, kind='video'):
+        """Return an empty per-call stats dict for iter_scan/scan to add to."""
+        return {
+            'kind': kind,
+            'files': 0,
+            'cached': 0,
+            'probed': 0,
+            'failed': 0,
+            'elapsed_seconds': 0.0,
+            'files_per_second': None,
+            'probe_workers': self.max_workers
+        }
+
+    def _stat_paths(self, paths):
+        """Return (path, realpath, size, mtime) for every path that still exists; the catalog is keyed by realpath."""
+        stats = []
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError as e:
+                logging.warning(f"Failed to stat {path}: {e}")
+                continue
+            stats.append((path, os.path.realpath(path), st.st_size, st.st_mtime))
+        return stats
+
+    def _probe_and_store(self, catalog, path, abspath, size, mtime, kind):
+        metadata = probe_media(path, kind)
+        if not metadata.get('duration'):
+            raise ValueError(f"Could not determine duration of {path}")
+        if catalog:
+            try:
+                catalog.store(abspath, size, mtime, kind, metadata)
+            except Exception as e:
+                logging.warning(f"Failed to store catalog entry for {path}: {e}")
+        return metadata
+
+    def iter_scan(self, paths, kind='video', stats=None):
+        """
+        Yield (path, metadata) pairs as each file is resolved, in completion order.
+        Counts and timing are added to stats (from new_stats) once the scan finishes.
+        """
+        start_time = time.time()
+        catalog = get_media_catalog()
+        cached = 0
+        probed = 0
+        failed = 0
+
+        pending = []
+        for path, abspath, size, mtime in self._stat_paths(paths):
+            metadata = catalog.lookup(abspath, size, mtime, kind) if catalog else None
+            if metadata:
+                cached += 1
+                yield path, metadata
+            else:
+                pending.append((path, abspath, size, mtime))
+
+        if pending:
+            workers = max(1, min(self.max_workers, len(pending)))
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = {
+                    executor.submit(self._probe_and_store, catalog, path, abspath, size, mtime, kind): path
+                    for path, abspath, size, mtime in pending
+                }
+                for future in concurrent.futures.as_completed(futures):
+                    path = futures[future]
+                    try:
+                        metadata = future.result()
+                    except Exception as e:
+                        failed += 1
+                        logging.warning(f"Failed to read {kind} {os.path.basename(path)}: {e}")
+                        continue
+                    probed += 1
+                    yield path, metadata
+
+        elapsed = time.time() - start_time
+        total = cached + probed + failed
+        if stats is not None:
+            stats['files'] += total
+            stats['cached'] += cached
+            stats['probed'] += probed
+            stats['failed'] += failed
+            stats['elapsed_seconds'] = round(stats['elapsed_seconds'] + elapsed, 3)
+            if stats['elapsed_seconds'] > 0:
+                stats['files_per_second'] = round(stats['files'] / stats['elapsed_seconds'], 1)
+        logging.info(f"Scanned {total} {kind} files ({cached} cached, {probed} probed, {failed} failed) in {elapsed:.2f}s")
+
+    def scan(self, paths, kind='video', stats=None):
+        """Return {path: metadata} for all readable files."""
+        return dict(self.iter_scan(paths, kind, stats))
@@ -8,6 +8,11 @@ import logging
 from werkzeug.utils import secure_filename
 from moviepy.editor import VideoFileClip, AudioFileClip
 from config import *
+from encoder_registry import is_gpu_acceleration_available
+from resource_scheduler import get_resource_scheduler
+from ffmpeg_engine import remux_with_audio, mix_voice_over, mux_pcm_stream, report_gpu_failure, FfmpegError
+from audio_cache import audio_cache, get_cached_audio, snap_to_aac_frame
+from pcm_cache import pcm_cache, get_cached_pcm, load_pcm, iter_mix_blocks
 
 ALLOWED_VIDEO_EXTENSIONS = {'mp4', 'webm'}
 ALLOWED_AUDIO_EXTENSIONS = {'mp3', 'ogg'}
@@ -18,88 +23,6 @@ def allowed_video_file(filename):
 def allowed_audio_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_AUDIO_EXTENSIONS
 
-def is_gpu_acceleration_available():
-    """Check if GPU acceleration is available."""
-    if not ENABLE_GPU_ACCELERATION:
-        return False
-    
-    try:
-        import shutil
-        import tempfile
-        import os
-        
-        # Check if ffmpeg is available
-        ffmpeg_path = shutil.which('ffmpeg')
-        if not ffmpeg_path:
-            logging.info("FFmpeg not found in PATH")
-            return False
-        
-        logging.info(f"FFmpeg found at: {ffmpeg_path}")
-        
-        # Run ffmpeg to check for GPU encoders
-        result = subprocess.run([ffmpeg_path, '-encoders'], capture_output=True, text=True)
-        if result.returncode != 0:
-            logging.warning(f"FFmpeg command failed with return code: {result.returncode}")
-            return False
-        
-        # Check if GPU codec is available
-        gpu_available = GPU_CODEC in result.stdout
-        logging.info(f"GPU codec {GPU_CODEC} available: {gpu_available}")
-        
-        # List available encoders for debugging
-        available_encoders = [line.split()[1] for line in result.stdout.split('\n') if 'encoding:' in line and 'V' in line.split('\t')]
-        logging.info(f"Available video encoders: {available_encoders[:10]}...")  # Show first 10
-        
-        if not gpu_available:
-            return False
-        
-        # Test if GPU encoding actually works by creating a test video
-        logging.info("Testing GPU encoding with a short test video...")
-        with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as temp_file:
-            temp_path = temp_file.name
-        
-        try:
-            # Create a simple test video using GPU encoding
-            test_cmd = [
-                ffmpeg_path,
-                '-f', 'lavfi',
-                '-i', 'testsrc=duration=1:size=320x240:rate=1',
-                '-c:v', GPU_CODEC,
-                '-preset', GPU_ENCODING_PRESET,
-                '-b:v', '500k',
-                '-y',  # Overwrite output file if it exists
-                temp_path
-            ]
-            
-            test_result = subprocess.run(test_cmd, capture_output=True, text=True)
-            
-            # Clean up temp file
-            try:
-                os.unlink(temp_path)
-            except:
-                pass
-            
-            if test_result.returncode == 0:
-                logging.info("GPU encoding test successful")
-                return True
-            else:
-                logging.warning(f"GPU encoding test failed with return code: {test_result.returncode}")
-                logging.warning(f"GPU encoding test stderr: {test_result.stderr}")
-                return False
-                
-        except Exception as test_error:
-            logging.warning(f"Error during GPU encoding test: {test_error}")
-            # Clean up temp file if it exists
-            try:
-                os.unlink(temp_path)
-            except:
-                pass
-            return False
-            
-    except Exception as e:
-        logging.warning(f"Error checking GPU acceleration availability: {e}")
-        return False
-
 def validate_and_upload_single(video_file, audio_file, upload_folder, job_id):
     """
     Validate and upload single video and audio files, return paths.
@@ -158,9 +81,51 @@ def validate_and_upload_batch(videos, audios, upload_folder, batch_id):
     
     return batch_jobs
 
+def choose_audio_start(audio_duration, video_duration, audio_trim_mode='fixed'):
+    """Start of the audio window: 0 in fixed mode, random within the spare audio in random mode."""
+    if audio_duration > video_duration and audio_trim_mode == 'random':
+        return random.uniform(0, audio_duration - video_duration)
+    return 0
+
+def remux_video_audio(video_path, audio_path, output_path, audio_trim_mode='fixed'):
+    """
+    Replace the soundtrack by stream-copying the video and encoding only the trimmed audio.
+    With ENABLE_AUDIO_CACHE the audio is transcoded once per library file and then copied too,
+    with the start snapped to an AAC frame boundary.
+    The output keeps the video's duration; shorter audio simply ends early, as with MoviePy.
+    """
+    from media_catalog import get_media_metadata
+    
+    video_duration = get_media_metadata(video_path, 'video')['duration']
+    audio_duration = get_media_metadata(audio_path, 'audio')['duration']
+    start_time = choose_audio_start(audio_duration, video_duration, audio_trim_mode)
+    
+    source_path = audio_path
+    cache_key = None
+    if ENABLE_AUDIO_CACHE:
+        try:
+            cache_key, cached_path = get_cached_audio(audio_path)
+            if cached_path:
+                source_path = cached_path
+                start_time = snap_to_aac_frame(start_time)
+        except (FfmpegError, ValueError, OSError) as e:
+            logging.warning(f"Could not cache {audio_path} as AAC, encoding it for this merge: {e}")
+    copy_audio = source_path != audio_path
+    duration = min(video_duration, audio_duration - start_time)
+    
+    try:
+        with get_resource_scheduler().reserve('video+audio remux', threads=1):
+            remux_with_audio(video_path, source_path, output_path, duration, start_time, copy_audio)
+    finally:
+        if copy_audio:
+            audio_cache.release(cache_key)
+    logging.info(f"Remuxed {video_path} with audio {start_time:.2f}s to {start_time + duration:.2f}s")
+    return output_path
+
 def process_video_audio(job_id, video_path, audio_path, output_folder, processing_status, audio_trim_mode='fixed'):
     """
     Process single video+audio pair, update status, return output_path.
+    With VIDEO_AUDIO_ENGINE 'remux' the video stream is copied and MoviePy is only the fallback.
     Raises Exception on errors.
     """
     try:
@@ -168,6 +133,18 @@ def process_video_audio(job_id, video_path, audio_path, output_folder, processin
         if job_id in processing_status:
             processing_status[job_id]['progress'] = 10
         
+        if VIDEO_AUDIO_ENGINE == 'remux':
+            output_path = os.path.join(output_folder, f"merged_{job_id}.mp4")
+            try:
+                remux_video_audio(video_path, audio_path, output_path, audio_trim_mode)
+                if job_id in processing_status:
+                    processing_status[job_id]['progress'] = 100
+                    processing_status[job_id]['status'] = 'completed'
+                    processing_status[job_id]['output_path'] = output_path
+                return output_path
+            except (FfmpegError, ValueError, OSError) as e:
+                logging.warning(f"Stream-copy remux failed for {video_path}, re-encoding with MoviePy: {e}")
+        
         # Load video and audio clips
         video_clip = VideoFileClip(video_path)
         audio_clip = AudioFileClip(audio_path)
@@ -220,6 +197,7 @@ def process_video_audio(job_id, video_path, audio_path, output_folder, processin
         # Determine codec based on GPU availability
         use_gpu = is_gpu_acceleration_available()
         codec = GPU_CODEC if use_gpu else FALLBACK_CPU_CODEC
+        gpu_failure = None
         
         # Set encoding parameters based on GPU availability
         if use_gpu:
@@ -237,10 +215,12 @@ def process_video_audio(job_id, video_path, audio_path, output_folder, processin
             # Try GPU encoding first with fallback to CPU
             try:
                 # Export the final video with GPU parameters
-                final_video.write_videofile(output_path, **encoding_params)
+                with get_resource_scheduler().reserve('video+audio encode (GPU)') as threads:
+                    final_video.write_videofile(output_path, threads=threads, **encoding_params)
                 logging.info(f"Successfully merged video with audio using GPU acceleration")
             except Exception as gpu_error:
                 logging.warning(f"GPU encoding failed for video+audio merge: {str(gpu_error)}")
+                gpu_failure = gpu_error
                 logging.info("Falling back to CPU encoding for video+audio merge")
                 
                 # Close and reload the clips to ensure clean state
@@ -278,14 +258,16 @@ def process_video_audio(job_id, video_path, audio_path, output_folder, processin
                 'audio_codec': 'aac',
                 'bitrate': VIDEO_BITRATE,
                 'verbose': False,
-                'logger': None,
-                'threads': MAX_WORKERS
+                'logger': None
             }
             logging.info(f"Using CPU-based encoding with codec: {FALLBACK_CPU_CODEC}")
             
             # Export the final video with CPU parameters
-            final_video.write_videofile(output_path, **encoding_params)
+            with get_resource_scheduler().reserve('video+audio encode') as threads:
+                final_video.write_videofile(output_path, threads=threads, **encoding_params)
             logging.info(f"Successfully merged video with audio using CPU encoding")
+            if gpu_failure:
+                report_gpu_failure(gpu_failure)
         
         if job_id in processing_status:
             processing_status[job_id]['progress'] = 100
@@ -352,9 +334,62 @@ def start_processing_thread(job_id, video_path, audio_path, output_folder, proce
     cleanup_starter.daemon = True
     cleanup_starter.start()
 
+def mix_voice_with_ffmpeg(video_path, audio_path, output_path, original_audio_volume=30):
+    """
+    Add voice audio with a stream-copied video trimmed to the shorter of video and voice.
+    The original audio is kept at original_audio_volume percent, as in the MoviePy path.
+    """
+    from media_catalog import get_media_metadata
+    
+    video_metadata = get_media_metadata(video_path, 'video')
+    voice_duration = get_media_metadata(audio_path, 'audio')['duration']
+    final_duration = min(video_metadata['duration'], voice_duration)
+    original_volume = original_audio_volume / 100.0 if video_metadata.get('has_audio') else None
+    
+    with get_resource_scheduler().reserve('video+voice mix', threads=1):
+        mix_voice_over(video_path, audio_path, output_path, final_duration, original_volume)
+    logging.info(f"Mixed voice into {video_path} with stream copy, {final_duration:.2f}s")
+    return output_path
+
+def mix_voice_with_numpy(video_path, audio_path, output_path, original_audio_volume=30):
+    """
+    Same mix as mix_voice_with_ffmpeg, but summed with NumPy from memory-mapped PCM cache
+    entries and piped to the encoder, so repeated voices and videos are decoded only once.
+    """
+    from media_catalog import get_media_metadata
+    
+    video_metadata = get_media_metadata(video_path, 'video')
+    voice_duration = get_media_metadata(audio_path, 'audio')['duration']
+    final_duration = min(video_metadata['duration'], voice_duration)
+    
+    sources = [(audio_path, 1.0)]
+    if video_metadata.get('has_audio'):
+        sources.insert(0, (video_path, original_audio_volume / 100.0))
+    
+    leased_keys = []
+    try:
+        tracks = []
+        for path, gain in sources:
+            key, pcm_path = get_cached_pcm(path)
+            if not pcm_path:
+                raise ValueError(f"Could not decode {path} into the PCM cache")
+            leased_keys.append(key)
+            tracks.append((load_pcm(pcm_path), gain))
+        
+        frames = int(round(final_duration * AUDIO_SAMPLE_RATE))
+        with get_resource_scheduler().reserve('video+voice mix', threads=1):
+            mux_pcm_stream(video_path, iter_mix_blocks(tracks, frames), output_path, final_duration)
+    finally:
+        for key in leased_keys:
+            pcm_cache.release(key)
+    logging.info(f"Mixed voice into {video_path} with NumPy, {final_duration:.2f}s")
+    return output_path
+
 def merge_video_with_voice(video_path, audio_path, output_folder, progress_callback=None, original_audio_volume=30):
     """
     Merge video with voice audio, adjusting original video audio volume and trimming video to match audio duration.
+    With VOICE_MIX_ENGINE 'numpy' or 'ffmpeg' only the audio is encoded; 'numpy' falls back
+    to 'ffmpeg', and MoviePy is the last resort.
     Returns output_path.
     Raises Exception on errors.
     """
@@ -362,6 +397,19 @@ def merge_video_with_voice(video_path, audio_path, output_folder, progress_callb
         if progress_callback:
             progress_callback(10, "Loading video and audio files...")
         
+        mixers = {'numpy': [mix_voice_with_numpy, mix_voice_with_ffmpeg], 'ffmpeg': [mix_voice_with_ffmpeg]}
+        for mixer in mixers.get(VOICE_MIX_ENGINE, []):
+            output_path = os.path.join(output_folder, f"voice_added_{uuid.uuid4()}.mp4")
+            try:
+                if progress_callback:
+                    progress_callback(40, "Mixing audio tracks...")
+                mixer(video_path, audio_path, output_path, original_audio_volume)
+                if progress_callback:
+                    progress_callback(100, "Processing completed!")
+                return output_path
+            except (FfmpegError, ValueError, OSError) as e:
+                logging.warning(f"Stream-copy voice mix with {mixer.__name__} failed for {video_path}: {e}")
+        
         # Load video and audio clips
         video_clip = VideoFileClip(video_path)
         voice_audio_clip = AudioFileClip(audio_path)
@@ -440,6 +488,7 @@ def merge_video_with_voice(video_path, audio_path, output_folder, progress_callb
         # Determine codec based on GPU availability
         use_gpu = is_gpu_acceleration_available()
         codec = GPU_CODEC if use_gpu else FALLBACK_CPU_CODEC
+        gpu_failure = None
         
         # Set encoding parameters based on GPU availability
         if use_gpu:
@@ -457,10 +506,12 @@ def merge_video_with_voice(video_path, audio_path, output_folder, progress_callb
             # Try GPU encoding first with fallback to CPU
             try:
                 # Export the final video with GPU parameters
-                final_video.write_videofile(output_path, **encoding_params)
+                with get_resource_scheduler().reserve('video+voice encode (GPU)') as threads:
+                    final_video.write_videofile(output_path, threads=threads, **encoding_params)
                 logging.info(f"Successfully merged video with voice using GPU acceleration")
             except Exception as gpu_error:
                 logging.warning(f"GPU encoding failed for video+voice merge: {str(gpu_error)}")
+                gpu_failure = gpu_error
                 logging.info("Falling back to CPU encoding for video+voice merge")
                 
                 # Close and reload the clips to ensure clean state
@@ -523,14 +574,16 @@ def merge_video_with_voice(video_path, audio_path, output_folder, progress_callb
                 'audio_codec': 'aac',
                 'bitrate': VIDEO_BITRATE,
                 'verbose': False,
-                'logger': None,
-                'threads': MAX_WORKERS
+                'logger': None
             }
             logging.info(f"Using CPU-based encoding for voice merge with codec: {FALLBACK_CPU_CODEC}")
             
             # Export the final video with CPU parameters
-            final_video.write_videofile(output_path, **encoding_params)
+            with get_resource_scheduler().reserve('video+voice encode') as threads:
+                final_video.write_videofile(output_path, threads=threads, **encoding_params)
             logging.info(f"Successfully merged video with voice using CPU encoding")
+            if gpu_failure:
+                report_gpu_failure(gpu_failure)
         
         if progress_callback:
             progress_callback(90, "Finalizing...")
@@ -5,12 +5,20 @@ import uuid
 import hashlib
 import shutil
 import concurrent.futures
+import multiprocessing
+import threading
 import time
 from datetime import datetime, timedelta
 from moviepy.editor import VideoFileClip, concatenate_videoclips, vfx
 from moviepy.video.io.ffmpeg_tools import ffmpeg_extract_subclip
 from werkzeug.utils import secure_filename
 from config import *
+from encoder_registry import is_gpu_acceleration_available
+from resource_scheduler import get_resource_scheduler
+from mp4_parser import read_mp4_info, Mp4ParseError
+from cache_manager import CacheManager, get_source_identity
+from ffmpeg_engine import (normalize_with_ffmpeg, merge_single_pass, trim_bounds, concat_copy, smart_render, cut_segment,
+                           report_gpu_failure, capture_gpu_failures, FfmpegError)
 
 # Patch for Pillow compatibility with MoviePy
 try:
@@ -27,134 +35,75 @@ ALLOWED_EXTENSIONS = {'mp4'}
 # Create cache folder if it doesn't exist
 os.makedirs(VIDEO_CACHE_FOLDER, exist_ok=True)
 
-# GPU acceleration check
-def is_gpu_acceleration_available():
-    """Check if GPU acceleration is available."""
-    if not ENABLE_GPU_ACCELERATION:
-        return False
-    
-    try:
-        import subprocess
-        import shutil
-        import tempfile
-        import os
-        
-        # Check if ffmpeg is available
-        ffmpeg_path = shutil.which('ffmpeg')
-        if not ffmpeg_path:
-            logging.info("FFmpeg not found in PATH")
-            return False
-        
-        logging.info(f"FFmpeg found at: {ffmpeg_path}")
-        
-        # Run ffmpeg to check for GPU encoders
-        result = subprocess.run([ffmpeg_path, '-encoders'], capture_output=True, text=True)
-        if result.returncode != 0:
-            logging.warning(f"FFmpeg command failed with return code: {result.returncode}")
-            return False
-        
-        # Check if GPU codec is available
-        gpu_available = GPU_CODEC in result.stdout
-        logging.info(f"GPU codec {GPU_CODEC} available: {gpu_available}")
-        
-        # List available encoders for debugging
-        available_encoders = [line.split()[1] for line in result.stdout.split('\n') if 'encoding:' in line and 'V' in line.split('\t')]
-        logging.info(f"Available video encoders: {available_encoders[:10]}...")  # Show first 10
-        
-        if not gpu_available:
-            return False
-        
-        # Test if GPU encoding actually works by creating a test video
-        logging.info("Testing GPU encoding with a short test video...")
-        with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as temp_file:
-            temp_path = temp_file.name
-        
-        try:
-            # Create a simple test video using GPU encoding
-            test_cmd = [
-                ffmpeg_path,
-                '-f', 'lavfi',
-                '-i', 'testsrc=duration=1:size=320x240:rate=1',
-                '-c:v', GPU_CODEC,
-                '-preset', GPU_ENCODING_PRESET,
-                '-b:v', '500k',
-                '-y',  # Overwrite output file if it exists
-                temp_path
-            ]
-            
-            test_result = subprocess.run(test_cmd, capture_output=True, text=True)
-            
-            # Clean up temp file
-            try:
-                os.unlink(temp_path)
-            except:
-                pass
-            
-            if test_result.returncode == 0:
-                logging.info("GPU encoding test successful")
-                return True
-            else:
-                logging.warning(f"GPU encoding test failed with return code: {test_result.returncode}")
-                logging.warning(f"GPU encoding test stderr: {test_result.stderr}")
-                return False
-                
-        except Exception as test_error:
-            logging.warning(f"Error during GPU encoding test: {test_error}")
-            # Clean up temp file if it exists
-            try:
-                os.unlink(temp_path)
-            except:
-                pass
-            return False
-            
-    except Exception as e:
-        logging.warning(f"Error checking GPU acceleration availability: {e}")
-        return False
+# Size-bounded cache of normalized segments
+video_cache = CacheManager(VIDEO_CACHE_FOLDER, VIDEO_CACHE_MAX_BYTES, CACHE_EVICTION_POLICY, name='video cache')
+
+# Full-length normalized sources that random trims are cut from
+mezzanine_cache = CacheManager(MEZZANINE_CACHE_FOLDER, MEZZANINE_CACHE_MAX_BYTES, CACHE_EVICTION_POLICY, name='mezzanine cache')
+
+# Worker processes for SEGMENT_EXECUTION_MODE = 'process'
+_segment_pool = None
+_segment_pool_lock = threading.Lock()
 
 # Cache cleanup function
 def cleanup_old_cache_files():
-    """Remove cache files older than CLEANUP_CACHE_DAYS."""
+    """Remove cache files not used for CLEANUP_CACHE_DAYS."""
     if not ENABLE_CACHING:
         return
         
     try:
-        now = time.time()
-        cutoff_time = now - (CLEANUP_CACHE_DAYS * 86400)  # 86400 seconds = 1 day
-        
-        for filename in os.listdir(VIDEO_CACHE_FOLDER):
-            file_path = os.path.join(VIDEO_CACHE_FOLDER, filename)
-            if os.path.isfile(file_path):
-                file_mtime = os.path.getmtime(file_path)
-                if file_mtime < cutoff_time:
-                    os.remove(file_path)
-                    logging.info(f"Removed old cache file: {filename}")
+        video_cache.cleanup_older_than(CLEANUP_CACHE_DAYS)
+        mezzanine_cache.cleanup_older_than(CLEANUP_CACHE_DAYS)
     except Exception as e:
         logging.warning(f"Error cleaning up cache files: {e}")
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def get_video_hash(file_path, trim_info=None):
-    """Generate a hash for a video file based on its path and trim info."""
-    hash_input = file_path
+def get_segment_codec():
+    """Return the encoder new segments are encoded with, following the live encoder registry."""
+    return GPU_CODEC if is_gpu_acceleration_available() else FALLBACK_CPU_CODEC
+
+def get_encode_signature(codec=None):
+    """Describe every encode setting that changes the normalized output."""
+    codec = codec or get_segment_codec()
+    return (f"{NORMALIZE_ENGINE}_gop{NORMALIZE_GOP_SECONDS}_pt{ENABLE_PASSTHROUGH}_h{TARGET_HEIGHT}_w{TARGET_WIDTH}_fps{TARGET_FPS}_{codec}_{VIDEO_PRESET}_{GPU_ENCODING_PRESET}"
+            f"_q{VIDEO_QUALITY}_crf{CRF_VALUE}_{VIDEO_BITRATE}_{GPU_BITRATE}_a{AUDIO_SAMPLE_RATE}_{AUDIO_CHANNELS}_{AUDIO_BITRATE}")
+
+def get_video_hash(file_path, trim_info=None, codec=None):
+    """Generate a cache key from the source identity, trim and encode settings."""
+    hash_input = get_source_identity(file_path)
     if trim_info:
-        hash_input += f"_{trim_info.get('start', 0)}_{trim_info.get('end', 'full')}"
+        start = float(trim_info.get('start', 0))
+        end = f"{float(trim_info['end']):.3f}" if trim_info.get('end') else 'full'
+        hash_input += f"_{start:.3f}_{end}"
+    hash_input += f"_{get_encode_signature(codec)}"
     
     return hashlib.md5(hash_input.encode()).hexdigest()
 
-def get_cache_path(file_hash):
-    """Get the cache file path for a given hash."""
-    return os.path.join(VIDEO_CACHE_FOLDER, f"{file_hash}.mp4")
-
-def is_video_cached(file_hash):
-    """Check if a video is already cached."""
-    if not ENABLE_CACHING:
-        return False
-    cache_path = get_cache_path(file_hash)
-    return os.path.exists(cache_path)
+def get_mezzanine_hash(file_path, codec=None):
+    """Generate the mezzanine cache key for a whole source."""
+    hash_input = f"mezzanine_{get_source_identity(file_path)}_{get_encode_signature(codec)}"
+    return hashlib.md5(hash_input.encode()).hexdigest()
 
 def validate_video(file_path):
     """Validate video file and return metadata."""
+    try:
+        info = read_mp4_info(file_path)
+        if info['has_video']:
+            if not info.get('fps') or not info.get('width') or not info.get('duration'):
+                return None
+            return {
+                'fps': info['fps'],
+                'size': [info['width'], info['height']],
+                'duration': info['duration']
+            }
+    except Mp4ParseError as e:
+        logging.info(f"MP4 header read failed for {file_path}, falling back to FFmpeg: {e}")
+    except OSError as e:
+        logging.warning(f"Failed to validate video {file_path}: {e}")
+        return None
+    
     try:
         with VideoFileClip(file_path) as clip:
             if clip.fps == 0 or clip.size[0] == 0 or clip.duration == 0:
@@ -169,8 +118,160 @@ def validate_video(file_path):
         logging.warning(f"Failed to validate video {file_path}: {e}")
         return None
 
-def normalize_video(input_path, output_path, trim_info=None):
-    """Normalize video to standard format, fps, and resolution."""
+_segment_stats_lock = threading.Lock()
+
+def record_segment_stat(stats, path_taken):
+    """Count how a segment was produced in a per-job stats dict."""
+    if stats is None:
+        return
+    with _segment_stats_lock:
+        stats[path_taken] = stats.get(path_taken, 0) + 1
+
+def source_conforms(info):
+    """Check whether probed MP4 info already matches the target video and audio profile."""
+    if not info.get('has_video') or info.get('codec') not in PASSTHROUGH_CODECS:
+        return False
+    # Encoded segments are 8-bit yuv420p with SAR 1; anything else would mix formats in one output
+    if info.get('profile') not in PASSTHROUGH_PROFILES or info.get('chroma_format') != 1 or info.get('bit_depth') != 8:
+        return False
+    sar = info.get('sar')
+    if sar and sar[0] != sar[1]:
+        return False
+    if info.get('height') != TARGET_HEIGHT or (TARGET_WIDTH and info.get('width') != TARGET_WIDTH):
+        return False
+    if not info.get('fps') or abs(info['fps'] - TARGET_FPS) > PASSTHROUGH_FPS_TOLERANCE:
+        return False
+    return (info.get('has_audio') and info.get('audio_codec') == 'aac'
+            and info.get('sample_rate') == AUDIO_SAMPLE_RATE and info.get('channels') == AUDIO_CHANNELS)
+
+def passthrough_video(input_path, output_path, trim_info=None, threads=None, use_gpu=False):
+    """
+    Trim a conforming source by stream copy. Returns False when the source does not conform
+    or the trim does not start on (or within PASSTHROUGH_KEYFRAME_SNAP of) a keyframe.
+    """
+    try:
+        info = read_mp4_info(input_path, include_keyframes=True)
+    except (Mp4ParseError, OSError) as e:
+        logging.info(f"Pass-through check skipped for {os.path.basename(input_path)}: {e}")
+        return False
+    if not source_conforms(info):
+        return False
+    
+    start, duration = trim_bounds(trim_info)
+    keyframes = info['keyframes']
+    snapped = max((t for t in keyframes if t <= start), default=None)
+    if snapped is not None and start - snapped <= PASSTHROUGH_KEYFRAME_SNAP:
+        start = snapped
+    elif not any(abs(t - start) <= 0.5 / TARGET_FPS for t in keyframes):
+        # A re-encoded head would carry the encoder's SPS/PPS, not the copied body's
+        logging.info(f"Pass-through skipped for {os.path.basename(input_path)}: trim start {start:.3f}s is not near a keyframe")
+        return False
+    if duration is None:
+        duration = info['duration'] - start
+    
+    try:
+        method = cut_segment(input_path, start, duration, output_path, keyframes, use_gpu, threads)
+    except FfmpegError as e:
+        logging.warning(f"Pass-through trim failed for {os.path.basename(input_path)}: {e}")
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        return False
+    logging.info(f"Passed {os.path.basename(input_path)} through without transcoding ({method})")
+    return True
+
+def _init_segment_worker():
+    # Forked workers must not share the parent's SQLite connection
+    from media_catalog import reset_media_catalog
+    reset_media_catalog()
+
+def get_segment_pool_size():
+    return SEGMENT_PROCESS_WORKERS or get_resource_scheduler().pool_size()
+
+def get_segment_process_pool():
+    """Return the shared pool of segment worker processes, creating it on first use."""
+    global _segment_pool
+    with _segment_pool_lock:
+        if _segment_pool is None:
+            workers = get_segment_pool_size()
+            # Fork so workers inherit the loaded modules instead of re-running their startup code
+            _segment_pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('fork'),
+                initializer=_init_segment_worker
+            )
+            logging.info(f"Started segment process pool with {workers} workers")
+        return _segment_pool
+
+def reset_segment_process_pool(broken_pool):
+    """Drop a broken segment pool so the next segment starts a fresh one."""
+    global _segment_pool
+    with _segment_pool_lock:
+        # Another thread may already have replaced it
+        if _segment_pool is not broken_pool:
+            return
+        _segment_pool = None
+    broken_pool.shutdown(wait=False)
+
+def warm_segment_process_pool():
+    """Start every segment worker up front; call at startup before other threads are running."""
+    if SEGMENT_EXECUTION_MODE != 'process':
+        return
+    pool = get_segment_process_pool()
+    pids = {future.result() for future in [pool.submit(os.getpid) for _ in range(get_segment_pool_size() * 2)]}
+    logging.info(f"Segment process pool warmed ({len(pids)} processes)")
+
+def normalize_segment(input_path, output_path, trim_info, use_gpu, threads, allow_passthrough=True):
+    """
+    Produce one normalized segment with explicit encoder settings; runs in a thread or worker process.
+    Returns (method, gpu_error): GPU failures are returned rather than reported, because a
+    worker's encoder registry is not the one the parent consults.
+    """
+    with capture_gpu_failures() as gpu_errors:
+        method = _normalize_segment(input_path, output_path, trim_info, use_gpu, threads, allow_passthrough)
+    return method, (gpu_errors[0] if gpu_errors else None)
+
+def _normalize_segment(input_path, output_path, trim_info, use_gpu, threads, allow_passthrough=True):
+    if NORMALIZE_ENGINE == 'ffmpeg':
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        if ENABLE_PASSTHROUGH and allow_passthrough and passthrough_video(input_path, output_path, trim_info, threads, use_gpu):
+            return 'passthrough'
+        if normalize_with_ffmpeg(input_path, output_path, trim_info, use_gpu, threads):
+            return 'ffmpeg'
+        logging.warning(f"ffmpeg normalization failed for {os.path.basename(input_path)}, falling back to MoviePy")
+    
+    return 'moviepy' if normalize_video_moviepy(input_path, output_path, trim_info, threads, use_gpu) else False
+
+def normalize_video(input_path, output_path, trim_info=None, allow_passthrough=True):
+    """
+    Normalize video to standard format, fps, and resolution.
+    Returns how the segment was produced ('passthrough', 'ffmpeg' or 'moviepy'), or False on failure.
+    """
+    if not os.path.exists(input_path):
+        logging.error(f"Input file does not exist: {input_path}")
+        return False
+    
+    with get_resource_scheduler().reserve(f"normalize {os.path.basename(input_path)}") as threads:
+        use_gpu = is_gpu_acceleration_available()
+        if SEGMENT_EXECUTION_MODE == 'process':
+            try:
+                pool = get_segment_process_pool()
+                future = pool.submit(
+                    normalize_segment, input_path, output_path, trim_info, use_gpu, threads, allow_passthrough)
+                method, gpu_error = future.result()
+            except concurrent.futures.process.BrokenProcessPool as e:
+                logging.warning(f"Segment process pool is broken, encoding in this thread: {e}")
+                reset_segment_process_pool(pool)
+                method, gpu_error = normalize_segment(input_path, output_path, trim_info, use_gpu, threads, allow_passthrough)
+        else:
+            method, gpu_error = normalize_segment(input_path, output_path, trim_info, use_gpu, threads, allow_passthrough)
+    
+    if gpu_error:
+        report_gpu_failure(gpu_error)
+    return method
+
+def normalize_video_moviepy(input_path, output_path, trim_info=None, threads=None, use_gpu=None):
+    """Normalize video through MoviePy's frame pipeline (fallback engine)."""
+    threads = threads or MAX_WORKERS
     import threading
     thread_id = threading.get_ident()
     logging.info(f"Thread {thread_id}: Starting normalization of {os.path.basename(input_path)}")
@@ -226,8 +327,10 @@ def normalize_video(input_path, output_path, trim_info=None):
                     bitrate = '4000k'
                 
                 # Determine codec based on GPU availability
-                use_gpu = is_gpu_acceleration_available()
+                if use_gpu is None:
+                    use_gpu = is_gpu_acceleration_available()
                 codec = GPU_CODEC if use_gpu else FALLBACK_CPU_CODEC
+                gpu_failure = None
                 
                 # Set encoding parameters based on GPU availability
                 if use_gpu:
@@ -251,6 +354,7 @@ def normalize_video(input_path, output_path, trim_info=None):
                         return True
                     except Exception as gpu_error:
                         logging.warning(f"Thread {thread_id}: GPU encoding failed: {str(gpu_error)}")
+                        gpu_failure = gpu_error
                         logging.info(f"Thread {thread_id}: Falling back to CPU encoding")
                         
                         # Close and reload the clip to ensure clean state
@@ -285,14 +389,17 @@ def normalize_video(input_path, output_path, trim_info=None):
                         'bitrate': bitrate,
                         'verbose': False,
                         'logger': None,
-                        'threads': MAX_WORKERS
+                        'threads': threads
                     }
-                    logging.info(f"Thread {thread_id}: Using CPU-based encoding with {MAX_WORKERS} threads and codec: {FALLBACK_CPU_CODEC}")
+                    logging.info(f"Thread {thread_id}: Using CPU-based encoding with {threads} threads and codec: {FALLBACK_CPU_CODEC}")
                     
                     # Write normalized video with CPU parameters
                     logging.info(f"Thread {thread_id}: Writing normalized video to {output_path} using CPU")
                     clip.write_videofile(output_path, **encoding_params)
                     logging.info(f"Thread {thread_id}: Completed CPU normalization of {os.path.basename(input_path)}")
+                    if gpu_failure:
+                        # The CPU encoder handled the same clip, so the failure was the GPU's
+                        report_gpu_failure(gpu_failure)
                     return True
         except Exception as clip_error:
             logging.error(f"Thread {thread_id}: Error processing video clip from {input_path}: {clip_error}")
@@ -301,7 +408,7 @@ def normalize_video(input_path, output_path, trim_info=None):
         logging.error(f"Thread {thread_id}: Failed to normalize video {input_path}: {e}")
         return False
 
-def process_video_task(file_path, trim_info, output_dir):
+def process_video_task(file_path, trim_info, output_dir, stats=None):
     """Process a single video task with caching and normalization."""
     import threading
     thread_id = threading.get_ident()
@@ -315,41 +422,110 @@ def process_video_task(file_path, trim_info, output_dir):
         # Ensure output directory exists
         os.makedirs(VIDEO_CACHE_FOLDER, exist_ok=True)
         
-        file_hash = get_video_hash(file_path, trim_info)
-        cache_path = get_cache_path(file_hash)
+        filled = []
+        uncached = []
         
-        # Check if video is already cached
-        if is_video_cached(file_hash):
-            logging.info(f"Thread {thread_id}: Using cached video for {file_path}")
-            return cache_path
-        
-        # Validate video
-        metadata = validate_video(file_path)
-        if not metadata:
-            raise ValueError(f'Invalid video: {file_path}')
-        
-        # Log video metadata for debugging
-        logging.info(f"Thread {thread_id}: Processing video: {file_path}, metadata: {metadata}")
+        def fill(temp_path):
+            # Validate video
+            metadata = validate_video(file_path)
+            if not metadata:
+                raise ValueError(f'Invalid video: {file_path}')
+            
+            # Log video metadata for debugging
+            logging.info(f"Thread {thread_id}: Processing video: {file_path}, metadata: {metadata}")
+            method = normalize_video(file_path, temp_path, trim_info)
+            filled.append(method)
+            if method and get_segment_codec() != codec:
+                # The GPU failed during this encode, so the file is a CPU encode that must not be
+                # cached under the GPU key; hand it to this merge as a per-job cut instead
+                cut_path = os.path.join(output_dir, f"cut_{uuid.uuid4()}.mp4")
+                os.replace(temp_path, cut_path)
+                uncached.append(cut_path)
+                return False
+            return method
         
-        # Normalize video with fallback to original file if normalization fails
-        if normalize_video(file_path, cache_path, trim_info):
-            # Verify the output file was created successfully
-            if os.path.exists(cache_path) and os.path.getsize(cache_path) > 0:
-                logging.info(f"Thread {thread_id}: Successfully normalized video: {file_path}")
+        # Concurrent requests for the same segment share one encode; the returned
+        # entry is leased until the merge releases it. If the encoder changes while
+        # waiting on another fill, look again under the new encoder's key.
+        for _ in range(2):
+            codec = get_segment_codec()
+            file_hash = get_video_hash(file_path, trim_info, codec)
+            cache_path = video_cache.get_or_fill(file_hash, fill, lease=True, refresh=not ENABLE_CACHING)
+            if cache_path:
+                record_segment_stat(stats, 'passthrough' if filled == ['passthrough'] else 'encoded' if filled else 'cached')
+                logging.info(f"Thread {thread_id}: Using normalized video {os.path.basename(cache_path)} for {file_path}")
                 return cache_path
-            else:
-                logging.warning(f"Thread {thread_id}: Normalized video file is empty or not created: {cache_path}")
-                # Fall back to using the original file
-                return file_path
-        else:
-            logging.warning(f"Thread {thread_id}: Failed to normalize video {file_path}, using original file")
-            # Fall back to using the original file
-            return file_path
+            if uncached:
+                record_segment_stat(stats, 'encoded')
+                return uncached[0]
+            if filled or get_segment_codec() == codec:
+                break
+        
+        record_segment_stat(stats, 'original')
+        logging.warning(f"Thread {thread_id}: Failed to normalize video {file_path}, using original file")
+        # Fall back to using the original file
+        return file_path
     except Exception as e:
+        record_segment_stat(stats, 'original')
         logging.error(f"Thread {thread_id}: Error in process_video_task for {file_path}: {e}")
         # Fall back to using the original file
         return file_path
 
+def process_mezzanine_task(file_path, trim_info, output_dir, snap_to_keyframe=None, stats=None):
+    """
+    Cut a trim from the normalized full-length copy of its source, creating that copy on
+    first use. The cut is written to output_dir. Falls back to process_video_task on failure.
+    """
+    import threading
+    thread_id = threading.get_ident()
+    if snap_to_keyframe is None:
+        snap_to_keyframe = MEZZANINE_SNAP_TO_KEYFRAME
+    
+    mezzanine_key = None
+    mezzanine_path = None
+    cut_path = os.path.join(output_dir, f"cut_{uuid.uuid4()}.mp4")
+    try:
+        codec = get_segment_codec()
+        mezzanine_key = get_mezzanine_hash(file_path, codec)
+        
+        def fill(temp_path):
+            if not validate_video(file_path):
+                raise ValueError(f'Invalid video: {file_path}')
+            logging.info(f"Thread {thread_id}: Creating mezzanine for {file_path}")
+            # Sources are re-encoded even when they conform so cuts get the short GOP
+            method = normalize_video(file_path, temp_path, allow_passthrough=False)
+            # A GPU failure mid-encode leaves a CPU encode; never cache it under the GPU key
+            return method and get_segment_codec() == codec
+        
+        mezzanine_path = mezzanine_cache.get_or_fill(mezzanine_key, fill, lease=True)
+        if not mezzanine_path:
+            raise ValueError(f'Failed to create mezzanine for {file_path}')
+        
+        info = read_mp4_info(mezzanine_path, include_keyframes=True)
+        start, duration = trim_bounds(trim_info)
+        if duration is None:
+            duration = info['duration'] - start
+        
+        keyframes = info['keyframes']
+        if snap_to_keyframe:
+            start = max((t for t in keyframes if t <= start + 0.5 / TARGET_FPS), default=0.0)
+        duration = min(duration, info['duration'] - start)
+        
+        with get_resource_scheduler().reserve(f"cut {os.path.basename(file_path)}") as threads:
+            method = cut_segment(mezzanine_path, start, duration, cut_path, keyframes,
+                                 is_gpu_acceleration_available(), threads)
+        record_segment_stat(stats, 'mezzanine')
+        logging.info(f"Thread {thread_id}: Cut {duration:.2f}s at {start:.2f}s from mezzanine of {os.path.basename(file_path)} ({method})")
+        return cut_path
+    except Exception as e:
+        logging.warning(f"Thread {thread_id}: Mezzanine cut failed for {file_path}, normalizing the trim directly: {e}")
+        if os.path.exists(cut_path):
+            os.remove(cut_path)
+        return process_video_task(file_path, trim_info, output_dir, stats)
+    finally:
+        if mezzanine_path:
+            mezzanine_cache.release(mezzanine_key)
+
 def apply_video_transition(clip1, clip2, transition_duration=None):
     """Apply fade transition between two video clips."""
     # Use configured transition duration if not specified
@@ -396,59 +572,338 @@ def validate_and_upload_videos(files, upload_folder):
     
     return uploaded_files
 
-def merge_videos_with_trims(files, trims, upload_folder, output_folder):
+def render_merged_moviepy(processed_clips, output_path, transition_duration=None):
+    """Crossfade and concatenate normalized clips with MoviePy and encode the result."""
+    if transition_duration is None:
+        transition_duration = TRANSITION_DURATION
+    
+    # Load processed clips and apply transitions
+    clips = []
+    for i, clip_path in enumerate(processed_clips):
+        try:
+            clip = VideoFileClip(clip_path)
+            
+            # Apply transitions between clips (except for the first clip)
+            if i > 0 and clips and transition_duration:
+                prev_clip = clips[-1]
+                prev_clip, clip = apply_video_transition(prev_clip, clip, transition_duration)
+                clips[-1] = prev_clip
+            
+            clips.append(clip)
+        except Exception as e:
+            logging.error(f"Error loading processed clip {clip_path}: {e}")
+            # Close all previously opened clips
+            for c in clips:
+                try:
+                    c.close()
+                except:
+                    pass
+            # Skip this clip and continue with others
+            logging.warning(f"Skipping problematic clip: {clip_path}")
+    
+    if not clips:
+        raise ValueError('No valid clips to merge after loading')
+    
+    # Concatenate clips with transitions
+    try:
+        final_clip = concatenate_videoclips(clips, method="compose")
+        
+        # Apply video quality settings
+        bitrate = VIDEO_BITRATE
+        crf = CRF_VALUE
+        
+        # Adjust quality based on settings
+        if VIDEO_QUALITY == 'low':
+            crf = 28  # Higher CRF = lower quality, smaller file
+            bitrate = '1000k'
+        elif VIDEO_QUALITY == 'high':
+            crf = 18  # Lower CRF = higher quality, larger file
+            bitrate = '4000k'
+        
+        # Determine codec based on GPU availability
+        use_gpu = is_gpu_acceleration_available()
+        codec = GPU_CODEC if use_gpu else FALLBACK_CPU_CODEC
+        gpu_failure = None
+        
+        # Set encoding parameters based on GPU availability
+        if use_gpu:
+            # GPU-specific parameters
+            encoding_params = {
+                'codec': codec,
+                'preset': GPU_ENCODING_PRESET,
+                'audio_codec': None,  # Skip audio processing
+                'bitrate': GPU_BITRATE,
+                'verbose': False,
+                'logger': None
+            }
+            logging.info(f"Using GPU acceleration for final merge with codec: {codec}")
+            
+            # Try GPU encoding first with fallback to CPU
+            try:
+                # Write final video with GPU parameters
+                # MoviePy composites frames on the CPU even when the GPU encodes them
+                with get_resource_scheduler().reserve('final merge (GPU)') as threads:
+                    final_clip.write_videofile(output_path, threads=threads, **encoding_params)
+                logging.info(f"Successfully merged videos using GPU acceleration")
+            except Exception as gpu_error:
+                logging.warning(f"GPU encoding failed for final merge: {str(gpu_error)}")
+                gpu_failure = gpu_error
+                logging.info("Falling back to CPU encoding for final merge")
+                
+                # Switch to CPU encoding
+                use_gpu = False
+        
+        # CPU encoding (either as primary choice or fallback)
+        if not use_gpu:
+            # CPU-specific parameters
+            encoding_params = {
+                'codec': FALLBACK_CPU_CODEC,
+                'preset': VIDEO_PRESET,
+                'audio_codec': None,  # Skip audio processing
+                'bitrate': bitrate,
+                'verbose': False,
+                'logger': None
+            }
+            logging.info(f"Using CPU-based encoding for final merge with codec: {FALLBACK_CPU_CODEC}")
+            
+            # Write final video with CPU parameters
+            with get_resource_scheduler().reserve('final merge') as threads:
+                final_clip.write_videofile(output_path, threads=threads, **encoding_params)
+            logging.info(f"Successfully merged videos using CPU encoding")
+            if gpu_failure:
+                report_gpu_failure(gpu_failure)
+        
+        # Close clips to free memory
+        for clip in clips:
+            try:
+                clip.close()
+            except:
+                pass
+        final_clip.close()
+        
+        return output_path
+    except Exception as e:
+        # Close all clips on error
+        for clip in clips:
+            try:
+                clip.close()
+            except:
+                pass
+        if 'final_clip' in locals():
+            try:
+                final_clip.close()
+            except:
+                pass
+        raise ValueError(f'Failed to merge clips: {e}')
+
+def get_stream_signature(file_path):
     """
-    Merge videos with trims and resize, return output_path.
-    Uses optimized processing with caching and parallel execution.
-    Raises ValueError or Exception on errors.
+    Return the stream parameters that must match for segments to be joined by stream copy.
+    The avcC record (profile, level, SPS/PPS) must be identical because the joined file keeps only one.
     """
-    processed_clips = []
+    info = read_mp4_info(file_path)
+    return (
+        info.get('codec'), info.get('width'), info.get('height'),
+        info.get('avcc'), info.get('chroma_format'), info.get('bit_depth'),
+        round(info['fps'], 3) if info.get('fps') else None, info.get('video_timescale'),
+        info['has_audio'], info.get('audio_codec'), info.get('sample_rate'), info.get('channels')
+    )
+
+def segments_share_parameters(paths):
+    """Check that every segment has identical codec, size, frame rate and audio format."""
+    try:
+        signatures = {get_stream_signature(path) for path in paths}
+    except (Mp4ParseError, OSError) as e:
+        logging.info(f"Could not read segment parameters: {e}")
+        return False
+    if len(signatures) > 1:
+        logging.info(f"Segments differ in stream parameters: {signatures}")
+    return len(signatures) == 1
+
+def merge_concat(processed_clips, output_path):
+    """Join normalized segments without transitions, by stream copy when they are compatible."""
+    if segments_share_parameters(processed_clips):
+        try:
+            return concat_copy(processed_clips, output_path)
+        except FfmpegError as e:
+            logging.warning(f"Stream-copy concat failed, re-encoding instead: {e}")
+    else:
+        logging.info("Segments are not stream-copy compatible, re-encoding without transitions")
+    return render_merged_moviepy(processed_clips, output_path, transition_duration=0)
+
+def merge_smart(processed_clips, output_path):
+    """Crossfade normalized segments, re-encoding only the transition windows."""
+    if len(processed_clips) < 2 or not TRANSITION_DURATION:
+        return merge_concat(processed_clips, output_path)
+    
+    if segments_share_parameters(processed_clips):
+        try:
+            segments = []
+            for path in processed_clips:
+                info = read_mp4_info(path, include_keyframes=True)
+                segments.append({
+                    'path': path,
+                    'duration': info.get('video_duration') or info['duration'],
+                    'keyframes': info['keyframes'],
+                    'has_audio': info['has_audio']
+                })
+            with get_resource_scheduler().reserve('smart render') as threads:
+                return smart_render(segments, output_path, TRANSITION_DURATION, is_gpu_acceleration_available(), threads)
+        except (FfmpegError, Mp4ParseError, ValueError, OSError) as e:
+            logging.warning(f"Smart render failed, re-encoding the full timeline: {e}")
+    else:
+        logging.info("Segments are not stream-copy compatible, re-encoding the full timeline")
+    return render_merged_moviepy(processed_clips, output_path)
+
+def collect_merge_inputs(files, trims, upload_folder):
+    """Return ([(filename, file_path, trim)], failed_files) for the files that can be merged."""
+    inputs = []
     failed_files = []
+    for filename in files:
+        if filename not in trims:
+            logging.warning(f'No trim data for {filename}, skipping')
+            failed_files.append(filename)
+            continue
+        
+        file_path = os.path.join(upload_folder, filename)
+        if not os.path.exists(file_path):
+            logging.warning(f'File not found: {filename}, skipping')
+            failed_files.append(filename)
+            continue
+        
+        inputs.append((filename, file_path, trims[filename]))
+    return inputs, failed_files
+
+def build_single_pass_segments(inputs):
+    """Resolve trim windows into the segment list used by the single-pass engine."""
+    from media_catalog import get_media_metadata
+    
+    segments = []
+    for filename, file_path, trim in inputs:
+        start, duration = trim_bounds(trim)
+        metadata = get_media_metadata(file_path, 'video')
+        if duration is None:
+            duration = metadata['duration'] - start
+        if duration <= 0:
+            raise ValueError(f'Trim of {filename} is outside the video')
+        segments.append({
+            'path': file_path,
+            'start': start,
+            'duration': duration,
+            'has_audio': bool(metadata.get('has_audio')),
+            'width': metadata.get('width'),
+            'height': metadata.get('height')
+        })
+    return segments
+
+def submit_merge_segments(executor, files, trims, upload_folder, output_folder, merge_mode=None, use_mezzanine=False, stats=None, report=None):
+    """
+    Collect the merge inputs and queue their segment tasks on executor without waiting.
+    Returns a merge plan for finish_merge. Single-pass merges queue no tasks up front.
+    report(progress, message), if given, receives this merge's 0-100 progress.
+    Raises ValueError when there is nothing to merge.
+    """
+    merge_mode = merge_mode or DEFAULT_MERGE_MODE
+    if merge_mode not in MERGE_MODES:
+        raise ValueError(f'Invalid merge mode: {merge_mode}')
+    
+    inputs, failed_files = collect_merge_inputs(files, trims, upload_folder)
+    plan = {
+        'files': files,
+        'upload_folder': upload_folder,
+        'output_folder': output_folder,
+        'merge_mode': merge_mode,
+        'use_mezzanine': use_mezzanine,
+        'stats': stats,
+        'report': report,
+        'inputs': inputs,
+        'failed_files': failed_files,
+        'futures': None
+    }
+    if not inputs:
+        cleanup_merge(plan, [])
+        raise ValueError('No valid clips to merge. All videos failed to process.')
+    
+    if merge_mode != 'single_pass':
+        queue_segment_tasks(executor, plan)
+    return plan
+
+def queue_segment_tasks(executor, plan):
+    """Submit one normalize (or mezzanine cut) task per input of a merge plan."""
+    futures = []
+    for filename, file_path, trim in plan['inputs']:
+        logging.info(f"Submitting video task for processing: {filename}")
+        if plan['use_mezzanine']:
+            future = executor.submit(process_mezzanine_task, file_path, trim, plan['upload_folder'], stats=plan['stats'])
+        else:
+            future = executor.submit(process_video_task, file_path, trim, plan['upload_folder'], plan['stats'])
+        futures.append((future, filename))
+    plan['futures'] = futures
+    logging.info(f"Submitted {len(futures)} tasks for parallel processing")
+    if plan['report']:
+        track_segment_progress(plan)
+
+def track_segment_progress(plan):
+    """Advance the plan's progress up to SEGMENT_PROGRESS_SHARE as segments finish; the final encode completes it."""
+    report = plan['report']
+    total = len(plan['futures'])
+    done = []
+    lock = threading.Lock()
+    
+    def segment_done(_future):
+        with lock:
+            done.append(_future)
+            count = len(done)
+        report(SEGMENT_PROGRESS_SHARE * count / total, f"processed {count} of {total} segments")
+    
+    for future, _ in plan['futures']:
+        future.add_done_callback(segment_done)
+
+def finish_merge(plan, executor, output_filename='merged.mp4'):
+    """
+    Wait for a merge plan's segments and render them to output_folder/output_filename.
+    Segment leases, mezzanine cuts and the input files are cleaned up whether or not it succeeds.
+    """
+    merge_mode = plan['merge_mode']
+    failed_files = plan['failed_files']
+    processed_clips = []
     
     try:
         # Ensure output folder exists
-        os.makedirs(output_folder, exist_ok=True)
+        os.makedirs(plan['output_folder'], exist_ok=True)
+        output_path = os.path.join(plan['output_folder'], output_filename)
         
-        # Process videos in parallel
-        logging.info(f"Starting parallel processing with {MAX_WORKERS} workers")
-        with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-            futures = []
-            
-            for filename in files:
-                if filename not in trims:
-                    logging.warning(f'No trim data for {filename}, skipping')
-                    failed_files.append(filename)
-                    continue
-                
-                trim = trims[filename]
-                file_path = os.path.join(upload_folder, filename)
-                
-                if not os.path.exists(file_path):
-                    logging.warning(f'File not found: {filename}, skipping')
-                    failed_files.append(filename)
-                    continue
-                
-                # Submit video processing task
-                logging.info(f"Submitting video task for processing: {filename}")
-                future = executor.submit(process_video_task, file_path, trim, output_folder)
-                futures.append((future, filename))
-            
-            logging.info(f"Submitted {len(futures)} tasks for parallel processing")
-            
-            # Collect processed video paths
-            for i, (future, filename) in enumerate(futures):
-                try:
-                    logging.info(f"Waiting for task {i+1}/{len(futures)}: {filename}")
-                    processed_path = future.result()
-                    if processed_path and os.path.exists(processed_path):
-                        processed_clips.append(processed_path)
-                        logging.info(f"Successfully processed video: {filename}")
-                    else:
-                        logging.warning(f"Failed to process video {filename}, result path is invalid")
-                        failed_files.append(filename)
-                except Exception as e:
-                    logging.error(f"Error processing video {filename}: {e}")
+        if merge_mode == 'single_pass':
+            try:
+                segments = build_single_pass_segments(plan['inputs'])
+                report = plan['report']
+                progress = (lambda fraction: report(min(99, 100 * fraction), "rendering single pass")) if report else None
+                with get_resource_scheduler().reserve('single-pass merge') as threads:
+                    merge_single_pass(segments, output_path, TRANSITION_DURATION, is_gpu_acceleration_available(), threads, progress)
+                for _ in segments:
+                    record_segment_stat(plan['stats'], 'single_pass')
+                if failed_files:
+                    logging.warning(f"Failed to process {len(failed_files)} files: {failed_files}")
+                return output_path
+            except Exception as e:
+                logging.warning(f"Single-pass merge failed, falling back to standard merge: {e}")
+                queue_segment_tasks(executor, plan)
+        
+        # Collect processed video paths
+        futures = plan['futures']
+        for i, (future, filename) in enumerate(futures):
+            try:
+                logging.info(f"Waiting for task {i+1}/{len(futures)}: {filename}")
+                processed_path = future.result()
+                if processed_path and os.path.exists(processed_path):
+                    processed_clips.append(processed_path)
+                    logging.info(f"Successfully processed video: {filename}")
+                else:
+                    logging.warning(f"Failed to process video {filename}, result path is invalid")
                     failed_files.append(filename)
+            except Exception as e:
+                logging.error(f"Error processing video {filename}: {e}")
+                failed_files.append(filename)
         
         # Check if we have any valid clips
         if not processed_clips:
@@ -458,136 +913,53 @@ def merge_videos_with_trims(files, trims, upload_folder, output_folder):
         if failed_files:
             logging.warning(f"Failed to process {len(failed_files)} files: {failed_files}")
         
-        # Load processed clips and apply transitions
-        clips = []
-        for i, clip_path in enumerate(processed_clips):
+        if merge_mode == 'concat':
+            return merge_concat(processed_clips, output_path)
+        if merge_mode == 'smart':
+            return merge_smart(processed_clips, output_path)
+        return render_merged_moviepy(processed_clips, output_path)
+    
+    finally:
+        cleanup_merge(plan, processed_clips)
+
+def cleanup_merge(plan, processed_clips):
+    """Release segment leases, remove mezzanine cuts and delete the merge's input files."""
+    # Normalized segments stay cached; only release the leases taken for this merge
+    video_cache.release_paths(processed_clips)
+    
+    # Cuts from the mezzanine cache are per-job files
+    for clip_path in processed_clips:
+        if os.path.basename(clip_path).startswith('cut_') and os.path.exists(clip_path):
             try:
-                clip = VideoFileClip(clip_path)
-                
-                # Apply transitions between clips (except for the first clip)
-                if i > 0 and clips:
-                    prev_clip = clips[-1]
-                    prev_clip, clip = apply_video_transition(prev_clip, clip)
-                    clips[-1] = prev_clip
-                
-                clips.append(clip)
-            except Exception as e:
-                logging.error(f"Error loading processed clip {clip_path}: {e}")
-                # Close all previously opened clips
-                for c in clips:
-                    try:
-                        c.close()
-                    except:
-                        pass
-                # Skip this clip and continue with others
-                logging.warning(f"Skipping problematic clip: {clip_path}")
-        
-        if not clips:
-            raise ValueError('No valid clips to merge after loading')
-        
-        # Concatenate clips with transitions
-        try:
-            final_clip = concatenate_videoclips(clips, method="compose")
-            output_filename = 'merged.mp4'
-            output_path = os.path.join(output_folder, output_filename)
-            
-            # Apply video quality settings
-            bitrate = VIDEO_BITRATE
-            crf = CRF_VALUE
-            
-            # Adjust quality based on settings
-            if VIDEO_QUALITY == 'low':
-                crf = 28  # Higher CRF = lower quality, smaller file
-                bitrate = '1000k'
-            elif VIDEO_QUALITY == 'high':
-                crf = 18  # Lower CRF = higher quality, larger file
-                bitrate = '4000k'
-            
-            # Determine codec based on GPU availability
-            use_gpu = is_gpu_acceleration_available()
-            codec = GPU_CODEC if use_gpu else FALLBACK_CPU_CODEC
-            
-            # Set encoding parameters based on GPU availability
-            if use_gpu:
-                # GPU-specific parameters
-                encoding_params = {
-                    'codec': codec,
-                    'preset': GPU_ENCODING_PRESET,
-                    'audio_codec': None,  # Skip audio processing
-                    'bitrate': GPU_BITRATE,
-                    'verbose': False,
-                    'logger': None
-                }
-                logging.info(f"Using GPU acceleration for final merge with codec: {codec}")
-                
-                # Try GPU encoding first with fallback to CPU
-                try:
-                    # Write final video with GPU parameters
-                    final_clip.write_videofile(output_path, **encoding_params)
-                    logging.info(f"Successfully merged videos using GPU acceleration")
-                except Exception as gpu_error:
-                    logging.warning(f"GPU encoding failed for final merge: {str(gpu_error)}")
-                    logging.info("Falling back to CPU encoding for final merge")
-                    
-                    # Switch to CPU encoding
-                    use_gpu = False
-            
-            # CPU encoding (either as primary choice or fallback)
-            if not use_gpu:
-                # CPU-specific parameters
-                encoding_params = {
-                    'codec': FALLBACK_CPU_CODEC,
-                    'preset': VIDEO_PRESET,
-                    'audio_codec': None,  # Skip audio processing
-                    'bitrate': bitrate,
-                    'verbose': False,
-                    'logger': None,
-                    'threads': MAX_WORKERS
-                }
-                logging.info(f"Using CPU-based encoding for final merge with codec: {FALLBACK_CPU_CODEC}")
-                
-                # Write final video with CPU parameters
-                final_clip.write_videofile(output_path, **encoding_params)
-                logging.info(f"Successfully merged videos using CPU encoding")
-            
-            # Close clips to free memory
-            for clip in clips:
-                try:
-                    clip.close()
-                except:
-                    pass
-            final_clip.close()
-            
-            return output_path
-        except Exception as e:
-            # Close all clips on error
-            for clip in clips:
-                try:
-                    clip.close()
-                except:
-                    pass
-            if 'final_clip' in locals():
-                try:
-                    final_clip.close()
-                except:
-                    pass
-            raise ValueError(f'Failed to merge clips: {e}')
-            
-    except Exception as e:
-        # Clean up processed clips on error
-        for clip_path in processed_clips:
+                os.remove(clip_path)
+            except OSError as cleanup_error:
+                logging.warning(f"Error cleaning up cut {clip_path}: {cleanup_error}")
+    
+    # Clean up input files
+    for filename in plan['files']:
+        input_path = os.path.join(plan['upload_folder'], filename)
+        if os.path.exists(input_path):
             try:
-                if os.path.exists(clip_path) and clip_path != file_path:
-                    os.remove(clip_path)
+                os.remove(input_path)
             except Exception as cleanup_error:
-                logging.warning(f"Error cleaning up processed clip {clip_path}: {cleanup_error}")
-        raise
-    finally:
-        # Clean up input files
-        for filename in files:
-            input_path = os.path.join(upload_folder, filename)
-            if os.path.exists(input_path):
-                try:
-                    os.remove(input_path)
-                except Exception as cleanup_error:
-                    logging.warning(f"Error cleaning up input file {input_path}: {cleanup_error}")
\ No newline at end of file
+                logging.warning(f"Error cleaning up input file {input_path}: {cleanup_error}")
+
+def merge_videos_with_trims(files, trims, upload_folder, output_folder, merge_mode=None, use_mezzanine=False, stats=None, output_filename='merged.mp4'):
+    """
+    Merge videos with trims and resize, return output_path.
+    merge_mode 'standard' normalizes segments through the cache and joins them with MoviePy;
+    'single_pass' renders the whole output with one ffmpeg filtergraph;
+    'concat' joins the cached segments without transitions, by stream copy when possible;
+    'smart' crossfades the cached segments, re-encoding only the transition windows.
+    With use_mezzanine, trims are cut from cached full-length normalized sources instead
+    of being normalized individually. If a stats dict is given, it counts how each segment
+    was produced (cached, passthrough, encoded, mezzanine, single_pass or original).
+    The output is written to output_folder/output_filename.
+    Raises ValueError or Exception on errors.
+    """
+    # Size the pool to the core budget; encodes still wait for their thread reservation
+    workers = get_resource_scheduler().pool_size(min(MAX_WORKERS, max(1, len(files))))
+    logging.info(f"Starting parallel processing with {workers} workers")
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        plan = submit_merge_segments(executor, files, trims, upload_folder, output_folder, merge_mode, use_mezzanine, stats)
+        return finish_merge(plan, executor, output_filename)
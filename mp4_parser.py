@@ -0,0 +1,376 @@
+import os
+import struct
+from config import *
+
+# Box types that only contain other boxes and need to be descended into
+CONTAINER_BOXES = {b'moov', b'trak', b'mdia', b'minf', b'stbl', b'edts', b'dinf'}
+
+# Sample entry fourcc -> codec name as reported by ffprobe
+CODEC_NAMES = {
+    'avc1': 'h264',
+    'avc3': 'h264',
+    'hvc1': 'hevc',
+    'hev1': 'hevc',
+    'av01': 'av1',
+    'vp09': 'vp9',
+    'mp4v': 'mpeg4',
+    'mp4a': 'aac',
+    '.mp3': 'mp3',
+    'ac-3': 'ac3',
+    'ec-3': 'eac3',
+    'Opus': 'opus'
+}
+
+MP4_EXTENSIONS = ('.mp4', '.m4v', '.mov', '.m4a')
+
+# Size of a VisualSampleEntry before its child boxes (avcC, pasp, ...)
+VISUAL_SAMPLE_ENTRY_SIZE = 78
+
+# H.264 profiles whose avcC and SPS carry chroma format and bit depth
+AVC_HIGH_PROFILES = {100, 110, 122, 144, 244, 44, 83, 86, 118, 128, 138, 139, 134, 135}
+
+
+class Mp4ParseError(Exception):
+    """Raised when an MP4 file cannot be read from its moov box alone."""
+
+
+class Mp4FragmentedError(Mp4ParseError):
+    """Raised for fragmented MP4 files whose sample tables live in moof boxes."""
+
+
+def _read_box_header(data, offset, end):
+    """Return (box_type, payload_start, box_end) for the box at offset."""
+    if offset + 8 > end:
+        raise Mp4ParseError("Truncated box header")
+    size, box_type = struct.unpack_from('>I4s', data, offset)
+    header_size = 8
+    if size == 1:
+        if offset + 16 > end:
+            raise Mp4ParseError("Truncated 64-bit box header")
+        size = struct.unpack_from('>Q', data, offset + 8)[0]
+        header_size = 16
+    elif size == 0:
+        size = end - offset
+    if size < header_size or offset + size > end:
+        raise Mp4ParseError(f"Invalid size for box {box_type!r}")
+    return box_type, offset + header_size, offset + size
+
+
+def _iter_boxes(data, start, end):
+    offset = start
+    while offset + 8 <= end:
+        box_type, payload, box_end = _read_box_header(data, offset, end)
+        yield box_type, payload, box_end
+        offset = box_end
+
+
+def _find_moov(f, file_size):
+    """Walk top-level boxes by seeking and return the raw moov payload."""
+    offset = 0
+    moov = None
+    while offset + 8 <= file_size:
+        f.seek(offset)
+        header = f.read(16)
+        if len(header) < 8:
+            break
+        size, box_type = struct.unpack_from('>I4s', header, 0)
+        header_size = 8
+        if size == 1:
+            if len(header) < 16:
+                raise Mp4ParseError("Truncated 64-bit box header")
+            size = struct.unpack_from('>Q', header, 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = file_size - offset
+        if size < header_size:
+            raise Mp4ParseError(f"Invalid size for top-level box {box_type!r}")
+
+        if box_type == b'moof':
+            raise Mp4FragmentedError("Fragmented MP4 (moof box found)")
+        if box_type == b'moov':
+            payload_size = size - header_size
+            if payload_size > MP4_MAX_MOOV_BYTES:
+                raise Mp4ParseError(f"moov box too large ({payload_size} bytes)")
+            f.seek(offset + header_size)
+            moov = f.read(payload_size)
+            if len(moov) < payload_size:
+                raise Mp4ParseError("Truncated moov box")
+            # Keep walking only far enough to notice fragments right after moov
+            next_offset = offset + size
+            if next_offset + 8 <= file_size:
+                f.seek(next_offset)
+                next_header = f.read(8)
+                if len(next_header) == 8 and next_header[4:8] == b'moof':
+                    raise Mp4FragmentedError("Fragmented MP4 (moof box found)")
+            return moov
+        offset += size
+
+    raise Mp4ParseError("No moov box found")
+
+
+def _full_box_version(data, payload):
+    return data[payload]
+
+
+def _parse_mvhd(data, payload):
+    if _full_box_version(data, payload) == 1:
+        timescale, duration = struct.unpack_from('>IQ', data, payload + 20)
+    else:
+        timescale, duration = struct.unpack_from('>II', data, payload + 12)
+    return timescale, duration
+
+
+def _parse_tkhd(data, payload):
+    offset = payload + (88 if _full_box_version(data, payload) == 1 else 76)
+    width, height = struct.unpack_from('>II', data, offset)
+    return width / 65536.0, height / 65536.0
+
+
+class _BitReader:
+    """Read bits and Exp-Golomb codes from an RBSP, most significant bit first."""
+
+    def __init__(self, data, byte_offset=0):
+        self.data = data
+        self.position = byte_offset * 8
+
+    def bit(self):
+        value = (self.data[self.position >> 3] >> (7 - (self.position & 7))) & 1
+        self.position += 1
+        return value
+
+    def ue(self):
+        zeros = 0
+        while self.bit() == 0:
+            zeros += 1
+            if zeros > 31:
+                raise Mp4ParseError("Invalid Exp-Golomb code in SPS")
+        value = 1
+        for _ in range(zeros):
+            value = (value << 1) | self.bit()
+        return value - 1
+
+
+def _sps_format(sps):
+    """Return (chroma_format_idc, bit_depth) from a high-profile SPS NAL unit."""
+    # Drop emulation prevention bytes (00 00 03 -> 00 00)
+    rbsp = sps.replace(b'\x00\x00\x03', b'\x00\x00')
+    reader = _BitReader(rbsp, 4)  # NAL header, profile_idc, constraint flags, level_idc
+    reader.ue()  # seq_parameter_set_id
+    chroma_format = reader.ue()
+    if chroma_format == 3:
+        reader.bit()  # separate_colour_plane_flag
+    bit_depth = max(reader.ue(), reader.ue()) + 8
+    return chroma_format, bit_depth
+
+
+def _parse_avcc(data, payload, end):
+    """Parse an AVCDecoderConfigurationRecord into profile, level, chroma format and bit depth."""
+    config = bytes(data[payload:end])
+    profile, level = config[1], config[3]
+    offset = 6
+    sps_list = []
+    for _ in range(config[5] & 0x1f):
+        length = struct.unpack_from('>H', config, offset)[0]
+        sps_list.append(config[offset + 2:offset + 2 + length])
+        offset += 2 + length
+    pps_count = config[offset]
+    offset += 1
+    for _ in range(pps_count):
+        offset += 2 + struct.unpack_from('>H', config, offset)[0]
+
+    # Baseline, main and extended profiles are always 8-bit 4:2:0
+    chroma_format, bit_depth = 1, 8
+    if profile in AVC_HIGH_PROFILES:
+        if offset + 3 <= len(config):
+            chroma_format = config[offset] & 0x03
+            bit_depth = max(config[offset + 1] & 0x07, config[offset + 2] & 0x07) + 8
+        elif sps_list:
+            # Many muxers omit the high-profile extension; read the SPS instead
+            chroma_format, bit_depth = _sps_format(sps_list[0])
+    return {
+        'avcc': config,
+        'profile': profile,
+        'level': level,
+        'chroma_format': chroma_format,
+        'bit_depth': bit_depth
+    }
+
+
+def _parse_stsd(data, payload, handler):
+    entry_count = struct.unpack_from('>I', data, payload + 4)[0]
+    if entry_count == 0:
+        return {}
+    entry_type, entry_payload, entry_end = _read_box_header(data, payload + 8, len(data))
+    info = {'fourcc': entry_type.decode('latin-1')}
+    if handler == 'vide':
+        info['width'], info['height'] = struct.unpack_from('>HH', data, entry_payload + 24)
+        for box_type, box_payload, box_end in _iter_boxes(data, entry_payload + VISUAL_SAMPLE_ENTRY_SIZE, entry_end):
+            if box_type == b'avcC':
+                info.update(_parse_avcc(data, box_payload, box_end))
+            elif box_type == b'pasp':
+                info['sar'] = struct.unpack_from('>II', data, box_payload)
+    elif handler == 'soun':
+        info['channels'] = struct.unpack_from('>H', data, entry_payload + 16)[0]
+        info['sample_rate'] = struct.unpack_from('>I', data, entry_payload + 24)[0] >> 16
+    return info
+
+
+def _parse_stts(data, payload):
+    entry_count = struct.unpack_from('>I', data, payload + 4)[0]
+    return [struct.unpack_from('>II', data, payload + 8 + i * 8) for i in range(entry_count)]
+
+
+def _parse_stss(data, payload):
+    entry_count = struct.unpack_from('>I', data, payload + 4)[0]
+    return list(struct.unpack_from(f'>{entry_count}I', data, payload + 8))
+
+
+def _parse_trak(data, start, end):
+    track = {}
+
+    def walk(box_start, box_end):
+        for box_type, payload, box_stop in _iter_boxes(data, box_start, box_end):
+            if box_type in CONTAINER_BOXES:
+                walk(payload, box_stop)
+            elif box_type == b'tkhd':
+                track['display_width'], track['display_height'] = _parse_tkhd(data, payload)
+            elif box_type == b'mdhd':
+                track['timescale'], track['duration'] = _parse_mvhd(data, payload)
+            elif box_type == b'hdlr':
+                track['handler'] = data[payload + 8:payload + 12].decode('latin-1')
+            elif box_type == b'stsd':
+                track['stsd'] = (payload, box_stop)
+            elif box_type == b'stts':
+                track['stts'] = _parse_stts(data, payload)
+            elif box_type == b'stss':
+                track['stss'] = (payload, box_stop)
+
+    walk(start, end)
+    if 'stsd' in track:
+        track['sample_entry'] = _parse_stsd(data, track.pop('stsd')[0], track.get('handler'))
+    return track
+
+
+def _keyframe_times(track):
+    """Convert the stss sync-sample table to decode timestamps in seconds."""
+    stts = track.get('stts') or []
+    timescale = track.get('timescale') or 1
+    stss = track.get('stss')
+    total_samples = sum(count for count, _ in stts)
+    sync_samples = stss if stss is not None else range(1, total_samples + 1)
+
+    times = []
+    sync_iter = iter(sync_samples)
+    target = next(sync_iter, None)
+    sample_number = 1
+    decode_time = 0
+    for count, delta in stts:
+        run_end = sample_number + count
+        while target is not None and target < run_end:
+            times.append((decode_time + (target - sample_number) * delta) / timescale)
+            target = next(sync_iter, None)
+        if target is None:
+            break
+        decode_time += count * delta
+        sample_number = run_end
+    return times
+
+
+def read_mp4_info(file_path, include_keyframes=False):
+    """
+    Read duration and stream information from the moov box of an MP4 file.
+    Raises Mp4FragmentedError for fragmented files and Mp4ParseError for broken ones.
+    """
+    file_size = os.path.getsize(file_path)
+    with open(file_path, 'rb') as f:
+        moov = _find_moov(f, file_size)
+
+    movie_timescale = None
+    movie_duration = None
+    tracks = []
+    try:
+        for box_type, payload, box_end in _iter_boxes(moov, 0, len(moov)):
+            if box_type == b'mvhd':
+                movie_timescale, movie_duration = _parse_mvhd(moov, payload)
+            elif box_type == b'mvex':
+                raise Mp4FragmentedError("Fragmented MP4 (mvex box found)")
+            elif box_type == b'trak':
+                tracks.append(_parse_trak(moov, payload, box_end))
+    except (struct.error, IndexError) as e:
+        raise Mp4ParseError(f"Malformed moov box: {e}")
+
+    if not movie_timescale:
+        raise Mp4ParseError("Missing or invalid mvhd box")
+
+    video = next((t for t in tracks if t.get('handler') == 'vide'), None)
+    audio = next((t for t in tracks if t.get('handler') == 'soun'), None)
+
+    info = {
+        'duration': movie_duration / movie_timescale,
+        'timescale': movie_timescale,
+        'has_video': video is not None,
+        'has_audio': audio is not None
+    }
+
+    if video:
+        entry = video.get('sample_entry', {})
+        timescale = video.get('timescale') or movie_timescale
+        stts = video.get('stts') or []
+        sample_count = sum(count for count, _ in stts)
+        media_ticks = sum(count * delta for count, delta in stts)
+        info.update({
+            'codec': CODEC_NAMES.get(entry.get('fourcc'), entry.get('fourcc')),
+            'width': entry.get('width') or int(video.get('display_width', 0)),
+            'height': entry.get('height') or int(video.get('display_height', 0)),
+            'fps': sample_count * timescale / media_ticks if media_ticks else None,
+            'video_timescale': timescale,
+            'video_duration': media_ticks / timescale if media_ticks else None,
+            'avcc': entry.get('avcc'),
+            'profile': entry.get('profile'),
+            'level': entry.get('level'),
+            'chroma_format': entry.get('chroma_format'),
+            'bit_depth': entry.get('bit_depth'),
+            'sar': entry.get('sar')
+        })
+        if not info['duration'] and video.get('duration'):
+            info['duration'] = video['duration'] / timescale
+        if include_keyframes:
+            try:
+                if 'stss' in video:
+                    payload, _ = video['stss']
+                    video['stss'] = _parse_stss(moov, payload)
+                info['keyframes'] = _keyframe_times(video)
+            except (struct.error, IndexError) as e:
+                raise Mp4ParseError(f"Malformed stss box: {e}")
+
+    if audio:
+        entry = audio.get('sample_entry', {})
+        info.update({
+            'audio_codec': CODEC_NAMES.get(entry.get('fourcc'), entry.get('fourcc')),
+            'sample_rate': entry.get('sample_rate'),
+            'channels': entry.get('channels')
+        })
+        if not info['duration'] and audio.get('duration') and audio.get('timescale'):
+            info['duration'] = audio['duration'] / audio['timescale']
+
+    if not info['duration']:
+        raise Mp4ParseError("Duration not available in moov box")
+
+    return info
+
+
+def probe_mp4_metadata(file_path):
+    """Return media catalog metadata for an MP4 file without spawning FFmpeg."""
+    info = read_mp4_info(file_path)
+    if not info['has_video']:
+        raise Mp4ParseError(f"No video track found in {file_path}")
+    return {
+        'duration': info['duration'],
+        'fps': info.get('fps'),
+        'width': info.get('width'),
+        'height': info.get('height'),
+        'codec': info.get('codec'),
+        'has_audio': info['has_audio'],
+        'sample_rate': info.get('sample_rate'),
+        'channels': info.get('channels')
+    }
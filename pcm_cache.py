@@ -0,0 +1,82 @@
+import os
+import hashlib
+import logging
+import numpy as np
+from config import *
+from cache_manager import CacheManager, get_source_identity
+from resource_scheduler import get_resource_scheduler
+from ffmpeg_engine import decode_audio_to_raw
+
+# Decoded audio stored as .npy files and memory-mapped by the NumPy mixer
+pcm_cache = CacheManager(PCM_CACHE_FOLDER, PCM_CACHE_MAX_BYTES, CACHE_EVICTION_POLICY, suffix='.npy', name='PCM cache')
+
+
+def get_pcm_cache_key(audio_path):
+    """Generate a cache key from the source identity and the decoded sample format."""
+    hash_input = f"pcm_{get_source_identity(audio_path)}_{AUDIO_SAMPLE_RATE}_{AUDIO_CHANNELS}_{PCM_CACHE_DTYPE}"
+    return hashlib.md5(hash_input.encode()).hexdigest()
+
+
+def write_npy_from_raw(raw_path, npy_path, dtype='float32'):
+    """Copy interleaved raw samples into an .npy file block by block, without loading them whole."""
+    dtype = np.dtype(dtype).newbyteorder('<')
+    frames = os.path.getsize(raw_path) // (dtype.itemsize * AUDIO_CHANNELS)
+    if not frames:
+        raise ValueError(f"No audio samples decoded into {raw_path}")
+    
+    source = np.memmap(raw_path, dtype=dtype, mode='r', shape=(frames, AUDIO_CHANNELS))
+    target = np.lib.format.open_memmap(npy_path, mode='w+', dtype=dtype, shape=(frames, AUDIO_CHANNELS))
+    for start in range(0, frames, PCM_MIX_BLOCK_FRAMES):
+        target[start:start + PCM_MIX_BLOCK_FRAMES] = source[start:start + PCM_MIX_BLOCK_FRAMES]
+    target.flush()
+    del source, target
+    return npy_path
+
+
+def get_cached_pcm(audio_path):
+    """
+    Return (key, path) of the decoded samples of audio_path, decoding them on first use.
+    The entry is leased; call pcm_cache.release(key) once the mix is done.
+    Raises FfmpegError if decoding fails.
+    """
+    key = get_pcm_cache_key(audio_path)
+    
+    def fill(temp_path):
+        raw_path = f"{temp_path}.raw"
+        logging.info(f"Decoding {audio_path} to the PCM cache")
+        try:
+            with get_resource_scheduler().reserve('audio decode', threads=1):
+                decode_audio_to_raw(audio_path, raw_path, PCM_CACHE_DTYPE)
+            write_npy_from_raw(raw_path, temp_path, PCM_CACHE_DTYPE)
+            return True
+        finally:
+            if os.path.exists(raw_path):
+                os.remove(raw_path)
+    
+    return key, pcm_cache.get_or_fill(key, fill, lease=True)
+
+
+def load_pcm(path):
+    """Memory-map cached samples as a (frames, channels) array."""
+    return np.load(path, mmap_mode='r')
+
+
+def iter_mix_blocks(tracks, frames, block_frames=None):
+    """
+    Mix (samples, gain) tracks into float32 blocks of shape (n, AUDIO_CHANNELS), frames in total.
+    int16 samples are scaled to [-1, 1]; tracks shorter than frames leave silence.
+    Every block is clipped to [-1, 1].
+    """
+    block_frames = block_frames or PCM_MIX_BLOCK_FRAMES
+    
+    for start in range(0, frames, block_frames):
+        end = min(start + block_frames, frames)
+        block = np.zeros((end - start, AUDIO_CHANNELS), dtype=np.float32)
+        for samples, gain in tracks:
+            part = samples[start:end]
+            if len(part):
+                scale = gain / 32768.0 if samples.dtype == np.int16 else gain
+                block[:len(part)] += part * np.float32(scale)
+        
+        np.clip(block, -1.0, 1.0, out=block)
+        yield block
@@ -0,0 +1,92 @@
+import time
+import logging
+import itertools
+import threading
+from contextlib import contextmanager
+from config import *
+
+
+class ResourceScheduler:
+    """
+    Process-wide CPU core budget shared by every encode in every job.
+    Encoders reserve threads before starting and block while the budget is exhausted,
+    so concurrent batches queue for cores instead of oversubscribing them.
+    """
+
+    def __init__(self, total_cores=None, threads_per_encode=None):
+        self.total_cores = max(1, total_cores or CPU_CORE_BUDGET)
+        self.threads_per_encode = max(1, min(threads_per_encode or ENCODER_THREADS, self.total_cores))
+        self.in_use = 0
+        self.waiting = 0
+        self._allocations = {}
+        self._ids = itertools.count(1)
+        self._condition = threading.Condition()
+
+    def pool_size(self, limit=None):
+        """Number of encodes that can run side by side at the default thread count."""
+        size = max(1, self.total_cores // self.threads_per_encode)
+        return min(size, limit) if limit else size
+
+    @contextmanager
+    def reserve(self, label, threads=None):
+        """
+        Reserve up to `threads` cores (default ENCODER_THREADS) and yield the number granted.
+        Waits until at least one core is free; grants fewer threads when the budget is nearly used.
+        """
+        wanted = max(1, min(threads or self.threads_per_encode, self.total_cores))
+        requested_at = time.time()
+        with self._condition:
+            self.waiting += 1
+            try:
+                while self.in_use >= self.total_cores:
+                    self._condition.wait()
+            finally:
+                self.waiting -= 1
+            granted = min(wanted, self.total_cores - self.in_use)
+            self.in_use += granted
+            allocation_id = next(self._ids)
+            self._allocations[allocation_id] = {
+                'label': label,
+                'threads': granted,
+                'started': time.time(),
+                'waited_seconds': round(time.time() - requested_at, 3)
+            }
+
+        if granted < wanted:
+            logging.info(f"Granted {granted}/{wanted} threads to {label}, core budget nearly used")
+        try:
+            yield granted
+        finally:
+            with self._condition:
+                self.in_use -= granted
+                self._allocations.pop(allocation_id, None)
+                self._condition.notify_all()
+
+    def get_allocations(self):
+        """Report the core budget and every running reservation."""
+        with self._condition:
+            now = time.time()
+            return {
+                'total_cores': self.total_cores,
+                'threads_per_encode': self.threads_per_encode,
+                'in_use': self.in_use,
+                'available': self.total_cores - self.in_use,
+                'waiting': self.waiting,
+                'allocations': [
+                    {**allocation, 'running_seconds': round(now - allocation['started'], 1)}
+                    for allocation in self._allocations.values()
+                ]
+            }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_resource_scheduler():
+    """Return the shared resource scheduler."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = ResourceScheduler()
+        return _scheduler
@@ -0,0 +1,144 @@
+import struct
+
+import pytest
+
+from audio_headers import (read_wav_info, read_mp3_info, read_ogg_info, probe_audio_header_metadata,
+                           AudioHeaderError)
+
+# MPEG-1 Layer III, 128 kbps, 44.1 kHz, stereo
+MP3_FRAME_HEADER = b'\xff\xfb\x90\x00'
+MP3_FRAME_LENGTH = 417
+
+
+def write(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+def wav(sample_rate=44100, channels=2, data_size=44100 * 4, declared_size=None, with_data=True):
+    block_align = channels * 2
+    fmt = struct.pack('<HHIIHH', 1, channels, sample_rate, sample_rate * block_align, block_align, 16)
+    chunks = b'fmt ' + struct.pack('<I', len(fmt)) + fmt
+    if with_data:
+        chunks += b'data' + struct.pack('<I', data_size if declared_size is None else declared_size) + b'\0' * data_size
+    return b'RIFF' + struct.pack('<I', 4 + len(chunks)) + b'WAVE' + chunks
+
+
+def mp3_frame(body=b''):
+    return MP3_FRAME_HEADER + body + b'\0' * (MP3_FRAME_LENGTH - 4 - len(body))
+
+
+def id3_tag(size=20):
+    return b'ID3\x04\x00\x00' + bytes([0, 0, 0, size]) + b'\0' * size
+
+
+def ogg_page(granule, body, serial=1234, header_type=0):
+    segments = [255] * (len(body) // 255) + [len(body) % 255]
+    return (b'OggS\x00' + bytes([header_type]) + struct.pack('<qIII', granule, serial, 0, 0)
+            + bytes([len(segments)]) + bytes(segments) + body)
+
+
+def vorbis_id_header(channels=2, sample_rate=44100):
+    return b'\x01vorbis' + struct.pack('<IBI', 0, channels, sample_rate) + b'\0' * 13
+
+
+def opus_head(channels=2, pre_skip=312, sample_rate=48000):
+    return b'OpusHead' + struct.pack('<BBHIhB', 1, channels, pre_skip, sample_rate, 0, 0)
+
+
+def test_wav_duration(tmp_path):
+    info = read_wav_info(write(tmp_path, 'a.wav', wav()))
+    assert info == {'duration': 1.0, 'sample_rate': 44100, 'channels': 2, 'codec': 'pcm'}
+
+
+def test_wav_oversized_data_chunk_is_clamped(tmp_path):
+    info = read_wav_info(write(tmp_path, 'a.wav', wav(data_size=44100 * 2, declared_size=0xFFFFFFFF)))
+    assert info['duration'] == 0.5
+
+
+def test_wav_without_data_chunk(tmp_path):
+    with pytest.raises(AudioHeaderError):
+        read_wav_info(write(tmp_path, 'a.wav', wav(with_data=False)))
+
+
+def test_wav_truncated_header(tmp_path):
+    path = write(tmp_path, 'a.wav', wav()[:30])
+    with pytest.raises(AudioHeaderError):
+        probe_audio_header_metadata(path)
+
+
+def test_wav_not_riff(tmp_path):
+    with pytest.raises(AudioHeaderError):
+        read_wav_info(write(tmp_path, 'a.wav', b'JUNK' + wav()[4:]))
+
+
+def test_mp3_cbr_duration(tmp_path):
+    frames = 40
+    info = read_mp3_info(write(tmp_path, 'a.mp3', id3_tag() + mp3_frame() * frames))
+    assert info['duration'] == pytest.approx(frames * MP3_FRAME_LENGTH * 8 / 128000)
+    assert (info['sample_rate'], info['channels'], info['codec']) == (44100, 2, 'mp3')
+
+
+def test_mp3_xing_frame_count(tmp_path):
+    # Xing tag follows the 32-byte side information of a stereo MPEG-1 frame
+    xing = b'\0' * 32 + b'Xing' + struct.pack('>II', 1, 1000)
+    info = read_mp3_info(write(tmp_path, 'a.mp3', mp3_frame(xing) + mp3_frame() * 3))
+    assert info['duration'] == pytest.approx(1000 * 1152 / 44100)
+
+
+def test_mp3_ignores_trailing_id3v1_tag(tmp_path):
+    data = mp3_frame() * 40
+    with_tag = read_mp3_info(write(tmp_path, 'a.mp3', data + b'TAG' + b'\0' * 125))
+    without_tag = read_mp3_info(write(tmp_path, 'b.mp3', data))
+    assert with_tag['duration'] == pytest.approx(without_tag['duration'])
+
+
+def test_mp3_without_frames(tmp_path):
+    with pytest.raises(AudioHeaderError):
+        read_mp3_info(write(tmp_path, 'a.mp3', id3_tag() + b'\x00\x11' * 500))
+
+
+def test_mp3_truncated_xing_header(tmp_path):
+    path = write(tmp_path, 'a.mp3', MP3_FRAME_HEADER + b'\0' * 32 + b'Xing' + b'\x00\x00')
+    with pytest.raises(AudioHeaderError):
+        probe_audio_header_metadata(path)
+
+
+def test_ogg_vorbis_duration(tmp_path):
+    data = ogg_page(0, vorbis_id_header(), header_type=2) + ogg_page(44100, b'\0' * 300) + ogg_page(88200, b'\0' * 10)
+    info = read_ogg_info(write(tmp_path, 'a.ogg', data))
+    assert info == {'duration': 2.0, 'sample_rate': 44100, 'channels': 2, 'codec': 'vorbis'}
+
+
+def test_ogg_opus_subtracts_pre_skip(tmp_path):
+    data = ogg_page(0, opus_head(), header_type=2) + ogg_page(48000 * 3 + 312, b'\0' * 10)
+    info = read_ogg_info(write(tmp_path, 'a.opus', data))
+    assert (info['duration'], info['codec']) == (3.0, 'opus')
+
+
+def test_ogg_ignores_pages_of_other_streams(tmp_path):
+    data = (ogg_page(0, vorbis_id_header(), header_type=2) + ogg_page(88200, b'\0' * 10)
+            + ogg_page(999999, b'\0' * 10, serial=42))
+    assert read_ogg_info(write(tmp_path, 'a.ogg', data))['duration'] == 2.0
+
+
+def test_ogg_unsupported_codec(tmp_path):
+    with pytest.raises(AudioHeaderError):
+        read_ogg_info(write(tmp_path, 'a.ogg', ogg_page(0, b'\x80theora' + b'\0' * 20)))
+
+
+def test_ogg_truncated_first_page(tmp_path):
+    with pytest.raises(AudioHeaderError):
+        read_ogg_info(write(tmp_path, 'a.ogg', ogg_page(0, vorbis_id_header())[:20]))
+
+
+def test_ogg_without_audio_pages_has_no_duration(tmp_path):
+    path = write(tmp_path, 'a.ogg', ogg_page(0, vorbis_id_header(), header_type=2))
+    with pytest.raises(AudioHeaderError):
+        probe_audio_header_metadata(path)
+
+
+def test_probe_rejects_unknown_extension(tmp_path):
+    with pytest.raises(AudioHeaderError):
+        probe_audio_header_metadata(write(tmp_path, 'a.flac', b'fLaC'))
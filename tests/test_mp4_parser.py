@@ -0,0 +1,164 @@
+import struct
+
+import pytest
+
+from mp4_parser import read_mp4_info, probe_mp4_metadata, Mp4ParseError, Mp4FragmentedError
+
+
+def box(box_type, payload=b''):
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+
+def full_box(box_type, payload, version=0):
+    return box(box_type, bytes([version, 0, 0, 0]) + payload)
+
+
+def avcc(profile=100, level=31, sps=b'\x67\x64\x00\x1f\xac', extension=None):
+    record = bytes([1, profile, 0, level, 0xFF, 0xE1]) + struct.pack('>H', len(sps)) + sps
+    record += b'\x01' + struct.pack('>H', 2) + b'\x68\xee'
+    if extension:
+        chroma_format, bit_depth = extension
+        record += bytes([0xFC | chroma_format, 0xF8 | (bit_depth - 8), 0xF8 | (bit_depth - 8), 0])
+    return box(b'avcC', record)
+
+
+def video_trak(width=1280, height=720, timescale=30000, stts=((90, 1000),), stss=(1, 31, 61),
+               children=None, stss_box=None):
+    if children is None:
+        children = avcc(extension=(1, 8))
+    entry = box(b'avc1', b'\0' * 24 + struct.pack('>HH', width, height) + b'\0' * 50 + children)
+    stbl = full_box(b'stsd', struct.pack('>I', 1) + entry)
+    stbl += full_box(b'stts', struct.pack('>I', len(stts)) + b''.join(struct.pack('>II', *e) for e in stts))
+    if stss_box is not None:
+        stbl += stss_box
+    elif stss is not None:
+        stbl += full_box(b'stss', struct.pack('>I', len(stss)) + b''.join(struct.pack('>I', s) for s in stss))
+    duration = sum(count * delta for count, delta in stts)
+    mdia = full_box(b'mdhd', struct.pack('>IIII', 0, 0, timescale, duration) + b'\0' * 4)
+    mdia += full_box(b'hdlr', b'\0' * 4 + b'vide' + b'\0' * 13)
+    mdia += box(b'minf', box(b'stbl', stbl))
+    tkhd = full_box(b'tkhd', b'\0' * 72 + struct.pack('>II', width << 16, height << 16))
+    return box(b'trak', tkhd + box(b'mdia', mdia))
+
+
+def audio_trak(channels=2, sample_rate=44100):
+    entry = box(b'mp4a', b'\0' * 16 + struct.pack('>H', channels) + b'\0' * 6 + struct.pack('>I', sample_rate << 16))
+    stbl = full_box(b'stsd', struct.pack('>I', 1) + entry)
+    mdia = full_box(b'mdhd', struct.pack('>IIII', 0, 0, sample_rate, sample_rate * 3) + b'\0' * 4)
+    mdia += full_box(b'hdlr', b'\0' * 4 + b'soun' + b'\0' * 13)
+    mdia += box(b'minf', box(b'stbl', stbl))
+    return box(b'trak', box(b'mdia', mdia))
+
+
+def moov(*traks, timescale=1000, duration=3000, extra=b''):
+    mvhd = full_box(b'mvhd', struct.pack('>IIII', 0, 0, timescale, duration) + b'\0' * 80)
+    return box(b'moov', mvhd + b''.join(traks) + extra)
+
+
+def write_mp4(tmp_path, moov_box, after=b''):
+    path = tmp_path / 'clip.mp4'
+    path.write_bytes(box(b'ftyp', b'isom\0\0\0\0') + box(b'mdat', b'\0' * 32) + moov_box + after)
+    return str(path)
+
+
+def test_reads_video_and_audio_tracks(tmp_path):
+    path = write_mp4(tmp_path, moov(video_trak(children=avcc(extension=(1, 8)) + box(b'pasp', struct.pack('>II', 1, 1))),
+                                    audio_trak()))
+    info = read_mp4_info(path)
+    assert info['duration'] == 3.0
+    assert info['codec'] == 'h264'
+    assert (info['width'], info['height']) == (1280, 720)
+    assert info['fps'] == 30.0
+    assert (info['profile'], info['level'], info['chroma_format'], info['bit_depth']) == (100, 31, 1, 8)
+    assert info['sar'] == (1, 1)
+    assert (info['audio_codec'], info['channels'], info['sample_rate']) == ('aac', 2, 44100)
+
+
+def test_probe_metadata_requires_video(tmp_path):
+    path = write_mp4(tmp_path, moov(video_trak(), audio_trak()))
+    assert probe_mp4_metadata(path)['has_audio'] is True
+
+    audio_only = write_mp4(tmp_path, moov(audio_trak()))
+    with pytest.raises(Mp4ParseError):
+        probe_mp4_metadata(audio_only)
+
+
+def test_high_profile_format_read_from_sps_without_extension(tmp_path):
+    # seq_parameter_set_id=0, chroma_format_idc=1, 10-bit luma and chroma
+    sps = b'\x67\x64\x00\x1f' + bytes([0b10100110, 0b11000000])
+    path = write_mp4(tmp_path, moov(video_trak(children=avcc(sps=sps))))
+    info = read_mp4_info(path)
+    assert (info['chroma_format'], info['bit_depth']) == (1, 10)
+
+
+def test_high_profile_extension_reports_chroma_and_bit_depth(tmp_path):
+    path = write_mp4(tmp_path, moov(video_trak(children=avcc(extension=(2, 10)))))
+    info = read_mp4_info(path)
+    assert (info['chroma_format'], info['bit_depth']) == (2, 10)
+
+
+def test_main_profile_is_8bit_420(tmp_path):
+    path = write_mp4(tmp_path, moov(video_trak(children=avcc(profile=77, sps=b'\x67\x4d\x00\x1f'))))
+    info = read_mp4_info(path)
+    assert (info['profile'], info['chroma_format'], info['bit_depth']) == (77, 1, 8)
+
+
+def test_keyframe_times(tmp_path):
+    path = write_mp4(tmp_path, moov(video_trak(stts=((60, 1000), (30, 1000)), stss=(1, 31, 61))))
+    assert read_mp4_info(path, include_keyframes=True)['keyframes'] == [0.0, 1.0, 2.0]
+
+
+def test_every_sample_is_a_keyframe_without_stss(tmp_path):
+    path = write_mp4(tmp_path, moov(video_trak(stts=((3, 1000),), stss=None)))
+    assert len(read_mp4_info(path, include_keyframes=True)['keyframes']) == 3
+
+
+def test_malformed_stss_raises_parse_error(tmp_path):
+    stss_box = full_box(b'stss', struct.pack('>I', 1000) + struct.pack('>I', 1))
+    path = write_mp4(tmp_path, moov(video_trak(stss_box=stss_box)))
+    # The stss table is only decoded when keyframes are requested
+    assert 'keyframes' not in read_mp4_info(path)
+    with pytest.raises(Mp4ParseError):
+        read_mp4_info(path, include_keyframes=True)
+
+
+def test_fragmented_files(tmp_path):
+    with pytest.raises(Mp4FragmentedError):
+        read_mp4_info(write_mp4(tmp_path, moov(video_trak(), extra=box(b'mvex', box(b'trex')))))
+    with pytest.raises(Mp4FragmentedError):
+        read_mp4_info(write_mp4(tmp_path, moov(video_trak()), after=box(b'moof', b'\0' * 8)))
+
+
+def test_truncated_moov(tmp_path):
+    data = box(b'ftyp', b'isom\0\0\0\0') + moov(video_trak())
+    path = tmp_path / 'truncated.mp4'
+    path.write_bytes(data[:len(data) // 2])
+    with pytest.raises(Mp4ParseError, match='Truncated moov'):
+        read_mp4_info(str(path))
+
+
+def test_missing_moov(tmp_path):
+    path = tmp_path / 'no_moov.mp4'
+    path.write_bytes(box(b'ftyp', b'isom\0\0\0\0') + box(b'mdat', b'\0' * 32))
+    with pytest.raises(Mp4ParseError, match='No moov'):
+        read_mp4_info(str(path))
+
+
+def test_child_box_overrunning_moov(tmp_path):
+    bad_trak = struct.pack('>I4s', 4096, b'trak') + b'\0' * 16
+    with pytest.raises(Mp4ParseError):
+        read_mp4_info(write_mp4(tmp_path, moov(extra=bad_trak)))
+
+
+def test_corrupt_sample_table(tmp_path):
+    trak = video_trak(stts=((90, 1000),))
+    # Claim far more stts entries than the box holds
+    corrupt = trak.replace(b'stts\0\0\0\0' + struct.pack('>I', 1), b'stts\0\0\0\0' + struct.pack('>I', 5000))
+    assert corrupt != trak
+    with pytest.raises(Mp4ParseError):
+        read_mp4_info(write_mp4(tmp_path, moov(corrupt)))
+
+
+def test_truncated_avcc(tmp_path):
+    with pytest.raises(Mp4ParseError):
+        read_mp4_info(write_mp4(tmp_path, moov(video_trak(children=box(b'avcC', b'\x01\x64')))))
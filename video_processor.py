@@ -4,7 +4,8 @@ import uuid
 import logging
 import shutil
 import sys
-from moviepy.editor import VideoFileClip
+import threading
+import concurrent.futures
 
 # Debug: Print current Python path
 logging.info(f"Current Python path: {sys.path}")
@@ -17,56 +18,153 @@ logging.info(f"merge_videos.py exists in parent: {os.path.exists(os.path.join(os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 logging.info(f"Python path after adding parent: {sys.path}")
 
-from merge_videos import merge_videos_with_trims
+from config import *
+from merge_videos import submit_merge_segments, finish_merge
+from resource_scheduler import get_resource_scheduler
 from merge_video_audio import process_video_audio, start_processing_thread
+from media_scanner import MediaScanner
+from folder_watcher import SCAN_EXTENSIONS
 
 class VideoProcessor:
     def __init__(self, temp_folder, output_folder):
         self.temp_folder = temp_folder
         self.output_folder = output_folder
+        self.scanner = MediaScanner()
+        self.watcher = None
         os.makedirs(temp_folder, exist_ok=True)
         os.makedirs(output_folder, exist_ok=True)
     
-    def scan_folder(self, folder_path):
+    def scan_folder(self, folder_path, stats=None):
         """Scan folder for videos and return metadata"""
-        videos = []
+        return self._scan_media_folder(folder_path, 'video', stats)
+    
+    def scan_audio_folder(self, folder_path, stats=None):
+        """Scan folder for audio files and return metadata"""
+        return self._scan_media_folder(folder_path, 'audio', stats)
+    
+    def _scan_media_folder(self, folder_path, kind, stats=None):
+        """Scan folder for media files, probing only files missing from the catalog; counts are added to stats"""
         if not os.path.exists(folder_path):
             raise ValueError(f"Folder does not exist: {folder_path}")
-            
-        for filename in os.listdir(folder_path):
-            if filename.lower().endswith('.mp4'):
-                file_path = os.path.join(folder_path, filename)
-                try:
-                    with VideoFileClip(file_path) as clip:
-                        videos.append({
-                            'name': filename,
-                            'path': file_path,
-                            'duration': clip.duration
-                        })
-                except Exception as e:
-                    logging.warning(f"Failed to read {filename}: {e}")
-        return videos
+        
+        # Configured watch folders are served from the watcher's in-memory snapshot
+        snapshot = self._watched_snapshot(folder_path, kind)
+        if snapshot is not None:
+            if stats is not None:
+                stats['files'] += len(snapshot)
+                stats['cached'] += len(snapshot)
+            return list(snapshot)
+        
+        extensions = SCAN_EXTENSIONS[kind]
+        filenames = [f for f in os.listdir(folder_path) if f.lower().endswith(extensions)]
+        paths = [os.path.join(folder_path, f) for f in filenames]
+        results = self.scanner.scan(paths, kind, stats)
+        
+        entries = []
+        for filename, file_path in zip(filenames, paths):
+            if file_path in results:
+                entries.append({
+                    'name': filename,
+                    'path': file_path,
+                    'duration': results[file_path]['duration']
+                })
+        return entries
     
-    def scan_audio_folder(self, folder_path):
-        """Scan folder for audio files and return metadata"""
-        audios = []
+    def list_media_paths(self, folder_path, kind='video', recursive=False):
+        """List media files in a folder (optionally including subfolders) in stable sorted order"""
         if not os.path.exists(folder_path):
             raise ValueError(f"Folder does not exist: {folder_path}")
-            
-        for filename in os.listdir(folder_path):
-            if filename.lower().endswith(('.mp3', '.ogg', '.wav')):
-                file_path = os.path.join(folder_path, filename)
-                try:
-                    from moviepy.editor import AudioFileClip
-                    with AudioFileClip(file_path) as clip:
-                        audios.append({
-                            'name': filename,
-                            'path': file_path,
-                            'duration': clip.duration
-                        })
-                except Exception as e:
-                    logging.warning(f"Failed to read audio {filename}: {e}")
-        return audios
+        
+        extensions = SCAN_EXTENSIONS[kind]
+        if not recursive:
+            return sorted(os.path.join(folder_path, f) for f in os.listdir(folder_path) if f.lower().endswith(extensions))
+        
+        paths = []
+        for dirpath, dirnames, filenames in os.walk(folder_path):
+            dirnames.sort()
+            paths.extend(os.path.join(dirpath, f) for f in sorted(filenames) if f.lower().endswith(extensions))
+        return paths
+    
+    def _watched_snapshot(self, folder_path, kind):
+        """Return the watcher's snapshot if the folder is watched, otherwise None"""
+        return self.watcher.snapshot(folder_path, kind) if self.watcher else None
+    
+    def _make_entry(self, folder_path, file_path, metadata):
+        return {
+            'name': os.path.relpath(file_path, folder_path),
+            'path': file_path,
+            'duration': metadata['duration']
+        }
+    
+    def iter_scan_folder(self, folder_path, kind='video', recursive=False, min_duration=None, max_duration=None, stats=None):
+        """Yield entries as soon as each file is probed, in completion order; counts are added to stats"""
+        def wanted(duration):
+            return (min_duration is None or duration >= min_duration) and (max_duration is None or duration <= max_duration)
+        
+        if not recursive and self._watched_snapshot(folder_path, kind) is not None:
+            for entry in self._scan_media_folder(folder_path, kind, stats):
+                if wanted(entry['duration']):
+                    yield entry
+            return
+        
+        paths = self.list_media_paths(folder_path, kind, recursive)
+        for file_path, metadata in self.scanner.iter_scan(paths, kind, stats):
+            if wanted(metadata['duration']):
+                yield self._make_entry(folder_path, file_path, metadata)
+    
+    def scan_folder_page(self, folder_path, kind='video', offset=0, limit=None, recursive=False, min_duration=None, max_duration=None):
+        """
+        Return one page of entries in stable path order, with this call's scan_stats.
+        Without duration filters only the requested page is probed; with filters
+        files are probed in chunks until the page is filled.
+        """
+        stats = self.scanner.new_stats(kind)
+        if not recursive and self._watched_snapshot(folder_path, kind) is not None:
+            entries = list(self.iter_scan_folder(folder_path, kind, False, min_duration, max_duration, stats))
+            entries.sort(key=lambda e: e['path'])
+            page = entries[offset:offset + limit] if limit is not None else entries[offset:]
+            next_offset = offset + len(page) if offset + len(page) < len(entries) else None
+            return {'entries': page, 'total': len(entries), 'next_offset': next_offset, 'scan_stats': stats}
+        
+        paths = self.list_media_paths(folder_path, kind, recursive)
+        filtered = min_duration is not None or max_duration is not None
+        
+        if not filtered:
+            page_paths = paths[offset:offset + limit] if limit is not None else paths[offset:]
+            results = self.scanner.scan(page_paths, kind, stats)
+            page = [self._make_entry(folder_path, p, results[p]) for p in page_paths if p in results]
+            end = offset + len(page_paths)
+            return {'entries': page, 'total': len(paths), 'next_offset': end if end < len(paths) else None, 'scan_stats': stats}
+        
+        page = []
+        matched = 0
+        position = 0
+        chunk_size = max(SCAN_PAGE_CHUNK_SIZE, limit or 0)
+        while position < len(paths) and (limit is None or len(page) < limit):
+            chunk = paths[position:position + chunk_size]
+            results = self.scanner.scan(chunk, kind, stats)
+            for file_path in chunk:
+                position += 1
+                metadata = results.get(file_path)
+                if not metadata:
+                    continue
+                duration = metadata['duration']
+                if (min_duration is not None and duration < min_duration) or (max_duration is not None and duration > max_duration):
+                    continue
+                matched += 1
+                if matched > offset:
+                    page.append(self._make_entry(folder_path, file_path, metadata))
+                    if limit is not None and len(page) >= limit:
+                        break
+        
+        # The total number of matches is only known once every file has been checked
+        exhausted = position >= len(paths)
+        return {
+            'entries': page,
+            'total': matched if exhausted else None,
+            'next_offset': None if exhausted else offset + len(page),
+            'scan_stats': stats
+        }
     
     def select_videos(self, videos, count):
         """Randomly select videos"""
@@ -74,8 +172,65 @@ class VideoProcessor:
             return videos
         return random.sample(videos, count)
     
-    def process_batch(self, folder_path, video_count, video_duration, output_count, progress_callback=None, output_folder=None, video_trim_mode='fixed'):
-        """Process batch of videos with optimized processing"""
+    def plan_output(self, all_videos, video_count, video_duration, video_trim_mode='fixed'):
+        """Select and trim the segments of one output; returns (batch_folder, files, trims)"""
+        # Select random videos
+        selected_videos = self.select_videos(all_videos, video_count)
+        
+        # Shuffle the selected videos for random order
+        random.shuffle(selected_videos)
+        
+        # Create unique batch folder
+        batch_folder = os.path.join(self.temp_folder, f"batch_{uuid.uuid4()}")
+        os.makedirs(batch_folder, exist_ok=True)
+        
+        # Prepare files for merging
+        files = []
+        trims = {}
+        
+        for video in selected_videos:
+            # Copy file to temp folder with UUID name
+            temp_filename = f"{uuid.uuid4()}.mp4"
+            temp_path = os.path.join(batch_folder, temp_filename)
+            
+            # Create symlink or copy file
+            if hasattr(os, 'symlink'):
+                try:
+                    os.symlink(video['path'], temp_path)
+                except (OSError, NotImplementedError):
+                    # Fallback to copy if symlink fails
+                    shutil.copy2(video['path'], temp_path)
+            else:
+                shutil.copy2(video['path'], temp_path)
+            
+            files.append(temp_filename)
+            
+            # Set trim parameters based on trim mode
+            if video_trim_mode == 'fixed':
+                # Fixed mode: start from 0, end at video_duration or video duration (whichever is smaller)
+                end_time = min(video_duration, video['duration'])
+                trims[temp_filename] = {'start': 0, 'end': end_time}
+            else:  # random mode
+                # Random mode: randomly select start position
+                if video['duration'] <= video_duration:
+                    # Video is shorter than requested duration, use the whole video
+                    trims[temp_filename] = {'start': 0, 'end': video['duration']}
+                else:
+                    # Video is longer than requested duration, randomly select start position
+                    max_start_time = video['duration'] - video_duration
+                    start_time = random.uniform(0, max_start_time)
+                    end_time = start_time + video_duration
+                    trims[temp_filename] = {'start': start_time, 'end': end_time}
+        
+        return batch_folder, files, trims
+    
+    def process_batch(self, folder_path, video_count, video_duration, output_count, progress_callback=None, output_folder=None, video_trim_mode='fixed', merge_mode=None, stats=None):
+        """
+        Process batch of videos with optimized processing; segment paths are counted in stats.
+        All outputs are planned up front and their segments queued on one shared pool, so later
+        outputs normalize while earlier ones run their final encode. Up to MAX_CONCURRENT_OUTPUTS
+        final encodes run at once, each within the shared core budget.
+        """
         if progress_callback:
             progress_callback(0, "Scanning for videos...")
         
@@ -91,98 +246,119 @@ class VideoProcessor:
         if not all_videos:
             raise ValueError("No videos found in the specified folder")
         
-        outputs = []
-        for i in range(output_count):
-            # Calculate overall progress
-            overall_progress = (i / output_count) * 100
-            
-            if progress_callback:
-                progress_callback(overall_progress, f"Processing output {i+1} of {output_count}...")
-            
-            # Select random videos
-            selected_videos = self.select_videos(all_videos, video_count)
-            
-            # Shuffle the selected videos for random order
-            random.shuffle(selected_videos)
-            
-            # Create unique batch folder
-            batch_folder = os.path.join(self.temp_folder, f"batch_{uuid.uuid4()}")
-            os.makedirs(batch_folder, exist_ok=True)
-            
-            if progress_callback:
-                progress_callback(overall_progress, "Preparing videos for merging...")
-            
-            # Prepare files for merging
-            files = []
-            trims = {}
-            
-            for video in selected_videos:
-                # Copy file to temp folder with UUID name
-                temp_filename = f"{uuid.uuid4()}.mp4"
-                temp_path = os.path.join(batch_folder, temp_filename)
-                
-                # Create symlink or copy file
-                if hasattr(os, 'symlink'):
-                    try:
-                        os.symlink(video['path'], temp_path)
-                    except (OSError, NotImplementedError):
-                        # Fallback to copy if symlink fails
-                        shutil.copy2(video['path'], temp_path)
-                else:
-                    shutil.copy2(video['path'], temp_path)
-                
-                files.append(temp_filename)
-                
-                # Set trim parameters based on trim mode
-                if video_trim_mode == 'fixed':
-                    # Fixed mode: start from 0, end at video_duration or video duration (whichever is smaller)
-                    end_time = min(video_duration, video['duration'])
-                    trims[temp_filename] = {'start': 0, 'end': end_time}
-                else:  # random mode
-                    # Random mode: randomly select start position
-                    if video['duration'] <= video_duration:
-                        # Video is shorter than requested duration, use the whole video
-                        trims[temp_filename] = {'start': 0, 'end': video['duration']}
-                    else:
-                        # Video is longer than requested duration, randomly select start position
-                        max_start_time = video['duration'] - video_duration
-                        start_time = random.uniform(0, max_start_time)
-                        end_time = start_time + video_duration
-                        trims[temp_filename] = {'start': start_time, 'end': end_time}
-            
-            # Merge videos with optimized processing
-            final_output_path = os.path.join(output_folder, f"output_{i+1}_{uuid.uuid4()}.mp4")
-            try:
+        use_mezzanine = ENABLE_MEZZANINE_CACHE and video_trim_mode == 'random'
+        segment_workers = get_resource_scheduler().pool_size(MAX_WORKERS)
+        output_workers = max(1, min(MAX_CONCURRENT_OUTPUTS, output_count))
+        batch_folders = []
+        output_futures = {}
+        outputs = [None] * output_count
+        errors = []
+        output_progress = [0] * output_count
+        progress_lock = threading.Lock()
+        
+        def report(index, progress, message):
+            with progress_lock:
+                if index is not None:
+                    output_progress[index] = max(output_progress[index], progress)
                 if progress_callback:
-                    progress_callback(overall_progress, "Merging videos with optimized processing...")
-                
-                # The merge_videos_with_trims function creates a file named 'merged.mp4'
-                merge_videos_with_trims(files, trims, batch_folder, output_folder)
-                
+                    progress_callback(sum(output_progress) / output_count, message)
+        
+        def output_reporter(index):
+            def output_report(progress, message):
+                report(index, progress, f"Output {index+1}: {message}")
+            return output_report
+        
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=segment_workers) as segment_executor, \
+                    concurrent.futures.ThreadPoolExecutor(max_workers=output_workers) as output_executor:
                 if progress_callback:
-                    progress_callback(overall_progress, "Finalizing output...")
+                    progress_callback(0, f"Planning {output_count} outputs...")
                 
-                # Find the actual output file (should be 'merged.mp4')
-                actual_output_path = os.path.join(output_folder, 'merged.mp4')
+                for i in range(output_count):
+                    batch_folder, files, trims = self.plan_output(all_videos, video_count, video_duration, video_trim_mode)
+                    batch_folders.append(batch_folder)
+                    try:
+                        plan = submit_merge_segments(
+                            segment_executor, files, trims, batch_folder, output_folder, merge_mode,
+                            use_mezzanine=use_mezzanine, stats=stats, report=output_reporter(i)
+                        )
+                    except Exception as e:
+                        errors.append((i, e))
+                        break
+                    
+                    output_filename = f"output_{i+1}_{uuid.uuid4()}.mp4"
+                    future = output_executor.submit(finish_merge, plan, segment_executor, output_filename)
+                    output_futures[future] = i
                 
-                # Rename the output file to our desired name
-                if os.path.exists(actual_output_path):
-                    os.rename(actual_output_path, final_output_path)
-                    outputs.append(os.path.basename(final_output_path))
-                else:
-                    # If the file doesn't exist, check for any .mp4 files in the output folder
-                    mp4_files = [f for f in os.listdir(output_folder) if f.endswith('.mp4')]
-                    if mp4_files:
-                        # Use the most recently created .mp4 file
-                        latest_file = os.path.join(output_folder, mp4_files[0])
-                        os.rename(latest_file, final_output_path)
-                        outputs.append(os.path.basename(final_output_path))
-                    else:
-                        raise FileNotFoundError("No output file was created by the merge operation")
-            finally:
-                # Clean up temp folder
+                report(None, None, "Merging videos with optimized processing...")
+                
+                # Outputs finish in any order; every started merge runs to completion so its leases are released
+                completed = 0
+                for future in concurrent.futures.as_completed(output_futures):
+                    i = output_futures[future]
+                    completed += 1
+                    try:
+                        outputs[i] = os.path.basename(future.result())
+                        logging.info(f"Finished output {i+1} of {output_count}")
+                    except Exception as e:
+                        logging.error(f"Output {i+1} of {output_count} failed: {e}")
+                        errors.append((i, e))
+                    
+                    report(i, 100, f"Finished {completed} of {output_count} outputs")
+        finally:
+            # Clean up temp folders
+            for batch_folder in batch_folders:
                 shutil.rmtree(batch_folder, ignore_errors=True)
         
+        if errors:
+            raise min(errors, key=lambda error: error[0])[1]
+        
+        return outputs
+    
+    def process_pairs(self, pairs, process_pair, progress_callback=None, start=0, span=100):
+        """
+        Run process_pair(video, audio, report) for every pair on a pool bounded by the core budget.
+        report(progress, message) sets that pair's 0-100 share of the overall progress.
+        Returns output filenames in completion order; a failed pair is logged and skipped.
+        """
+        total = len(pairs)
+        if not total:
+            return []
+        
+        workers = get_resource_scheduler().pool_size(min(MAX_WORKERS, total))
+        pair_progress = [0] * total
+        progress_lock = threading.Lock()
+        
+        def report(index, progress, message=None):
+            with progress_lock:
+                pair_progress[index] = max(pair_progress[index], min(progress, 100))
+                if progress_callback:
+                    progress_callback(start + span * sum(pair_progress) / (100 * total), message)
+        
+        def pair_reporter(index, name):
+            def pair_report(progress, message=None):
+                report(index, progress, f"{name}: {message}" if message else None)
+            return pair_report
+        
+        outputs = []
+        logging.info(f"Processing {total} pairs with {workers} workers")
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {}
+            for i, (video, audio) in enumerate(pairs):
+                futures[executor.submit(process_pair, video, audio, pair_reporter(i, video['name']))] = i
+            
+            for future in concurrent.futures.as_completed(futures):
+                i = futures[future]
+                video, audio = pairs[i]
+                try:
+                    output_path = future.result()
+                    # Add output filename to results
+                    outputs.append(os.path.basename(output_path))
+                    report(i, 100, f"Completed: {video['name']} with {audio['name']} ({len(outputs)} of {total})")
+                except Exception as e:
+                    logging.error(f"Error processing {video['name']} with {audio['name']}: {e}")
+                    report(i, 100, f"Error processing {video['name']}: {str(e)}")
+        
         return outputs
     
     def process_video_audio_batch(self, video_folder_path, audio_folder_path, output_folder, progress_callback=None, audio_trim_mode='fixed', audio_selection_mode='unique'):
@@ -214,13 +390,9 @@ class VideoProcessor:
             # For random mode, we'll use the full list for each selection
             available_audios = all_audios
         
-        for i, video in enumerate(all_videos):
-            # Calculate overall progress
-            overall_progress = (i / total_videos) * 100
-            
-            if progress_callback:
-                progress_callback(overall_progress, f"Processing video {i+1} of {total_videos}: {video['name']}...")
-            
+        # Pick every pair's audio up front so the unique rotation does not depend on completion order
+        pairs = []
+        for video in all_videos:
             # Select random audio
             if audio_selection_mode == 'unique':
                 # If we've used all available audios, reset the list
@@ -234,10 +406,12 @@ class VideoProcessor:
             else:
                 # For random mode, just select from all audios
                 selected_audio = random.choice(all_audios)
-            
-            if progress_callback:
-                progress_callback(overall_progress, f"Selected audio: {selected_audio['name']}...")
-            
+            pairs.append((video, selected_audio))
+        
+        if progress_callback:
+            progress_callback(0, f"Processing {total_videos} videos...")
+        
+        def process_pair(video, audio, report):
             # Create unique job ID
             job_id = f"va_{uuid.uuid4()}"
             
@@ -249,25 +423,12 @@ class VideoProcessor:
                 'error': None
             }
             
-            try:
-                # Process video with audio
-                output_path = process_video_audio(
-                    job_id, video['path'], selected_audio['path'], output_folder, processing_status, audio_trim_mode
-                )
-                
-                if progress_callback:
-                    progress_callback(overall_progress, f"Completed: {video['name']} with {selected_audio['name']}")
-                
-                # Add output filename to results
-                output_filename = os.path.basename(output_path)
-                outputs.append(output_filename)
-                
-            except Exception as e:
-                logging.error(f"Error processing {video['name']} with {selected_audio['name']}: {e}")
-                if progress_callback:
-                    progress_callback(overall_progress, f"Error processing {video['name']}: {str(e)}")
-                continue
+            # Process video with audio
+            return process_video_audio(
+                job_id, video['path'], audio['path'], output_folder, processing_status, audio_trim_mode
+            )
         
+        outputs.extend(self.process_pairs(pairs, process_pair, progress_callback))
         return outputs
     
     def process_voice_adder(self, video_path, audio_path, output_folder, progress_callback=None, original_audio_volume=30):
@@ -325,36 +486,14 @@ class VideoProcessor:
         # Import here to avoid issues if module not available
         from merge_video_audio import merge_video_with_voice
         
-        for i in range(num_pairs):
-            # Calculate overall progress
-            overall_progress = 5 + (i / num_pairs) * 90  # 5% to 95%
-            
-            video = all_videos[i]
-            audio = all_audios[i]
-            
-            if progress_callback:
-                progress_callback(overall_progress, f"Processing video {i+1} of {num_pairs}: {video['name']} with {audio['name']}...")
-            
-            try:
-                # Process video with voice audio
-                output_path = merge_video_with_voice(
-                    video['path'], audio['path'], output_folder,
-                    lambda p, msg=None: progress_callback(overall_progress + (p/num_pairs), msg),
-                    original_audio_volume
-                )
-                
-                if progress_callback:
-                    progress_callback(overall_progress + (100/num_pairs), f"Completed: {video['name']} with {audio['name']}")
-                
-                # Add output filename to results
-                output_filename = os.path.basename(output_path)
-                outputs.append(output_filename)
-                
-            except Exception as e:
-                logging.error(f"Error processing {video['name']} with {audio['name']}: {e}")
-                if progress_callback:
-                    progress_callback(overall_progress, f"Error processing {video['name']}: {str(e)}")
-                continue
+        def process_pair(video, audio, report):
+            # Process video with voice audio
+            return merge_video_with_voice(
+                video['path'], audio['path'], output_folder, report, original_audio_volume
+            )
+        
+        pairs = list(zip(all_videos[:num_pairs], all_audios[:num_pairs]))
+        outputs.extend(self.process_pairs(pairs, process_pair, progress_callback, start=5, span=90))
         
         if progress_callback:
             progress_callback(100, f"Batch processing completed! Processed {len(outputs)} of {num_pairs} pairs.")